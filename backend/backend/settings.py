@@ -120,6 +120,71 @@ DATABASES = {
 }
 
 
+# Cache
+# Per-user response cache (personalFinanceDashboard.utils.response_cache). Locmem evicts least recently
+# used entries past MAX_ENTRIES; use a shared backend such as redis when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Exchange rates (personalFinanceDashboard.utils.exchange_rates)
+# 'http' queries exchangerate-api, 'local' reads EXCHANGE_RATE_FILE for offline use and tests
+EXCHANGE_RATE_PROVIDER = env('EXCHANGE_RATE_PROVIDER', default='http')
+EXCHANGE_RATE_API_KEY = env('EXCHANGE_RATE_API_KEY', default='')
+EXCHANGE_RATE_FILE = env('EXCHANGE_RATE_FILE', default=str(BASE_DIR / 'personalFinanceDashboard' / 'data' / 'exchange_rates.json'))
+# Seconds a fetched set of rates is served before the provider is asked again
+EXCHANGE_RATE_TTL = 60 * 60
+# (connect, read) timeout of provider requests in seconds
+EXCHANGE_RATE_TIMEOUT = (3.05, 10)
+# Seconds the outcome of a failed provider request (stale rates or the error) is served before retrying
+EXCHANGE_RATE_FAILURE_BACKOFF = 60
+# Currency that latest and historical rates are fetched and stored against, other pairs are crossed through it
+EXCHANGE_RATE_PIVOT = 'USD'
+
+# Plaid (personalFinanceDashboard.utils.plaid_client), the client is built on the first Plaid call
+PLAID_CLIENT_ID = env('CLIENT_ID', default='')
+PLAID_SECRET = env('SECRET', default='')
+# 'sandbox' or 'production'; PLAID_HOST overrides it, e.g. a local stub server
+PLAID_ENV = env('PLAID_ENV', default='sandbox')
+PLAID_HOST = env('PLAID_HOST', default='')
+# Pooled connections per process and (connect, read) timeout of Plaid requests in seconds
+PLAID_POOL_SIZE = env.int('PLAID_POOL_SIZE', default=10)
+PLAID_TIMEOUT = (3.05, 30)
+# Concurrent /transactions/get pages of a full-history backfill, within PLAID_POOL_SIZE
+PLAID_BACKFILL_WORKERS = env.int('PLAID_BACKFILL_WORKERS', default=4)
+# Seconds a stored account balance is served before a refresh job is queued
+PLAID_BALANCE_TTL = env.int('PLAID_BALANCE_TTL', default=15 * 60)
+
+# Background jobs (personalFinanceDashboard.utils.jobs), run by `manage.py runworker`
+# Jobs run at the same time per worker process, and seconds between polls of an empty queue
+JOB_CONCURRENCY = env.int('JOB_CONCURRENCY', default=2)
+JOB_POLL_INTERVAL = 1.0
+# Seconds a job may run before it is assumed lost and queued again, and finished jobs are kept
+JOB_LEASE = 10 * 60
+JOB_RETENTION = 7 * 24 * 60 * 60
+# Jobs enqueued every `every` seconds, aligned on the epoch
+JOB_PERIODIC = {
+    'plaid-sync': {'task': 'plaid.sync_all', 'every': 6 * 60 * 60},
+    'exchange-rates': {'task': 'exchange_rates.refresh', 'every': 60 * 60},
+    # Catches emails whose delivery job was lost, and prunes sent ones
+    'outbox': {'task': 'outbox.send', 'every': 5 * 60},
+}
+# Email outbox (personalFinanceDashboard.utils.outbox): messages per SMTP connection, delivery
+# attempts before an email is marked failed, seconds a sender has to deliver a claimed batch, and
+# seconds sent emails are kept
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_LEASE = 15 * 60
+OUTBOX_RETENTION = 24 * 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -144,6 +209,8 @@ EMAIL_HOST = 'sandbox.smtp.mailtrap.io'
 EMAIL_HOST_USER = env('EMAIL_HOST_USERNAME')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = '2525'
+# Seconds before a stalled SMTP connection fails, the outbox retries it later
+EMAIL_TIMEOUT = 10
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -1,9 +1,16 @@
 from django.contrib import admin
-from .models import Transaction, UserSettings, Investment, EmailVerification
+from .models import Transaction, UserSettings, Investment, EmailVerification, MonthlySummary, BudgetAlert, ExchangeRate, PlaidItem, AccountBalanceSnapshot, Job, OutboxEmail
 
 # Transaction model
 admin.site.register(Transaction)
 # User profile settings (ex. budget) model
 admin.site.register(UserSettings)
 admin.site.register(Investment)
-admin.site.register(EmailVerification)
\ No newline at end of file
+admin.site.register(EmailVerification)
+admin.site.register(MonthlySummary)
+admin.site.register(BudgetAlert)
+admin.site.register(ExchangeRate)
+admin.site.register(PlaidItem)
+admin.site.register(AccountBalanceSnapshot)
+admin.site.register(Job)
+admin.site.register(OutboxEmail)
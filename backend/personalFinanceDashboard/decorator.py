@@ -1,6 +1,10 @@
 from functools import wraps
 from rest_framework.response import Response
 from rest_framework import status
+from django.views.decorators.http import condition
+from django.utils import timezone
+from .models import UserDataVersion
+from .utils import response_cache
 
 def check_authentication(view_func):
     @wraps(view_func)
@@ -11,4 +15,56 @@ def check_authentication(view_func):
                 'is_authenticated': False
             }, status=status.HTTP_401_UNAUTHORIZED)
         return view_func(request, *args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def _data_version(request):
+    # Shared by the ETag and Last-Modified checks, cached under the user's cache generation
+    # which moves on the same writes as UserDataVersion, so repeat polls skip the database
+    if not hasattr(request, '_data_version'):
+        key = response_cache.user_key(request.user.id, 'data-version')
+        data_version = response_cache.lookup(key)
+        if data_version is None:
+            data_version = UserDataVersion.objects.filter(user_id=request.user.id).values_list('version', 'modified_at').first()
+            if data_version is not None:
+                response_cache.store(key, data_version)
+        request._data_version = data_version
+    return request._data_version
+
+def _data_etag(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    data_version = _data_version(request)
+    if not data_version:
+        return None
+    # Income based budget follows the calendar month, so the month is part of the tag
+    return f"{request.user.id}-{data_version[0]}-{timezone.now():%Y%m}"
+
+def _data_last_modified(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    data_version = _data_version(request)
+    return data_version[1] if data_version else None
+
+# Conditional GET keyed on the user's UserDataVersion, a matching If-None-Match returns 304
+# before the view runs. Goes below @permission_classes so request.user is authenticated.
+conditional_on_data_version = condition(etag_func=_data_etag, last_modified_func=_data_last_modified)
+
+def cache_per_user(view_func):
+    # Serves GET responses from the per-user response cache, other methods pass straight through
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view_func(request, *args, **kwargs)
+        # Month dependent values (income based budget, current month ranges) must not outlive the month
+        key = response_cache.key_for(request, extra=f"{timezone.now():%Y%m}")
+        data = response_cache.lookup(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = view_func(request, *args, **kwargs)
+        if isinstance(response, Response) and response.status_code == status.HTTP_200_OK:
+            response_cache.store(key, response.data)
+            response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
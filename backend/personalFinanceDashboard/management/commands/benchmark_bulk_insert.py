@@ -0,0 +1,69 @@
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction as db_transaction
+
+from personalFinanceDashboard.models import Transaction
+from personalFinanceDashboard.serializers import TransactionSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measures rows/sec of the bulk POST /transactions/ path. Everything is rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--compare', action='store_true', help="Also time the one INSERT per row path.")
+
+    def payload(self, rows):
+        start = date(2020, 1, 1)
+        return [
+            {
+                'name': f"Benchmark {i}",
+                'type': 'Income' if i % 10 == 0 else 'Expense',
+                'category': ('Groceries', 'Rent', 'Transport', 'Dining')[i % 4],
+                'amount': f"{(i % 500) + 0.99:.2f}",
+                'currency': 'usd',
+                'date': (start + timedelta(days=i % 1500)).isoformat(),
+            }
+            for i in range(rows)
+        ]
+
+    def run_bulk(self, user, data):
+        serializer = TransactionSerializer(data=data, many=True, context={'request': SimpleNamespace(user=user)})
+        serializer.save_valid_rows()
+
+    def run_per_row(self, user, data):
+        serializer = TransactionSerializer(data=data, many=True, context={'request': SimpleNamespace(user=user)})
+        serializer.is_valid(raise_exception=True)
+        for item in serializer.validated_data:
+            serializer.child.create(item)
+
+    def timed(self, runner, rows):
+        data = self.payload(rows)
+        elapsed = None
+        try:
+            with db_transaction.atomic():
+                user = User.objects.create(username=f"benchmark-bulk-insert-{time.time_ns()}")
+                started = time.perf_counter()
+                runner(user, data)
+                elapsed = time.perf_counter() - started
+                assert Transaction.objects.filter(user=user).count() == rows
+                raise Rollback
+        except Rollback:
+            pass
+        return elapsed
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            elapsed = self.timed(self.run_bulk, rows)
+            self.stdout.write(f"bulk_create  {rows:>7} rows: {elapsed:8.3f}s  {rows / elapsed:>10.0f} rows/sec")
+            if options['compare']:
+                elapsed = self.timed(self.run_per_row, rows)
+                self.stdout.write(f"per-row      {rows:>7} rows: {elapsed:8.3f}s  {rows / elapsed:>10.0f} rows/sec")
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from personalFinanceDashboard.utils import jobs
+
+
+class Command(BaseCommand):
+    help = "Reports per job type throughput, run time and queue lag from the Job table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=60, help="Window of finished jobs to report on.")
+
+    def handle(self, *args, **options):
+        metrics = jobs.metrics(timezone.now() - timedelta(minutes=options['minutes']))
+        if not metrics:
+            self.stdout.write("No jobs in the window and none queued.")
+            return
+        for name, row in sorted(metrics.items()):
+            avg = f"{row['avg_seconds']:.3f}s" if row['avg_seconds'] is not None else "-"
+            lag = f"{row['lag_seconds']:.1f}s" if row['lag_seconds'] is not None else "-"
+            self.stdout.write(
+                f"{name}: {row['succeeded']} succeeded, {row['failed']} failed, {row['per_minute']}/min, "
+                f"avg {avg}, {row['queued']} queued, lag {lag}"
+            )
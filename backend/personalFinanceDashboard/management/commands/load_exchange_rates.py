@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from personalFinanceDashboard.utils import rate_history
+
+
+class Command(BaseCommand):
+    help = "Loads daily exchange rates from a CSV file into ExchangeRate, replacing rates already stored for the same day."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV with date, base, quote, rate columns, or date and one column per quote with --base.")
+        parser.add_argument('--base', help="Base currency of a file with one column per quote currency.")
+        parser.add_argument('--batch-size', type=int, default=rate_history.LOAD_BATCH_SIZE, help="Rates per INSERT statement.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='') as f:
+                written = rate_history.load_csv(f, base=options['base'], batch_size=options['batch_size'])
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValueError as e:
+            raise CommandError(f"Nothing loaded, {e}")
+        self.stdout.write(self.style.SUCCESS(f"Loaded {written} exchange rate(s)."))
@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from personalFinanceDashboard.utils import monthly_summary
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the MonthlySummary rollup from Transaction and verifies it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild the given username.")
+        parser.add_argument('--verify-only', action='store_true', help="Report mismatches without rebuilding.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        if not options['verify_only']:
+            written = monthly_summary.rebuild(user)
+            self.stdout.write(f"Wrote {written} monthly summary row(s).")
+
+        mismatches = monthly_summary.verify(user)
+        for key, expected, actual in mismatches:
+            self.stdout.write(f"Mismatch {key}: expected {expected}, found {actual}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} monthly summary row(s) do not match Transaction.")
+        self.stdout.write(self.style.SUCCESS("Monthly summary is consistent."))
@@ -0,0 +1,60 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from personalFinanceDashboard.utils import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs background jobs from the Job table until interrupted, or until none is due with --burst."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'JOB_CONCURRENCY', 1), help="Jobs run at the same time, one thread each.")
+        parser.add_argument('--poll-interval', type=float, default=jobs.POLL_INTERVAL, help="Seconds between polls while the queue is empty.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due instead of waiting for more.")
+        parser.add_argument('--stats-interval', type=float, default=60, help="Seconds between throughput reports, 0 to disable.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        worker = jobs.Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'], burst=options['burst'])
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping after the running jobs finish...")
+            worker.stop()
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        done = threading.Event()
+        if options['stats_interval'] > 0:
+            threading.Thread(target=self.report, args=(done, options['stats_interval']), daemon=True).start()
+        self.stdout.write(f"Worker {worker.name} running {options['concurrency']} job(s) at a time.")
+        started = time.monotonic()
+        try:
+            worker.run()
+        finally:
+            done.set()
+        self.write_stats(jobs.stats(), {}, time.monotonic() - started)
+
+    def report(self, done, interval):
+        previous = {}
+        while not done.wait(interval):
+            current = jobs.stats()
+            self.write_stats(current, previous, interval)
+            previous = current
+
+    def write_stats(self, current, previous, seconds):
+        # Per job type over the interval: jobs per second and mean run time
+        for name, counters in sorted(current.items()):
+            before = previous.get(name, {})
+            delta = {key: value - before.get(key, 0) for key, value in counters.items()}
+            ran = delta['succeeded'] + delta['failed'] + delta['retried']
+            if not ran:
+                continue
+            self.stdout.write(
+                f"{name}: {delta['succeeded']} succeeded, {delta['retried']} retried, {delta['failed']} failed, "
+                f"{ran / max(seconds, 1e-9):.2f}/s, {delta['seconds'] / ran:.3f}s avg"
+            )
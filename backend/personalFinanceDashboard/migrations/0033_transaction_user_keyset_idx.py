@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalFinanceDashboard', '0032_alter_usersettings_income_ratio_for_budget'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'date', 'name', 'category', 'id'], name='transaction_user_keyset_idx'),
+        ),
+    ]
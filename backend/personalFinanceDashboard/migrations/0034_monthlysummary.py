@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def populate_monthly_summary(apps, schema_editor):
+    Transaction = apps.get_model('personalFinanceDashboard', 'Transaction')
+    MonthlySummary = apps.get_model('personalFinanceDashboard', 'MonthlySummary')
+    rows = (
+        Transaction.objects.annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('user_id', 'year', 'month', 'category', 'type', 'currency')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    summaries = {}
+    for row in rows:
+        # Null and empty categories share the uncategorized rollup
+        key = (row['user_id'], row['year'], row['month'], row['category'] or '', row['type'], row['currency'])
+        if key in summaries:
+            summaries[key].total += row['total']
+            summaries[key].count += row['count']
+        else:
+            summaries[key] = MonthlySummary(
+                user_id=key[0], year=key[1], month=key[2], category=key[3], type=key[4], currency=key[5],
+                total=row['total'], count=row['count'],
+            )
+    MonthlySummary.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalFinanceDashboard', '0033_transaction_user_keyset_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('category', models.CharField(blank=True, default='', max_length=150)),
+                ('type', models.CharField(choices=[('Expense', 'Expense'), ('Income', 'Income')], max_length=15)),
+                ('currency', models.CharField(choices=[('usd', 'US Dollar $'), ('eur', 'Euro €'), ('gbp', 'Great Britain Pound £'), ('jpy', 'Japan Yen ¥'), ('aud', 'Australian Dollar $'), ('cad', 'Canadian Dollar $'), ('krw', 'Korean Won ₩'), ('inr', 'Indian Rupee ₹')], default='usd', max_length=3)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'year', 'month', 'category', 'type', 'currency'), name='unique_monthly_summary')],
+            },
+        ),
+        migrations.RunPython(populate_monthly_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalFinanceDashboard', '0037_transaction_date_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('frequency__isnull', False)), fields=['user', 'date'], name='transaction_user_recurring_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalFinanceDashboard', '0038_transaction_recurring_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('category', models.CharField(blank=True, default='', max_length=150)),
+                ('level', models.CharField(choices=[('threshold', 'threshold'), ('over_budget', 'over_budget')], max_length=15)),
+                ('spent', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('limit', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['created_at'], name='budget_alert_unsent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'year', 'month', 'category', 'level'), name='unique_budget_alert')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 19:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personalFinanceDashboard', '0042_transaction_external_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(max_length=100)),
+                ('name', models.CharField(blank=True, default='', max_length=150)),
+                ('official_name', models.CharField(blank=True, max_length=150, null=True)),
+                ('mask', models.CharField(blank=True, max_length=10, null=True)),
+                ('type', models.CharField(max_length=30)),
+                ('subtype', models.CharField(blank=True, max_length=50, null=True)),
+                ('persistent_account_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('current', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('available', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('limit', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('fetched_at', models.DateTimeField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='personalFinanceDashboard.plaiditem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'fetched_at'], name='balance_item_fetched_idx'), models.Index(fields=['user', 'fetched_at'], name='balance_user_fetched_idx')],
+            },
+        ),
+    ]
@@ -1,11 +1,29 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db.models import Sum
+from datetime import date
 
 # Create or update the profile when a user is created or saved
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from .utils import response_cache
+
+class TransactionQuerySet(models.QuerySet):
+    # Date filters written as plain ranges on the column so the (user, date, ...) indexes apply,
+    # date__month/date__year wrap the column in EXTRACT and force a scan of every user row
+    def between(self, start=None, end=None):
+        # Inclusive on both ends, either may be None for an open range
+        queryset = self
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
+
+    def for_month(self, year, month):
+        start = date(year, month, 1)
+        next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        return self.filter(date__gte=start, date__lt=next_month)
 
 # Transaction model    
 class Transaction(models.Model):
@@ -35,12 +53,221 @@ class Transaction(models.Model):
             null=True, blank=True)
     period = models.DecimalField(decimal_places=0, max_digits=10, null=True, blank=True)
     date = models.DateField()
+    # Id and account of the bank transaction it was imported from (Plaid), null when entered by hand
+    external_id = models.CharField(max_length=100, null=True, blank=True)
+    source_account = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Conflict target of imports, re-importing a bank transaction updates the same row
+            models.UniqueConstraint(fields=['user', 'external_id'], name='unique_transaction_external_id'),
+        ]
+        indexes = [
+            # Matches the keyset ordering of the transactions list
+            models.Index(fields=['user', 'date', 'name', 'category', 'id'], name='transaction_user_keyset_idx'),
+            # Delta sync reads rows changed after a point in time
+            models.Index(fields=['user', 'updated_at'], name='transaction_user_updated_idx'),
+            # Date ranges restricted to one type (income budget, forecasts) or one category (exports, budgets)
+            models.Index(fields=['user', 'type', 'date'], name='transaction_user_type_date_idx'),
+            models.Index(fields=['user', 'category', 'date'], name='transaction_user_cat_date_idx'),
+            # Recurring transactions are a small subset, a partial index keeps their lookup tiny
+            models.Index(fields=['user', 'date'], condition=models.Q(frequency__isnull=False), name='transaction_user_recurring_idx'),
+        ]
+
     def __str__(self) -> str:
         return f"Id: {self.id}, User {self.user}, spent {self.amount}, category is {self.category}, transaction date is {self.date}. This was created at {self.created_at}"
     
+# Per-user version stamp of transactions and settings, backs the ETag of their read endpoints
+class UserDataVersion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def bump(cls, user_id):
+        now = timezone.now()
+        if not cls.objects.filter(user_id=user_id).update(version=models.F('version') + 1, modified_at=now):
+            cls.objects.get_or_create(user_id=user_id, defaults={'version': 1, 'modified_at': now})
+
+# Record of a deleted transaction so delta sync clients can drop it
+class TransactionTombstone(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    transaction_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+# Per-user monthly rollup of Transaction, kept current by utils.monthly_summary
+class MonthlySummary(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    # Uncategorized transactions are stored under an empty category
+    category = models.CharField(max_length=150, blank=True, default="")
+    type = models.CharField(max_length=15, choices=[("Expense", "Expense"), ("Income", "Income")])
+    currency = models.CharField(max_length=3, choices=Transaction.CURRENCIES, default="usd")
+    total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year', 'month', 'category', 'type', 'currency'], name='unique_monthly_summary'),
+        ]
+
+    def __str__(self) -> str:
+        return f"User {self.user}, {self.year}-{self.month:02d} {self.type} {self.category or 'Uncategorized'}: {self.total} {self.currency} over {self.count} transaction(s)"
+
+# Notification outbox of budget threshold crossings, written by utils.budget_alerts.
+# At most one row per user, month, budget and level, so a crossing is only reported once per period.
+class BudgetAlert(models.Model):
+    LEVELS = [("threshold", "threshold"), ("over_budget", "over_budget")]
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    # The overall monthly budget is stored under an empty category
+    category = models.CharField(max_length=150, blank=True, default="")
+    level = models.CharField(max_length=15, choices=LEVELS)
+    spent = models.DecimalField(max_digits=20, decimal_places=2)
+    limit = models.DecimalField(max_digits=20, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year', 'month', 'category', 'level'], name='unique_budget_alert'),
+        ]
+        indexes = [
+            # Pending deliveries of the outbox
+            models.Index(fields=['created_at'], condition=models.Q(sent_at__isnull=True), name='budget_alert_unsent_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"User {self.user}, {self.year}-{self.month:02d} {self.category or 'monthly budget'} {self.level}: {self.spent} of {self.limit}"
+
+# Exchange rate of one unit of base in quote on a day, persisted by utils.exchange_rates
+class ExchangeRate(models.Model):
+    date = models.DateField()
+    base = models.CharField(max_length=3)
+    quote = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=24, decimal_places=10)
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['base', 'quote', 'date'], name='unique_exchange_rate'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.date} 1 {self.base} = {self.rate} {self.quote}"
+
+# A linked Plaid Item (one institution login) and its position in /transactions/sync
+class PlaidItem(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item_id = models.CharField(max_length=100, unique=True)
+    access_token = models.CharField(max_length=200)
+    # next_cursor of the last completed sync, empty before the first one
+    cursor = models.TextField(blank=True, default="")
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"User {self.user}, Plaid item {self.item_id}, last synced {self.last_synced_at}"
+
+# Balances of a PlaidItem's accounts as fetched at one point in time, one row per account per fetch
+class AccountBalanceSnapshot(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item = models.ForeignKey(PlaidItem, on_delete=models.CASCADE, related_name='balance_snapshots')
+    account_id = models.CharField(max_length=100)
+    name = models.CharField(max_length=150, blank=True, default="")
+    official_name = models.CharField(max_length=150, null=True, blank=True)
+    mask = models.CharField(max_length=10, null=True, blank=True)
+    type = models.CharField(max_length=30)
+    subtype = models.CharField(max_length=50, null=True, blank=True)
+    persistent_account_id = models.CharField(max_length=100, null=True, blank=True)
+    current = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    available = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    limit = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    # ISO code, or Plaid's unofficial code for currencies without one
+    currency = models.CharField(max_length=10, null=True, blank=True)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Latest fetch of an Item, and a user's history for net worth over time
+            models.Index(fields=['item', 'fetched_at'], name='balance_item_fetched_idx'),
+            models.Index(fields=['user', 'fetched_at'], name='balance_user_fetched_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"User {self.user}, account {self.account_id} balance {self.current} {self.currency} at {self.fetched_at}"
+
+# Background job run by `manage.py runworker`, see utils.jobs
+class Job(models.Model):
+    STATUSES = [("queued", "queued"), ("running", "running"), ("succeeded", "succeeded"), ("failed", "failed")]
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default="queued")
+    # Earliest time the job may run, pushed back by retries
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # At most one queued or running job per key, e.g. one sync per Plaid item or one run per periodic slot
+    dedupe_key = models.CharField(max_length=150, null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'], condition=models.Q(status__in=['queued', 'running']), name='unique_pending_job',
+            ),
+        ]
+        indexes = [
+            # Workers claim due jobs in run_at order, only queued rows are in the index
+            models.Index(fields=['run_at'], condition=models.Q(status='queued'), name='job_queued_run_at_idx'),
+            # Expired leases of crashed workers
+            models.Index(fields=['started_at'], condition=models.Q(status='running'), name='job_running_started_idx'),
+            # Metrics over recent jobs and pruning of old ones
+            models.Index(fields=['finished_at'], name='job_finished_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Job {self.id} {self.name} ({self.status}, attempt {self.attempts}/{self.max_attempts}) at {self.run_at}"
+
+# Email waiting to be delivered by the background sender, see utils.outbox
+class OutboxEmail(models.Model):
+    STATUSES = [("pending", "pending"), ("sent", "sent"), ("failed", "failed")]
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True, default="")
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    # Earliest next delivery attempt, pushed back after a failure and to the lease end while a sender holds it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The sender's claim of due pending emails
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='outbox_pending_due_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Email '{self.subject}' to {', '.join(self.to)} ({self.status}, {self.attempts} attempt(s))"
+
 class EmailVerification(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     code = models.CharField(max_length=6)
@@ -72,6 +299,14 @@ class UserSettings(models.Model):
     income_affects_budget = models.BooleanField(default=False)
     income_ratio_for_budget = models.DecimalField(max_digits=20, decimal_places=2, null=True)
 
+    def income_based_budget(self, income):
+        # Budget for a month with the given total income, None unless income affects the budget
+        if not self.income_affects_budget:
+            return None
+        if self.income_ratio_for_budget is None:
+            return self.monthly_budget
+        return income * (self.income_ratio_for_budget / 100)
+
     @property
     def get_income_based_budget(self):
         # Returns the budget including income if the setting is enabled.
@@ -79,14 +314,9 @@ class UserSettings(models.Model):
             return None
         if self.income_ratio_for_budget is None:
             return self.monthly_budget
-        total_income = Transaction.objects.filter(
-            user = self.user,
-            type = 'Income',
-            date__month = timezone.now().month,
-            date__year = timezone.now().year,
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        income_based_budget = total_income * (self.income_ratio_for_budget / 100); 
-        return income_based_budget
+        from .utils import income
+        today = timezone.now()
+        return self.income_based_budget(income.monthly_income(self.user_id, today.year, today.month))
     
     def save(self, *args, **kwargs):
         if not self.income_affects_budget:
@@ -98,4 +328,21 @@ class UserSettings(models.Model):
 def create_or_update_user_settings(sender, instance, created, **kwargs):
     if created:
         UserSettings.objects.create(user=instance)
-    instance.usersettings.save()
\ No newline at end of file
+    instance.usersettings.save()
+
+# Any change to a user's transactions or settings moves their ETag and invalidates their cached
+# responses, whether it comes from the API, the admin or the ORM. bulk_create/bulk_update send no
+# signals, and batched deletes bump once, those paths bump and invalidate explicitly.
+@receiver([post_save, post_delete], sender=Transaction)
+@receiver([post_save, post_delete], sender=UserSettings)
+def invalidate_response_cache(sender, instance, **kwargs):
+    # Rows deleted along with their user have no version left to bump
+    if not response_cache.batching() and not isinstance(kwargs.get('origin'), User):
+        UserDataVersion.bump(instance.user_id)
+    response_cache.invalidate(instance.user_id)
+
+@receiver([post_save, post_delete], sender=UserSettings)
+def invalidate_budget_alert_settings(sender, instance, **kwargs):
+    # Imported here, utils.budget_alerts imports the models
+    from .utils import budget_alerts
+    budget_alerts.forget_settings(instance.user_id)
@@ -1,28 +1,137 @@
+import copy
+from collections import defaultdict
+from django.db import models, transaction as db_transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Transaction,User, UserSettings, Investment
+from .models import Transaction,User, UserSettings, Investment, UserDataVersion
+from .utils import monthly_summary, response_cache, income
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id','username','email']
 
+class TransactionListSerializer(serializers.ListSerializer):
+    # Rows per INSERT statement when bulk creating
+    batch_size = 1000
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        transactions = [Transaction(user=user, **item) for item in validated_data]
+        with db_transaction.atomic():
+            Transaction.objects.bulk_create(transactions, batch_size=self.batch_size)
+            monthly_summary.record_created(transactions)
+            UserDataVersion.bump(user.id)
+        response_cache.invalidate(user.id)
+        return transactions
+
+    def save_valid_rows(self):
+        """
+        Validates every row in one pass and bulk creates the valid ones.
+        Returns a list of {'index', 'errors'} for the rejected rows, the created rows are in .data.
+        """
+        if not isinstance(self.initial_data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+        valid_rows, errors = [], []
+        for index, item in enumerate(self.initial_data):
+            try:
+                valid_rows.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        self._validated_data = valid_rows
+        self._errors = []
+        self.instance = self.create(valid_rows) if valid_rows else []
+        return errors
+
+    def update(self, instance, validated_data):
+        # instance is a list of transactions lined up with validated_data
+        before = [copy.copy(transaction) for transaction in instance]
+        now = timezone.now()
+        # One bulk_update per distinct set of changed fields
+        groups = defaultdict(list)
+        for transaction, changes in zip(instance, validated_data):
+            for field, value in changes.items():
+                setattr(transaction, field, value)
+            transaction.updated_at = now
+            groups[tuple(sorted(changes))].append(transaction)
+        with db_transaction.atomic():
+            for fields, transactions in groups.items():
+                Transaction.objects.bulk_update(transactions, [*fields, 'updated_at'], batch_size=self.batch_size)
+            monthly_summary.record_updated(before, instance)
+            if instance:
+                UserDataVersion.bump(instance[0].user_id)
+                response_cache.invalidate(instance[0].user_id)
+        return instance
+
+    def update_valid_rows(self):
+        """
+        Applies a list of {'id', ...fields} partial changes to the request user's transactions.
+        Returns a list of {'index', 'errors'} for the rejected rows, the updated rows are in .data.
+        """
+        if not isinstance(self.initial_data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+        ids = [
+            item.get('id') for item in self.initial_data
+            if isinstance(item, dict) and isinstance(item.get('id'), int) and not isinstance(item.get('id'), bool)
+        ]
+        existing = Transaction.objects.filter(user=self.context['request'].user, id__in=ids).select_related('user').in_bulk()
+        instances, valid_rows, errors, seen = [], [], [], set()
+        for index, item in enumerate(self.initial_data):
+            pk = item.get('id') if isinstance(item, dict) else None
+            if pk in seen:
+                errors.append({'index': index, 'errors': {'id': ['Duplicate id.']}})
+                continue
+            if pk not in existing:
+                errors.append({'index': index, 'errors': {'id': ['Not found.']}})
+                continue
+            try:
+                valid_rows.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+                continue
+            seen.add(pk)
+            instances.append(existing[pk])
+        self._validated_data = valid_rows
+        self._errors = []
+        self.instance = self.update(instances, valid_rows) if valid_rows else []
+        return errors
+
 class TransactionSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)  # Make user read-only since it will be set in the create method
 
     class Meta:
         model = Transaction
-        fields = ['id', 'user', 'name', 'type', 'category', 'amount', 'currency', 'frequency', 'period','date', 'created_at', 'updated_at']
-        read_only_fields = ['user']
+        fields = ['id', 'user', 'name', 'type', 'category', 'amount', 'currency', 'frequency', 'period','date', 'external_id', 'source_account', 'created_at', 'updated_at']
+        read_only_fields = ['user', 'external_id', 'source_account']
+        list_serializer_class = TransactionListSerializer
 
     def create(self, validated_data):
         print(validated_data)
         # Create the transaction and link the current user
-        transaction = Transaction.objects.create(
-            user=self.context['request'].user,  # Automatically set the user from the request
-            **validated_data
-        )
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(
+                user=self.context['request'].user,  # Automatically set the user from the request
+                **validated_data
+            )
+            monthly_summary.record_created([transaction])
+        return transaction
+
+    def update(self, instance, validated_data):
+        before = copy.copy(instance)
+        with db_transaction.atomic():
+            transaction = super().update(instance, validated_data)
+            monthly_summary.record_updated([before], [transaction])
         return transaction
     
+class UserSettingsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Loads the current month's income of every income based budget at once
+        settings_list = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        today = timezone.now()
+        user_ids = [s.user_id for s in settings_list if s.income_affects_budget and s.income_ratio_for_budget is not None]
+        self.context['monthly_incomes'] = income.monthly_incomes(user_ids, today.year, today.month) if user_ids else {}
+        return super().to_representation(settings_list)
+
 class UserSettingsSerializer(serializers.ModelSerializer):
     # Income based budget
     income_based_budget = serializers.SerializerMethodField()
@@ -30,8 +139,12 @@ class UserSettingsSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserSettings
         fields = "__all__"
+        list_serializer_class = UserSettingsListSerializer
     
     def get_income_based_budget(self, obj):
+        incomes = self.context.get('monthly_incomes')
+        if incomes is not None and obj.user_id in incomes:
+            return obj.income_based_budget(incomes[obj.user_id])
         return obj.get_income_based_budget
 
 class InvestmentSerializer(serializers.ModelSerializer):
@@ -49,4 +162,24 @@ class InvestmentSerializer(serializers.ModelSerializer):
             user=self.context['request'].user,  # Automatically set the user from the request
             **validated_data
         )
-        return investment
\ No newline at end of file
+        return investment
+
+class ForecastScenarioSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=100, required=False)
+    income_factor = serializers.DecimalField(max_digits=8, decimal_places=4, min_value=0, default=1)
+    expense_factor = serializers.DecimalField(max_digits=8, decimal_places=4, min_value=0, default=1)
+    # Multiplier per category name, applied on top of the type factor
+    category_factors = serializers.DictField(child=serializers.DecimalField(max_digits=8, decimal_places=4, min_value=0), default=dict)
+    # Recurring transaction ids to leave out, e.g. a cancelled subscription
+    exclude = serializers.ListField(child=serializers.IntegerField(), default=list)
+
+class ForecastSerializer(serializers.Serializer):
+    months = serializers.IntegerField(min_value=1, max_value=36, default=12)
+    starting_balance = serializers.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lookback_months = serializers.IntegerField(min_value=1, max_value=24, default=6)
+    scenarios = ForecastScenarioSerializer(many=True, required=False)
+
+    def validate_scenarios(self, value):
+        if len(value) > 10:
+            raise serializers.ValidationError('At most 10 scenarios per request.')
+        return value
@@ -1,3 +1,1584 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Sum
+from django.core import mail
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import AccountBalanceSnapshot, BudgetAlert, EmailVerification, ExchangeRate, Job, MonthlySummary, OutboxEmail, PlaidItem, Transaction, TransactionTombstone, UserDataVersion, UserSettings
+from .utils import balances, budget, budget_alerts, exchange_rates, export, forecast, income, jobs, monthly_summary, outbox, plaid_client, plaid_ingest, plaid_sync, rate_history, recurring, summary, sync
+from .utils.pagination import apply_cursor, encode_cursor, get_page_size, paginate_keyset
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN based checks that the hot transaction queries are answered with index range scans.
+    Runs on PostgreSQL (sequential scans disabled so tiny tables still show the usable plan) and SQLite.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='plans')
+        other = User.objects.create(username='plans-other')
+        start = date(2024, 1, 1)
+        Transaction.objects.bulk_create([
+            Transaction(
+                user=cls.user if i % 4 else other,
+                name=f"Transaction {i % 7}",
+                type='Income' if i % 5 == 0 else 'Expense',
+                category=('Groceries', 'Rent', None)[i % 3],
+                amount=10 + i,
+                date=start + timedelta(days=i % 400),
+            )
+            for i in range(800)
+        ])
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertIndexRangeScan(self, queryset, index, column):
+        plan = self.explain(queryset)
+        if connection.vendor == 'postgresql':
+            self.assertRegex(plan, rf'(Index Scan|Index Only Scan|Bitmap Index Scan) (using|on) {index}\b')
+            self.assertRegex(plan, rf'Index Cond: .*\b{column}\b')
+        elif connection.vendor == 'sqlite':
+            self.assertRegex(plan, rf'SEARCH \S+ USING (COVERING )?INDEX {index} \([^)]*\b{column}\b')
+        else:
+            self.skipTest(f"No plan assertions for {connection.vendor}")
+
+    def test_month_filter_uses_date_range(self):
+        queryset = Transaction.objects.filter(user=self.user).for_month(2024, 3).order_by('date', 'name', 'category')
+        self.assertIndexRangeScan(queryset, 'transaction_user_keyset_idx', 'date')
+
+    def test_keyset_page_after_cursor(self):
+        last = Transaction.objects.filter(user=self.user).order_by('date', 'id')[100]
+        queryset = apply_cursor(Transaction.objects.filter(user=self.user), encode_cursor(last))[:500]
+        self.assertIndexRangeScan(queryset, 'transaction_user_keyset_idx', 'date')
+
+    def test_summary_range_aggregate(self):
+        queryset = (
+            Transaction.objects.filter(user=self.user).between(date(2024, 2, 10), date(2024, 5, 20))
+            .values('category', 'type', 'currency').annotate(total=Sum('amount'))
+        )
+        self.assertIndexRangeScan(queryset, 'transaction_user_keyset_idx', 'date')
+
+    def test_type_month_filter(self):
+        queryset = Transaction.objects.filter(user=self.user, type='Income').for_month(2024, 2)
+        self.assertIndexRangeScan(queryset, 'transaction_user_type_date_idx', 'date')
+
+    def test_category_export_range(self):
+        queryset = Transaction.objects.filter(user=self.user, category='Rent').between(date(2024, 1, 1), date(2024, 6, 30))
+        self.assertIndexRangeScan(queryset, 'transaction_user_cat_date_idx', 'date')
+
+    def test_changes_since(self):
+        queryset = Transaction.objects.filter(user=self.user, updated_at__gt=datetime(2024, 1, 1, tzinfo=timezone.utc)).order_by('updated_at', 'id')
+        self.assertIndexRangeScan(queryset, 'transaction_user_updated_idx', 'updated_at')
+
+    def test_tombstones_since(self):
+        queryset = TransactionTombstone.objects.filter(user=self.user, deleted_at__gt=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertIndexRangeScan(queryset, 'tombstone_user_deleted_idx', 'deleted_at')
+
+    def test_income_budget_lookup(self):
+        queryset = MonthlySummary.objects.filter(user=self.user, type='Income', year=2024, month=2)
+        # The unique constraint's index, named after the constraint on PostgreSQL
+        index = 'unique_monthly_summary' if connection.vendor == 'postgresql' else r'sqlite_autoindex_\S+'
+        self.assertIndexRangeScan(queryset, index, 'month')
+
+    def test_plaid_ingest_probe(self):
+        queryset = Transaction.objects.filter(user=self.user, external_id__in=['a', 'b'])
+        index = 'unique_transaction_external_id' if connection.vendor == 'postgresql' else r'sqlite_autoindex_\S+'
+        self.assertIndexRangeScan(queryset, index, 'external_id')
+
+    def test_latest_balance_snapshot(self):
+        queryset = AccountBalanceSnapshot.objects.filter(item_id=1).order_by('-fetched_at')[:1]
+        self.assertIndexRangeScan(queryset, 'balance_item_fetched_idx', 'item_id')
+
+    def test_job_claim(self):
+        queryset = Job.objects.filter(status='queued', run_at__lte=datetime(2024, 1, 1, tzinfo=timezone.utc)).order_by('run_at')[:1]
+        self.assertIndexRangeScan(queryset, 'job_queued_run_at_idx', 'run_at')
+
+    def test_outbox_claim(self):
+        queryset = OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=datetime(2024, 1, 1, tzinfo=timezone.utc)).order_by('next_attempt_at')[:50]
+        self.assertIndexRangeScan(queryset, 'outbox_pending_due_idx', 'next_attempt_at')
+
+    def test_exchange_rate_as_of(self):
+        queryset = ExchangeRate.objects.filter(base='USD', quote='EUR', date__lte=date(2024, 3, 1)).order_by('-date')[:1]
+        index = 'unique_exchange_rate' if connection.vendor == 'postgresql' else r'sqlite_autoindex_\S+'
+        self.assertIndexRangeScan(queryset, index, 'date')
+
+
+class PaginationTests(TestCase):
+    """
+    The full transactions list is served in keyset pages ordered by (date, name, category, id),
+    null categories last, with a cursor to the next page until the last one.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='pages')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        rows = [
+            ('2024-03-01', 'A', None), ('2024-03-01', 'B', 'Food'), ('2024-03-01', 'A', 'Food'), ('2024-03-02', 'A', None),
+            ('2024-03-01', 'A', None), ('2024-02-28', 'Z', 'Food'), ('2024-03-01', 'A', 'Bills'),
+        ]
+        created = [
+            Transaction.objects.create(user=self.user, name=name, type='Expense', category=category, amount=1, date=date.fromisoformat(day))
+            for day, name, category in rows
+        ]
+        Transaction.objects.create(user=User.objects.create(username='pages-other'), name='A', type='Expense', amount=1, date=date(2024, 3, 1))
+        # Both null categories of 2024-03-01 'A' in id order
+        self.expected = [created[i].id for i in (5, 6, 2, 0, 4, 1, 3)]
+
+    def pages(self, page_size):
+        pages, cursor = [], None
+        while True:
+            params = {'page_size': page_size, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get('/transactions/', params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pages.append([row['id'] for row in data['expenses']])
+            cursor = data['next']
+            if cursor is None:
+                return pages
+
+    def test_pages_follow_the_keyset_order(self):
+        # Page boundaries between two null categories, and between a category and the nulls after it
+        expected = self.expected
+        self.assertEqual(self.pages(2), [expected[0:2], expected[2:4], expected[4:6], expected[6:]])
+        self.assertEqual(self.pages(3), [expected[0:3], expected[3:6], expected[6:]])
+        self.assertEqual(self.pages(7), [expected])
+
+    def test_page_rows_and_cursor(self):
+        rows, cursor = paginate_keyset(Transaction.objects.filter(user=self.user), page_size=4)
+        self.assertEqual([row.id for row in rows], self.expected[:4])
+        self.assertEqual(cursor, encode_cursor(rows[-1]))
+        rows, cursor = paginate_keyset(Transaction.objects.filter(user=self.user), cursor=cursor, page_size=4)
+        self.assertEqual(([row.id for row in rows], cursor), (self.expected[4:], None))
+
+    def test_page_size_is_capped(self):
+        self.assertEqual([get_page_size(value) for value in (None, '', 'many', '0', '50', '5000')], [500, 500, 500, 1, 50, 1000])
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, name='Bulk', type='Expense', amount=1, date=date(2024, 4, 1)) for _ in range(1000)
+        ])
+        data = self.client.get('/transactions/', {'page_size': 5000}).json()
+        self.assertEqual(len(data['expenses']), 1000)
+        data = self.client.get('/transactions/', {'page_size': 5000, 'cursor': data['next']}).json()
+        self.assertEqual((len(data['expenses']), data['next']), (7, None))
+
+    def test_bad_cursor(self):
+        wrong_shape = base64.urlsafe_b64encode(b'[1]').decode()
+        for cursor in ('garbage', wrong_shape):
+            response = self.client.get('/transactions/', {'cursor': cursor})
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid cursor.'}))
+
+
+def plaid_transaction(transaction_id, amount, day='2024-03-01'):
+    return {
+        'transaction_id': transaction_id, 'account_id': 'account-1', 'amount': amount, 'iso_currency_code': 'USD',
+        'unofficial_currency_code': None, 'date': day, 'name': f"Payment {transaction_id}", 'merchant_name': None,
+        'category': ['Shops'], 'payment_channel': 'online', 'pending': False,
+    }
+
+
+class FakePlaid(BaseHTTPRequestHandler):
+    """
+    Minimal local Plaid API: /transactions/sync pages are served from `pages` by request cursor,
+    and a cursor listed in `mutate_on` answers with a mutation-during-pagination error once.
+    /transactions/get pages through `history` by offset, /accounts/balance/get returns `accounts`.
+    """
+    pages = {}
+    history = []
+    accounts = []
+    mutate_on = set()
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        type(self).requests.append((self.path, body))
+        if self.path == '/item/public_token/exchange':
+            return self.reply(200, {'access_token': 'access-sandbox-1', 'item_id': 'item-1', 'request_id': 'r'})
+        if self.path == '/transactions/get':
+            options = body.get('options', {})
+            offset, count = options.get('offset', 0), options.get('count', 100)
+            return self.reply(200, {
+                'accounts': [], 'transactions': self.history[offset:offset + count],
+                'total_transactions': len(self.history), 'item': {}, 'request_id': 'r',
+            })
+        if self.path == '/accounts/balance/get':
+            return self.reply(200, {'accounts': self.accounts, 'item': {}, 'request_id': 'r'})
+        if self.path != '/transactions/sync':
+            return self.reply(404, {'error_code': 'NOT_FOUND'})
+        cursor = body.get('cursor', '')
+        if cursor in self.mutate_on:
+            self.mutate_on.discard(cursor)
+            return self.reply(400, {
+                'error_type': 'TRANSACTIONS_ERROR', 'error_code': 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION',
+                'error_message': 'Underlying transaction data changed since last page was fetched.', 'request_id': 'r',
+            })
+        added, modified, removed, next_cursor, has_more = self.pages[cursor]
+        self.reply(200, {
+            'added': added, 'modified': modified, 'removed': [{'transaction_id': t} for t in removed],
+            'next_cursor': next_cursor, 'has_more': has_more, 'request_id': 'r',
+        })
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePlaidServer:
+    # Runs FakePlaid on a free local port for the test class and points the Plaid client at it
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakePlaid)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.settings = override_settings(
+            PLAID_HOST=f"http://127.0.0.1:{cls.server.server_port}", PLAID_CLIENT_ID='client-id', PLAID_SECRET='secret'
+        )
+        cls.settings.enable()
+        plaid_client.reset_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.settings.disable()
+        plaid_client.reset_client()
+        super().tearDownClass()
+
+
+class PlaidSyncTests(FakePlaidServer, TestCase):
+    """
+    /transactions/sync against a local fake Plaid server: the first sync walks every page, later
+    syncs start from the stored cursor, and a mutation during pagination restarts the walk.
+    A /transactions/get backfill streams every page of the range in order.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='plaid')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        FakePlaid.requests = []
+        FakePlaid.mutate_on = set()
+        FakePlaid.pages = {
+            '': ([plaid_transaction('t1', 12.5), plaid_transaction('t2', 40)], [], [], 'c1', True),
+            'c1': ([plaid_transaction('t3', 7)], [], [], 'c2', False),
+            'c2': ([plaid_transaction('t4', 3)], [plaid_transaction('t1', 13)], ['t2'], 'c3', False),
+        }
+
+    def sync(self):
+        response = self.client.post('/sync-transactions/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['items']['item-1']
+
+    def test_exchange_then_incremental_sync(self):
+        response = self.client.post('/exchange-public-token/', {'public_token': 'public-sandbox-1'}, format='json')
+        self.assertEqual(response.json(), {'access_token': 'access-sandbox-1', 'item_id': 'item-1'})
+        item = PlaidItem.objects.get(item_id='item-1')
+        self.assertEqual((item.user, item.access_token, item.cursor), (self.user, 'access-sandbox-1', ''))
+        self.assertEqual(Job.objects.get().dedupe_key, f"plaid-sync:{item.pk}")
+
+        first = self.sync()
+        self.assertEqual([t['id'] for t in first['added']], ['t1', 't2', 't3'])
+        self.assertEqual((first['modified'], first['removed'], first['cursor']), ([], [], 'c2'))
+        self.assertEqual(first['added'][0]['currency'], 'USD')
+
+        second = self.sync()
+        self.assertEqual([t['id'] for t in second['added']], ['t4'])
+        self.assertEqual([(t['id'], t['amount']) for t in second['modified']], [('t1', 13)])
+        self.assertEqual(second['removed'], ['t2'])
+        self.assertEqual(second['stored'], {'created': 1, 'updated': 1, 'unchanged': 0, 'removed': 1})
+        stored = Transaction.objects.filter(user=self.user).order_by('external_id')
+        self.assertEqual(
+            [(t.external_id, t.type, t.amount, t.category, t.currency) for t in stored],
+            [('t1', 'Expense', 13, 'Shops', 'usd'), ('t3', 'Expense', 7, 'Shops', 'usd'), ('t4', 'Expense', 3, 'Shops', 'usd')],
+        )
+        self.assertEqual(monthly_summary.verify(self.user), [])
+        item.refresh_from_db()
+        self.assertEqual(item.cursor, 'c3')
+        self.assertIsNotNone(item.last_synced_at)
+        cursors = [body.get('cursor', '') for path, body in FakePlaid.requests if path == '/transactions/sync']
+        self.assertEqual(cursors, ['', 'c1', 'c2'])
+
+    def test_mutation_during_pagination_restarts(self):
+        PlaidItem.objects.create(user=self.user, item_id='item-1', access_token='access-sandbox-1')
+        FakePlaid.mutate_on = {'c1'}
+        result = self.sync()
+        # The pages before the error are dropped, not duplicated
+        self.assertEqual([t['id'] for t in result['added']], ['t1', 't2', 't3'])
+        cursors = [body.get('cursor', '') for path, body in FakePlaid.requests if path == '/transactions/sync']
+        self.assertEqual(cursors, ['', 'c1', '', 'c1'])
+        self.assertEqual(PlaidItem.objects.get().cursor, 'c2')
+
+    def test_backfill_streams_every_page(self):
+        FakePlaid.history = [plaid_transaction(f"h{i}", i) for i in range(1234)]
+        response = self.client.get('/get-transactions/', {'access_token': 'access-sandbox-1', 'start_date': '2022-03-01'})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body['total_transactions'], 1234)
+        self.assertEqual([t['id'] for t in body['transactions']], [f"h{i}" for i in range(1234)])
+        offsets = sorted(body['options']['offset'] for path, body in FakePlaid.requests if path == '/transactions/get')
+        self.assertEqual(offsets, [0, 500, 1000])
+
+    def test_reingest_is_a_noop(self):
+        added = [plaid_sync.normalize(plaid_transaction(f"n{i}", i - 5)) for i in range(10)]
+        self.assertEqual(plaid_ingest.ingest(self.user, added), {'created': 10, 'updated': 0, 'unchanged': 0, 'removed': 0})
+        self.assertEqual(Transaction.objects.filter(user=self.user, type='Income').count(), 5)
+        # One probe of the (user, external_id) index, inside the ingest savepoint
+        with self.assertNumQueries(3):
+            counts = plaid_ingest.ingest(self.user, added, removed=[])
+        self.assertEqual(counts, {'created': 0, 'updated': 0, 'unchanged': 10, 'removed': 0})
+        self.assertEqual(monthly_summary.verify(self.user), [])
+
+
+def plaid_account(account_id, type, current, currency='USD'):
+    return {
+        'account_id': account_id, 'name': f"Account {account_id}", 'official_name': None, 'mask': '0000',
+        'type': type, 'subtype': None, 'persistent_account_id': None,
+        'balances': {'available': current, 'current': current, 'limit': None, 'iso_currency_code': currency, 'unofficial_currency_code': None},
+    }
+
+
+class BalanceSnapshotTests(FakePlaidServer, TestCase):
+    """
+    Balances are served from the latest snapshot within the TTL, a stale snapshot is served while
+    one de-duplicated refresh job is queued, and net worth is read back from the stored history.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='balances')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.item = PlaidItem.objects.create(user=self.user, item_id='item-1', access_token='access-sandbox-1')
+        FakePlaid.requests = []
+        FakePlaid.accounts = [plaid_account('checking', 'depository', 1200), plaid_account('card', 'credit', 200)]
+
+    def balance_calls(self):
+        return sum(path == '/accounts/balance/get' for path, _ in FakePlaid.requests)
+
+    def test_fresh_snapshot_is_served_without_upstream_calls(self):
+        for _ in range(3):
+            response = self.client.get('/get-balance/', {'access_token': 'access-sandbox-1'})
+            self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertFalse(body['stale'])
+        self.assertEqual([(a['account_id'], a['balances']['current']) for a in body['accounts']], [('card', '200.00'), ('checking', '1200.00')])
+        self.assertEqual(self.balance_calls(), 1)
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_snapshot_queues_one_refresh_job(self):
+        balances.refresh(self.item)
+        AccountBalanceSnapshot.objects.update(fetched_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        FakePlaid.accounts = [plaid_account('checking', 'depository', 1500), plaid_account('card', 'credit', 300)]
+        for _ in range(5):
+            rows, stale = balances.get_balances(self.item)
+            self.assertTrue(stale)
+            self.assertEqual(rows[1].current, 1200)
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.kwargs, job.dedupe_key), ('plaid.refresh_balances', {'item_id': self.item.pk}, f"balances:{self.item.pk}"))
+        self.assertEqual(self.balance_calls(), 1)
+
+        jobs.Worker(burst=True, name='test').run()
+        rows, stale = balances.get_balances(self.item)
+        self.assertFalse(stale)
+        self.assertEqual([row.current for row in rows], [300, 1500])
+        self.assertEqual(self.balance_calls(), 2)
+
+    def test_net_worth_history(self):
+        for day, checking, card in [(1, 1000, 100), (1, 1100, 100), (3, 900, 250)]:
+            FakePlaid.accounts = [plaid_account('checking', 'depository', checking), plaid_account('card', 'credit', card)]
+            for row in balances.refresh(self.item):
+                row.fetched_at = datetime(2024, 5, day, 12, tzinfo=timezone.utc)
+                row.save()
+        response = self.client.get('/net-worth/', {'start': '2024-05-01'})
+        self.assertEqual(response.json(), {
+            'currency': None,
+            'history': [{'date': '2024-05-01', 'net_worth': '1000.00'}, {'date': '2024-05-03', 'net_worth': '650.00'}],
+        })
+        self.assertEqual(self.balance_calls(), 3)
+
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record_call(value):
+    calls.append(value)
+
+
+@jobs.task('tests.fail', max_attempts=2, backoff=10)
+def always_fail():
+    raise RuntimeError('upstream down')
+
+
+class JobQueueTests(TestCase):
+    """
+    Jobs run once when due, retry with backoff until out of attempts, are de-duplicated by key,
+    and periodic schedules keep one pending run per slot.
+    """
+
+    def setUp(self):
+        calls.clear()
+
+    def work(self):
+        jobs.Worker(burst=True, name='test').run()
+
+    def test_due_jobs_run_once(self):
+        first = jobs.enqueue('tests.record', {'value': 1}, dedupe_key='record')
+        self.assertIsNone(jobs.enqueue('tests.record', {'value': 2}, dedupe_key='record'))
+        later = jobs.enqueue('tests.record', {'value': 3}, delay=3600)
+        self.work()
+        self.assertEqual(calls, [1])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts, first.locked_by), ('succeeded', 1, 'test:0'))
+        self.assertEqual(Job.objects.get(pk=later.pk).status, 'queued')
+        # The key is free again once the job finished
+        self.assertIsNotNone(jobs.enqueue('tests.record', {'value': 4}, dedupe_key='record'))
+        self.assertGreaterEqual(jobs.stats()['tests.record']['succeeded'], 1)
+
+    def test_retries_with_backoff_then_fails(self):
+        job = jobs.enqueue('tests.fail')
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('upstream down', job.last_error)
+        self.assertGreaterEqual((job.run_at - job.started_at).total_seconds(), 5)
+        Job.objects.filter(pk=job.pk).update(run_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(jobs.metrics()['tests.fail']['failed'], 1)
+
+    def test_expired_lease_is_queued_again(self):
+        job = jobs.enqueue('tests.record', {'value': 5})
+        (claimed,) = jobs.claim('crashed')
+        Job.objects.filter(pk=claimed.pk).update(started_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(jobs.reclaim_expired(), 1)
+        self.work()
+        self.assertEqual(calls, [5])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 2))
+
+    def test_periodic_schedule_keeps_one_pending_run(self):
+        schedules = {'record': {'task': 'tests.record', 'every': 600, 'kwargs': {'value': 6}}}
+        now = datetime(2024, 1, 1, 10, 4, tzinfo=timezone.utc)
+        self.assertEqual(jobs.schedule_periodic(now, schedules), 1)
+        self.assertEqual(jobs.schedule_periodic(now, schedules), 0)
+        job = Job.objects.get()
+        self.assertEqual((job.run_at, job.dedupe_key), (datetime(2024, 1, 1, 10, 10, tzinfo=timezone.utc), 'periodic:record'))
+
+
+class CountingBackend(LocmemBackend):
+    """
+    locmem backend that counts opened connections, rejects mail to addresses in `rejected` and
+    calls `on_send` (when set) before each send.
+    """
+    opened = 0
+    rejected = set()
+    on_send = None
+
+    def open(self):
+        type(self).opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if self.on_send is not None:
+            type(self).on_send()
+        for message in messages:
+            if set(message.to) & self.rejected:
+                raise ConnectionError('550 mailbox unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='personalFinanceDashboard.tests.CountingBackend')
+class OutboxTests(TestCase):
+    """
+    Password reset codes go through the outbox: the request only writes them, the sender delivers
+    batches over one connection and retries failed messages with backoff.
+    """
+
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.rejected = set()
+        CountingBackend.on_send = None
+
+    def work(self):
+        jobs.Worker(burst=True, name='test').run()
+
+    def test_reset_code_is_sent_by_the_worker(self):
+        user = User.objects.create(username='reset', email='reset@example.com')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/reset-password-email/', {'email': 'reset@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mail.outbox, [])
+        self.work()
+        (message,) = mail.outbox
+        self.assertEqual(message.to, ['reset@example.com'])
+        self.assertIn(EmailVerification.objects.get().code, message.body)
+        self.assertEqual(OutboxEmail.objects.get().status, 'sent')
+
+    def test_batch_reuses_one_connection_and_retries_failures(self):
+        for i in range(5):
+            outbox.queue_email('Subject', f"Body {i}", [f"user{i}@example.com"])
+        CountingBackend.rejected = {'user2@example.com'}
+        self.assertEqual(outbox.send_batch(), (4, 1))
+        self.assertEqual(len(mail.outbox), 4)
+        # One connection for the batch, one more after the failed message
+        self.assertEqual(CountingBackend.opened, 2)
+        failed = OutboxEmail.objects.get(status='pending')
+        self.assertEqual((failed.to, failed.attempts), (['user2@example.com'], 1))
+        self.assertIn('550', failed.last_error)
+        self.assertEqual(outbox.send_batch(), (0, 0))
+
+        CountingBackend.rejected = set()
+        OutboxEmail.objects.filter(pk=failed.pk).update(next_attempt_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(outbox.send_pending(), 1)
+        self.assertEqual(OutboxEmail.objects.filter(status='sent').count(), 5)
+
+    def test_repeated_resets_share_one_send_job(self):
+        User.objects.create(username='reset', email='reset@example.com')
+        for _ in range(3):
+            outbox.queue_email('Subject', 'Body', ['reset@example.com'])
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.dedupe_key), ('outbox.send', 'outbox:send'))
+        self.work()
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_email_queued_while_the_sender_runs_gets_its_own_job(self):
+        outbox.queue_email('Subject', 'Body', ['first@example.com'])
+        queued = []
+        CountingBackend.on_send = lambda: queued or queued.append(outbox.queue_email('Subject', 'Body', ['second@example.com']))
+        (job,) = jobs.claim('test')
+        self.assertEqual(jobs.run(job, 'test'), 'succeeded')
+        self.assertEqual(len(mail.outbox), 2)
+        # The sender may have made its last claim before such an email commits, a queued job follows it
+        self.assertTrue(Job.objects.filter(name='outbox.send', status='queued', dedupe_key='outbox:send').exists())
+        self.assertIsNone(Job.objects.get(pk=job.pk).dedupe_key)
+
+    def test_claimed_emails_are_not_sent_twice(self):
+        outbox.queue_email('Subject', 'Body', ['one@example.com'])
+        # While a batch is being sent its emails are leased, another sender finds nothing due
+        claims = []
+        CountingBackend.on_send = lambda: claims.append(outbox.claim()[0])
+        self.assertEqual(outbox.send_batch(), (1, 0))
+        self.assertEqual(claims, [[]])
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_expired_lease_is_claimed_again(self):
+        email = outbox.queue_email('Subject', 'Body', ['slow@example.com'])
+        (claimed,), lease = outbox.claim()
+        self.assertEqual(claimed.pk, email.pk)
+        self.assertEqual(outbox.send_batch(), (0, 0))
+        # The first sender died, once its lease runs out the email is due again
+        OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(outbox.send_batch(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+
+    def test_gives_up_after_max_attempts(self):
+        email = outbox.queue_email('Subject', 'Body', ['gone@example.com'])
+        CountingBackend.rejected = {'gone@example.com'}
+        for _ in range(outbox.MAX_ATTEMPTS):
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+            outbox.send_batch()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', outbox.MAX_ATTEMPTS))
+
+
+class BudgetAlertTests(TestCase):
+    """
+    Budget crossings are detected as transactions are written, from the MonthlySummary rollup,
+    and recorded once per month, budget and level.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='alerts')
+        settings = self.user.usersettings
+        settings.notifications_enabled = True
+        settings.monthly_budget = 100
+        settings.category_budget_limits = {'Food': 50}
+        settings.save()
+
+    def spend(self, amount, category=None, day=date(2024, 3, 10), type='Expense', currency='usd'):
+        transaction = Transaction.objects.create(
+            user=self.user, name='Purchase', type=type, category=category, amount=amount, currency=currency, date=day,
+        )
+        monthly_summary.record_created([transaction])
+        return transaction
+
+    def alerts(self):
+        return sorted(BudgetAlert.objects.filter(user=self.user).values_list('category', 'level', 'spent', 'limit'))
+
+    def test_threshold_then_over_budget(self):
+        self.spend(70, 'Rent')
+        self.assertEqual(self.alerts(), [])
+        self.spend(15, 'Rent')
+        self.assertEqual(self.alerts(), [('', 'threshold', 85, 100)])
+        self.spend(20, 'Rent')
+        self.assertEqual(self.alerts(), [('', 'over_budget', 105, 100), ('', 'threshold', 85, 100)])
+
+    def test_one_alert_per_period_and_level(self):
+        for _ in range(3):
+            self.spend(60, 'Rent')
+        self.assertEqual([level for _, level, _, _ in self.alerts()], ['over_budget', 'threshold'])
+        # A new month is a new period
+        self.spend(90, 'Rent', day=date(2024, 4, 1))
+        self.assertEqual(BudgetAlert.objects.filter(user=self.user, month=4).count(), 1)
+
+    def test_uncategorized_expenses_count_once(self):
+        # Uncategorized expenses share MonthlySummary's '' category with nothing else
+        self.spend(45)
+        self.assertEqual(self.alerts(), [])
+        self.spend(40)
+        self.assertEqual(self.alerts(), [('', 'threshold', 85, 100)])
+
+    def test_category_limit_alerts_apart_from_the_overall_budget(self):
+        self.spend(45, 'Food')
+        self.assertEqual(self.alerts(), [('Food', 'threshold', 45, 50)])
+        self.spend(10, 'Food')
+        self.spend(30, 'Rent')
+        self.assertEqual(self.alerts(), [
+            ('', 'threshold', 85, 100), ('Food', 'over_budget', 55, 50), ('Food', 'threshold', 45, 50),
+        ])
+
+    def test_income_does_not_count_as_spending(self):
+        self.spend(500, 'Salary', type='Income')
+        self.spend(60, 'Rent')
+        self.assertEqual(self.alerts(), [])
+
+    def test_bulk_created_rows(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        rows = [
+            {'name': f"Row {i}", 'type': 'Expense', 'category': 'Food', 'amount': '30.00', 'currency': 'usd', 'date': '2024-03-10'}
+            for i in range(4)
+        ]
+        response = client.post('/transactions/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.alerts(), [
+            ('', 'over_budget', 120, 100), ('', 'threshold', 120, 100),
+            ('Food', 'over_budget', 120, 50), ('Food', 'threshold', 120, 50),
+        ])
+
+    def test_spending_converted_into_the_display_currency(self):
+        self.user.usersettings.display_currency = 'USD'
+        self.user.usersettings.save()
+        ExchangeRate.objects.create(date=date(2024, 3, 1), base='USD', quote='EUR', rate=Decimal('0.5'))
+        # 15 EUR is 30 USD, at the Food threshold of 40 with 10 USD more
+        self.spend(15, 'Food', currency='eur')
+        self.assertEqual(self.alerts(), [])
+        self.spend(10, 'Food')
+        self.assertEqual(self.alerts(), [('Food', 'threshold', 40, 50)])
+        self.spend(Decimal('20.01'), 'Rent', currency='eur')
+        self.assertEqual(self.alerts(), [('', 'threshold', Decimal('80.02'), 100), ('Food', 'threshold', 40, 50)])
+
+        # Without rates the write goes through and the month is not checked
+        with self.assertLogs('personalFinanceDashboard.utils.budget_alerts', 'WARNING'):
+            self.spend(500, 'Food', day=date(2024, 4, 1), currency='gbp')
+        self.assertFalse(BudgetAlert.objects.filter(user=self.user, month=4).exists())
+
+    def test_notifications_disabled(self):
+        self.user.usersettings.notifications_enabled = False
+        self.user.usersettings.save()
+        self.spend(150, 'Food')
+        self.assertEqual(self.alerts(), [])
+        self.assertEqual(budget_alerts.check({}), [])
+
+
+class TransactionWriteTests(TestCase):
+    """
+    Every write path keeps the MonthlySummary rollup equal to a rebuild from Transaction.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='writer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, **fields):
+        return {'name': 'Groceries', 'type': 'Expense', 'category': 'Food', 'amount': '10.00', 'currency': 'usd', 'date': '2024-03-10', **fields}
+
+    def summary(self, **filters):
+        return list(MonthlySummary.objects.filter(user=self.user, **filters).order_by('year', 'month', 'category').values_list('year', 'month', 'category', 'total', 'count'))
+
+    def assertConsistent(self):
+        self.assertEqual(monthly_summary.verify(self.user), [])
+
+    def test_create_update_and_delete_apply_deltas(self):
+        response = self.client.post('/transactions/', self.row(amount='12.50'), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.post('/transactions/', self.row(amount='7.50', category=None), format='json')
+        self.assertEqual(self.summary(), [(2024, 3, '', 7.5, 1), (2024, 3, 'Food', 12.5, 1)])
+        self.assertConsistent()
+
+        # Moving a transaction to another month and category moves its amount too
+        id = response.data['id']
+        response = self.client.patch(f"/transactions/{id}/", {'date': '2024-04-02', 'category': 'Rent', 'amount': '20.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.summary(), [(2024, 3, '', 7.5, 1), (2024, 4, 'Rent', 20, 1)])
+        self.assertConsistent()
+
+        response = self.client.delete('/transactions/', {'ids': [id]}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.summary(), [(2024, 3, '', 7.5, 1)])
+        self.assertConsistent()
+
+    def test_bulk_create_reports_rejected_rows(self):
+        rows = [self.row(), self.row(amount='not a number'), self.row(category='Rent', amount='5.00'), self.row(type='Gift')]
+        response = self.client.post('/transactions/', rows, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([row['category'] for row in response.data['created']], ['Food', 'Rent'])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 3])
+        self.assertIn('amount', response.data['errors'][0]['errors'])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+        self.assertConsistent()
+
+        response = self.client.post('/transactions/', [self.row(date='never')], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], [])
+        response = self.client.post('/transactions/', [self.row(), self.row()], format='json')
+        self.assertEqual((response.status_code, response.data['errors']), (201, []))
+        self.assertEqual(self.summary(category='Food'), [(2024, 3, 'Food', 30, 3)])
+        self.assertConsistent()
+
+    def test_bulk_update_groups_by_changed_fields(self):
+        ids = [row['id'] for row in self.client.post('/transactions/', [self.row() for _ in range(4)], format='json').data['created']]
+        changes = [
+            {'id': ids[0], 'amount': '15.00'},
+            {'id': ids[1], 'amount': '25.00'},
+            {'id': ids[2], 'category': 'Rent', 'date': '2024-04-01'},
+            {'id': ids[3], 'amount': 'lots'},
+            {'id': 999999, 'amount': '1.00'},
+            {'id': ids[0], 'amount': '2.00'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch('/transactions/', changes, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([row['id'] for row in response.data['updated']], ids[:3])
+        self.assertEqual([error['index'] for error in response.data['errors']], [3, 4, 5])
+        # One UPDATE per distinct set of changed fields, not one per row
+        updates = [q for q in queries.captured_queries if q['sql'].startswith(f'UPDATE "{Transaction._meta.db_table}"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.summary(), [(2024, 3, 'Food', 50, 3), (2024, 4, 'Rent', 10, 1)])
+        self.assertConsistent()
+
+        response = self.client.patch('/transactions/', [{'id': 999999, 'amount': '1.00'}], format='json')
+        self.assertEqual((response.status_code, response.data['updated']), (400, []))
+
+
+class ConvertedSummaryTests(TestCase):
+    """
+    Converted totals apply each transaction day's as-of rate, in Decimal, whether or not the range
+    covers whole months.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='converter')
+        ExchangeRate.objects.bulk_create([
+            ExchangeRate(date=date(2024, 2, 20), base='EUR', quote='USD', rate=Decimal('1.1')),
+            ExchangeRate(date=date(2024, 3, 15), base='EUR', quote='USD', rate=Decimal('1.3')),
+        ])
+        transactions = [
+            Transaction.objects.create(user=self.user, name=name, type='Expense', category='Food', amount=amount, currency=currency, date=day)
+            for name, amount, currency, day in [
+                ('Market', Decimal('10.00'), 'eur', date(2024, 3, 5)),
+                ('Bakery', Decimal('20.00'), 'eur', date(2024, 3, 25)),
+                ('Diner', Decimal('0.10'), 'usd', date(2024, 3, 25)),
+            ]
+        ]
+        monthly_summary.record_created(transactions)
+
+    def test_month_aligned_and_unaligned_ranges_agree(self):
+        # 10 EUR at 1.1 and 20 EUR at 1.3, plus 0.10 USD
+        expected = [{'category': 'Food', 'total': Decimal('37.10'), 'count': 3}]
+        aligned = summary.summarize_transactions(self.user, date(2024, 3, 1), date(2024, 3, 31), ['category'], currency='USD')
+        unaligned = summary.summarize_transactions(self.user, date(2024, 3, 2), date(2024, 3, 30), ['category'], currency='USD')
+        self.assertEqual(aligned, expected)
+        self.assertEqual(unaligned, expected)
+        self.assertIsInstance(aligned[0]['total'], Decimal)
+
+        self.assertEqual(
+            budget.spending_by_category(self.user, date(2024, 3, 1), date(2024, 3, 31), currency='USD'),
+            {'Food': (Decimal('37.10'), date(2024, 3, 5))},
+        )
+
+    def test_currency_groups_keep_the_original_total(self):
+        rows = summary.summarize_transactions(self.user, None, None, ['currency'], currency='USD')
+        self.assertEqual(rows, [
+            {'currency': 'eur', 'total': Decimal('37.00'), 'count': 2, 'original_total': Decimal('30.00')},
+            {'currency': 'usd', 'total': Decimal('0.10'), 'count': 1, 'original_total': Decimal('0.10')},
+        ])
+
+
+class SummaryEndpointTests(TestCase):
+    """
+    The summary endpoint validates group_by, and ranges of whole months read from MonthlySummary
+    with the same totals as grouping Transaction rows.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='summaries')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.post('/transactions/', [
+            {'name': name, 'type': type, 'category': category, 'amount': amount, 'currency': currency, 'date': day}
+            for name, type, category, amount, currency, day in [
+                ('Market', 'Expense', 'Food', '10.00', 'usd', '2024-02-03'),
+                ('Bakery', 'Expense', 'Food', '4.50', 'eur', '2024-02-20'),
+                ('Cash', 'Expense', None, '7.25', 'usd', '2024-02-28'),
+                ('Pay', 'Income', None, '1000.00', 'usd', '2024-03-01'),
+                ('Market', 'Expense', 'Food', '12.00', 'usd', '2024-03-15'),
+                ('Taxi', 'Expense', 'Travel', '30.00', 'eur', '2024-03-31'),
+                ('Later', 'Expense', 'Food', '99.00', 'usd', '2024-04-01'),
+            ]
+        ], format='json')
+
+    def test_group_by(self):
+        self.assertEqual(summary.parse_group_by(None), list(summary.SUMMARY_DIMENSIONS))
+        self.assertEqual(summary.parse_group_by('type, month'), ['month', 'type'])
+        with self.assertRaisesMessage(ValueError, 'Invalid group_by value(s): week, day'):
+            summary.parse_group_by('week,category,day')
+
+        response = self.client.get('/transactions/summary/', {'start': '2024-03-01', 'end': '2024-03-31', 'group_by': 'type'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['group_by'], data['currency']), (['type'], None))
+        self.assertEqual(data['summary'], [{'type': 'Expense', 'total': 42, 'count': 2}, {'type': 'Income', 'total': 1000, 'count': 1}])
+
+        for params in ({'group_by': 'week'}, {'start': '2024-13-01'}):
+            self.assertEqual(self.client.get('/transactions/summary/', params).status_code, 400)
+        self.assertEqual(self.client.get('/transactions/summary/', {'group_by': 'month,week'}).json(), {'error': 'Invalid group_by value(s): week'})
+
+    def test_month_aligned_ranges_match_the_raw_rows(self):
+        group_bys = [['month'], ['category'], ['type', 'currency'], ['month', 'category'], list(summary.SUMMARY_DIMENSIONS)]
+        for group_by in group_bys:
+            with self.subTest(group_by=group_by):
+                with CaptureQueriesContext(connection) as queries:
+                    aligned = summary.summarize_transactions(self.user, date(2024, 2, 1), date(2024, 3, 31), group_by)
+                self.assertTrue(all('monthlysummary' in query['sql'] for query in queries.captured_queries))
+                # The same rows, but the range starts mid-month so Transaction is grouped instead
+                raw = summary.summarize_transactions(self.user, date(2024, 1, 31), date(2024, 3, 31), group_by)
+                self.assertEqual(aligned, raw)
+        self.assertEqual(summary.summarize_transactions(self.user, date(2024, 2, 1), date(2024, 3, 31), ['category']), [
+            {'category': 'Food', 'total': Decimal('26.50'), 'count': 3},
+            {'category': 'Travel', 'total': Decimal('30.00'), 'count': 1},
+            {'category': None, 'total': Decimal('1007.25'), 'count': 2},
+        ])
+
+
+class ExportTests(TestCase):
+    """
+    Transactions stream out as CSV or NDJSON, filtered by date and category, gzip encoded only
+    when asked for and accepted by the client.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='exporter')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ids = [
+            Transaction.objects.create(user=self.user, name=name, type='Expense', category=category, amount=Decimal(amount), date=day).id
+            for name, category, amount, day in [
+                ('Market', 'Food', '10.50', date(2024, 3, 5)),
+                ('Cash, tip', None, '2.00', date(2024, 3, 6)),
+                ('Taxi', 'Travel', '30.00', date(2024, 4, 1)),
+            ]
+        ]
+        Transaction.objects.create(user=User.objects.create(username='exporter-other'), name='Other', type='Expense', amount=1, date=date(2024, 3, 5))
+
+    def export(self, **params):
+        headers = {'HTTP_ACCEPT_ENCODING': params.pop('accept_encoding')} if 'accept_encoding' in params else {}
+        response = self.client.get('/transactions/export/', params, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, body = self.export(start='2024-03-01', end='2024-03-31')
+        self.assertEqual((response['Content-Type'], response['Content-Disposition']), ('text/csv', 'attachment; filename="transactions.csv"'))
+        self.assertEqual(list(csv.reader(io.StringIO(body.decode()))), [
+            list(export.EXPORT_COLUMNS),
+            [str(self.ids[0]), '2024-03-05', 'Market', 'Expense', 'Food', '10.50', 'usd', '', ''],
+            [str(self.ids[1]), '2024-03-06', 'Cash, tip', 'Expense', '', '2.00', 'usd', '', ''],
+        ])
+
+    def test_ndjson(self):
+        response, body = self.export(file_format='ndjson', category='Travel')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([(row['id'], row['date'], row['amount'], row['category']) for row in rows], [(self.ids[2], '2024-04-01', '30.00', 'Travel')])
+        _, body = self.export(file_format='ndjson', start='2024-03-06')
+        self.assertEqual([json.loads(line)['id'] for line in body.decode().splitlines()], self.ids[1:])
+
+    def test_gzip_only_when_accepted(self):
+        _, plain = self.export(file_format='ndjson')
+        response, body = self.export(file_format='ndjson', gzip='1', accept_encoding='deflate, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(body), plain)
+        for params in ({'gzip': '1'}, {'gzip': '1', 'accept_encoding': 'gzip;q=0, *'}, {'gzip': '1', 'accept_encoding': 'br'}, {'accept_encoding': 'gzip'}):
+            response, body = self.export(file_format='ndjson', **params)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(body, plain)
+
+    def test_bad_parameters(self):
+        response = self.client.get('/transactions/export/', {'file_format': 'xlsx'})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Unsupported file_format, expected one of: csv, ndjson'}))
+        self.assertEqual(self.client.get('/transactions/export/', {'end': '2024-02-30'}).status_code, 400)
+
+
+class DeltaSyncTests(TestCase):
+    """
+    The changes endpoint returns the rows updated and the ids deleted since a token, and asks the
+    client to start over (410) once the token is older than the tombstones kept.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='syncer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ids = [
+            Transaction.objects.create(user=self.user, name=name, type='Expense', amount=1, date=date(2024, 3, 1)).id
+            for name in ('Kept', 'Edited', 'Deleted', 'Also deleted')
+        ]
+        # Written well before the token, outside the overlap window
+        Transaction.objects.update(updated_at=datetime.now(timezone.utc) - timedelta(hours=1))
+
+    def changes(self, token):
+        return self.client.get('/transactions/changes/', {'since': token})
+
+    def test_updates_and_deletes_since_the_token(self):
+        data = self.client.get('/transactions/changes/').json()
+        self.assertEqual((data['changed'], data['deleted']), ([], []))
+        token = data['token']
+        self.assertEqual(self.changes(token).json()['changed'], [])
+
+        self.client.patch(f"/transactions/{self.ids[1]}/", {'amount': '2.00'}, format='json')
+        self.client.delete('/transactions/', {'ids': self.ids[2:]}, format='json')
+        other = User.objects.create(username='syncer-other')
+        Transaction.objects.create(user=other, name='Other', type='Expense', amount=1, date=date(2024, 3, 1))
+        response = self.changes(token)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([(row['id'], row['amount']) for row in data['changed']], [(self.ids[1], 2)])
+        self.assertEqual(sorted(data['deleted']), self.ids[2:])
+        self.assertEqual(sync.decode_token(data['token']).tzinfo, timezone.utc)
+
+    def test_expired_token(self):
+        token = sync.encode_token(datetime.now(timezone.utc) - sync.TOMBSTONE_RETENTION - timedelta(minutes=1))
+        response = self.changes(token)
+        self.assertEqual((response.status_code, response.json()), (410, {'error': 'Sync token expired, fetch the full list again.'}))
+
+    def test_malformed_token(self):
+        for token in ('garbage', base64.urlsafe_b64encode(b'soon').decode(), base64.urlsafe_b64encode(b'9' * 40).decode()):
+            response = self.changes(token)
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid sync token.'}))
+
+
+class FlakyProvider(exchange_rates.LocalProvider):
+    """
+    LocalProvider that counts fetches, fails while `down` and holds fetches until `gate` (an Event, when set) opens.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.down = False
+        self.gate = None
+
+    def fetch(self, base):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.down:
+            raise exchange_rates.RateUnavailable('provider down')
+        return super().fetch(base)
+
+
+class ExchangeRateTests(TransactionTestCase):
+    """
+    Latest rates are looked up in-process, in the cache, then in today's persisted rows before the
+    provider; misses are single-flight and provider failures are backed off. Transactional, the
+    single-flight test fetches from several threads.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.provider = FlakyProvider()
+        exchange_rates.set_provider(self.provider)
+
+    def tearDown(self):
+        exchange_rates.set_provider(None)
+
+    def forget(self):
+        # As seen by another worker process
+        exchange_rates._local.clear()
+        exchange_rates._failures.clear()
+
+    def test_cache_hit(self):
+        snapshot = exchange_rates.latest('EUR')
+        self.assertEqual(exchange_rates.latest('eur'), snapshot)
+        self.forget()
+        self.assertEqual(exchange_rates.latest('EUR'), snapshot)
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(exchange_rates.rate('EUR', 'EUR'), 1)
+
+    def test_database_fallback(self):
+        snapshot = exchange_rates.latest('EUR')
+        self.forget()
+        caches['default'].clear()
+        self.assertEqual(exchange_rates.latest('EUR')['rates'], snapshot['rates'])
+        self.assertEqual(self.provider.calls, 1)
+
+    def test_provider_failure_serves_stale_rates_for_the_backoff(self):
+        exchange_rates.latest('EUR')
+        today = datetime.now(timezone.utc).date()
+        yesterday = today - timedelta(days=1)
+        ExchangeRate.objects.update(date=yesterday, fetched_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.forget()
+        caches['default'].clear()
+        self.provider.down = True
+        for _ in range(3):
+            self.assertEqual(exchange_rates.latest('EUR')['date'], yesterday)
+        # Other processes share the back-off through the cache
+        self.forget()
+        self.assertEqual(exchange_rates.latest('EUR')['date'], yesterday)
+        self.assertEqual(self.provider.calls, 2)
+
+        # Once the back-off is over the provider is asked again
+        self.forget()
+        caches['default'].clear()
+        self.provider.down = False
+        self.assertEqual(exchange_rates.latest('EUR')['date'], today)
+        self.assertEqual(self.provider.calls, 3)
+
+    def test_only_pivot_rates_are_stored(self):
+        eur = exchange_rates.latest('EUR')
+        usd = exchange_rates.latest('USD')
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(set(ExchangeRate.objects.values_list('base', flat=True)), {'USD'})
+        self.assertEqual(eur['rates']['EUR'], 1)
+        self.assertEqual(eur['rates']['USD'], (1 / usd['rates']['EUR']).quantize(exchange_rates.RATE_PLACES))
+        # The history a conversion reads is the pivot's own rates
+        today = datetime.now(timezone.utc).date()
+        self.assertEqual(rate_history.rate_on('USD', 'EUR', today), usd['rates']['EUR'])
+
+    def test_provider_failure_without_persisted_rates(self):
+        self.provider.down = True
+        for _ in range(3):
+            with self.assertRaisesMessage(exchange_rates.RateUnavailable, 'provider down'):
+                exchange_rates.latest('EUR')
+        self.assertEqual(self.provider.calls, 1)
+        self.assertFalse(ExchangeRate.objects.exists())
+
+    def test_concurrent_misses_fetch_once(self):
+        self.provider.gate = gate = threading.Event()
+        results = []
+
+        def lookup():
+            try:
+                results.append(exchange_rates.latest('GBP'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        # Let the others queue up behind the first fetch
+        deadline = time.monotonic() + 5
+        while not self.provider.calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.provider.calls, 1)
+        self.assertTrue(all(result == results[0] for result in results))
+
+
+class ConditionalGetTests(TransactionTestCase):
+    """
+    Read endpoints answer a matching If-None-Match or If-Modified-Since with 304 until the user's
+    data changes. Transactional, cache invalidation waits for the write to commit.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='conditional')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.post('/transactions/', {'name': 'Rent', 'type': 'Expense', 'amount': '500.00', 'date': '2024-03-01'}, format='json')
+
+    def test_etag_and_last_modified(self):
+        response = self.client.get('/transactions/')
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get('/transactions/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/transactions/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.client.get('/user/settings/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post('/transactions/', {'name': 'Lunch', 'type': 'Expense', 'amount': '12.00', 'date': '2024-03-02'}, format='json')
+        response = self.client.get('/transactions/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['expenses']), 2)
+
+    def test_orm_writes_change_the_etag(self):
+        # As the admin writes, through save() and delete() without the API's serializers
+        def version():
+            return UserDataVersion.objects.get(user=self.user).version
+
+        etag, start = self.client.get('/transactions/')['ETag'], version()
+        expense = Transaction.objects.create(user=self.user, name='Lunch', type='Expense', amount=Decimal('12.00'), date=date(2024, 3, 2))
+        self.assertEqual(version(), start + 1)
+        response = self.client.get('/transactions/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(response.data['expenses'])), (200, 2))
+
+        etag = response['ETag']
+        settings = UserSettings.objects.get(user=self.user)
+        settings.monthly_budget = Decimal('900.00')
+        settings.save()
+        self.assertEqual(version(), start + 2)
+        self.assertEqual(self.client.get('/user/settings/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get('/transactions/')['ETag']
+        expense.delete()
+        self.assertEqual(version(), start + 3)
+        self.assertEqual(self.client.get('/transactions/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # A batched delete bumps once, deleting the user drops the version with it
+        ids = list(Transaction.objects.filter(user=self.user).values_list('id', flat=True))
+        self.client.delete('/transactions/', {'ids': ids}, format='json')
+        self.assertEqual(version(), start + 4)
+        self.user.delete()
+        self.assertFalse(UserDataVersion.objects.exists())
+
+
+class ResponseCacheTests(TransactionTestCase):
+    """
+    GET responses are cached per user and every committed write serves a fresh MISS. Transactional,
+    invalidation runs on commit.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='cached')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path='/transactions/'):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache'], response.json()
+
+    def test_hit_then_miss_after_each_write(self):
+        self.assertEqual(self.get()[0], 'MISS')
+        self.assertEqual(self.get()[0], 'HIT')
+
+        id = self.client.post('/transactions/', {'name': 'Rent', 'type': 'Expense', 'amount': '500.00', 'date': '2024-03-01'}, format='json').data['id']
+        cache_status, data = self.get()
+        self.assertEqual((cache_status, [row['amount'] for row in data['expenses']]), ('MISS', [500]))
+        self.assertEqual(self.get()[0], 'HIT')
+
+        self.client.patch(f"/transactions/{id}/", {'amount': '450.00'}, format='json')
+        cache_status, data = self.get()
+        self.assertEqual((cache_status, [row['amount'] for row in data['expenses']]), ('MISS', [450]))
+
+        self.client.delete('/transactions/', {'ids': [id]}, format='json')
+        cache_status, data = self.get()
+        self.assertEqual((cache_status, data['expenses']), ('MISS', []))
+
+    def test_entries_are_per_user(self):
+        self.get()
+        other = User.objects.create(username='other')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.get()[0], 'MISS')
+
+    def test_settings_write_invalidates(self):
+        self.assertEqual(self.get('/user/settings/')[0], 'MISS')
+        self.assertEqual(self.get('/user/settings/')[0], 'HIT')
+        self.client.post('/user/settings/budget/', {'monthly_budget': 900}, format='json')
+        cache_status, data = self.get('/user/settings/')
+        self.assertEqual((cache_status, data['monthly_budget']), ('MISS', 900))
+
+
+class RecurringTests(TestCase):
+    """
+    Recurring transactions expand into one occurrence per period, clamped to the end of shorter months.
+    """
+
+    def item(self, day, frequency='monthly', period=None):
+        return {'id': 1, 'name': 'Subscription', 'type': 'Expense', 'category': None, 'amount': Decimal('9.99'),
+                'currency': 'usd', 'frequency': frequency, 'period': period, 'date': day}
+
+    def dates(self, items, start, end):
+        return [d.item() for d in recurring.expand(items, start, end)[2]]
+
+    def test_month_end_is_clamped(self):
+        self.assertEqual(self.dates([self.item(date(2024, 1, 31))], date(2024, 1, 1), date(2024, 4, 30)), [
+            date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30),
+        ])
+        self.assertEqual(self.dates([self.item(date(2023, 1, 31))], date(2023, 2, 1), date(2023, 2, 28)), [date(2023, 2, 28)])
+        self.assertEqual(self.dates([self.item(date(2024, 2, 29), 'yearly')], date(2024, 1, 1), date(2026, 12, 31)), [
+            date(2024, 2, 29), date(2025, 2, 28), date(2026, 2, 28),
+        ])
+
+    def test_period_limits_the_count(self):
+        index, occurrence, dates = recurring.expand([self.item(date(2024, 1, 15), period=3)], date(2024, 1, 1), date(2024, 12, 31))
+        self.assertEqual(occurrence.tolist(), [0, 1, 2])
+        self.assertEqual(dates[-1].item(), date(2024, 3, 15))
+        # The window can start part way through the series
+        self.assertEqual(recurring.expand([self.item(date(2024, 1, 15), period=3)], date(2024, 2, 16), date(2024, 12, 31))[1].tolist(), [2])
+        # A non-positive period is the original charge only
+        self.assertEqual(self.dates([self.item(date(2024, 1, 15), period=0)], date(2024, 1, 1), date(2024, 12, 31)), [date(2024, 1, 15)])
+        self.assertEqual(self.dates([self.item(date(2024, 1, 15))], date(2023, 1, 1), date(2023, 12, 31)), [])
+
+    def test_occurrences_endpoint(self):
+        user = User.objects.create(username='recurring')
+        client = APIClient()
+        client.force_authenticate(user)
+        Transaction.objects.create(user=user, name='Gym', type='Expense', amount=30, date=date(2024, 1, 31), frequency='monthly', period=2)
+        Transaction.objects.create(user=user, name='Coffee', type='Expense', amount=3, date=date(2024, 1, 31))
+        response = client.get('/transactions/occurrences/', {'start': '2024-01-01', 'end': '2024-12-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(o['name'], o['occurrence'], o['date']) for o in response.json()['occurrences']], [
+            ('Gym', 0, '2024-01-31'), ('Gym', 1, '2024-02-29'),
+        ])
+        response = client.get('/transactions/occurrences/', {'start': '2024-01-01', 'end': '2040-01-01'})
+        self.assertEqual(response.status_code, 400)
+        response = client.get('/transactions/occurrences/', {'start': '2024-02-01', 'end': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ForecastTests(TestCase):
+    """
+    Forecasts project recurring occurrences and the average daily history per scenario.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='forecaster')
+        create = Transaction.objects.create
+        create(user=self.user, name='Salary', type='Income', amount=3000, date=date(2024, 1, 1), frequency='monthly')
+        create(user=self.user, name='Rent', type='Expense', category='Housing', amount=1000, date=date(2024, 1, 5), frequency='monthly')
+        self.streaming = create(user=self.user, name='Streaming', type='Expense', category='Fun', amount=15, date=date(2024, 1, 20), frequency='monthly')
+        # 290 over the 29 days of February 2024, 10 a day
+        create(user=self.user, name='Groceries', type='Expense', category='Food', amount=290, date=date(2024, 2, 1))
+
+    def forecast(self, *scenarios):
+        return forecast.compute_forecast(self.user, date(2024, 3, 15), 1, Decimal('100'), 6, list(scenarios))
+
+    def test_baseline(self):
+        result = self.forecast({'name': 'baseline'})
+        self.assertEqual((result['start'], result['end'], len(result['dates'])), (date(2024, 3, 16), date(2024, 4, 30), 46))
+        (baseline,) = result['scenarios']
+        self.assertEqual(baseline['monthly'], [
+            {'month': '2024-03', 'income': 0, 'expense': 175, 'net': -175, 'category_spend': {'Food': 160, 'Fun': 15, 'Housing': 0}},
+            {'month': '2024-04', 'income': 3000, 'expense': 1315, 'net': 1685, 'category_spend': {'Food': 300, 'Fun': 15, 'Housing': 1000}},
+        ])
+        self.assertEqual(baseline['ending_balance'], 1610)
+        # The lowest point is the day before the salary arrives
+        self.assertEqual((baseline['min_balance'], baseline['min_balance_date']), (-75, '2024-03-31'))
+
+    def test_scenarios_are_projected_together(self):
+        baseline, frugal, expensive = self.forecast(
+            {'name': 'baseline'},
+            {'name': 'frugal', 'expense_factor': Decimal('0.5'), 'exclude': [self.streaming.id]},
+            {'name': 'expensive', 'category_factors': {'Housing': Decimal('2')}},
+        )['scenarios']
+        self.assertEqual(baseline['ending_balance'], 1610)
+        self.assertEqual(frugal['ending_balance'], 100 + 3000 - 500 - 230)
+        self.assertEqual(frugal['monthly'][1]['category_spend']['Fun'], 0)
+        self.assertEqual(expensive['ending_balance'], 610)
+        self.assertEqual(expensive['monthly'][1]['category_spend']['Housing'], 2000)
+
+    def test_request_validation(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/forecast/', {'months': 2, 'scenarios': [{'name': 'a'}, {'name': 'b', 'income_factor': '1.1'}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['name'] for s in response.json()['scenarios']], ['a', 'b'])
+        for body in [
+            {'months': 0},
+            {'months': 37},
+            {'lookback_months': 25},
+            {'scenarios': [{'expense_factor': '-1'}]},
+            {'scenarios': [{'category_factors': {'Food': 'double'}}]},
+            {'scenarios': [{'name': str(i)} for i in range(11)]},
+        ]:
+            self.assertEqual(client.post('/forecast/', body, format='json').status_code, 400, body)
+        self.assertEqual(client.get('/forecast/', {'months': 'soon'}).status_code, 400)
+
+
+class BudgetProgressTests(TestCase):
+    """
+    Budget progress compares spending over the dashboard range with the monthly limits scaled to
+    the months the range spans.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='budgeter')
+        self.settings = self.user.usersettings
+        self.settings.monthly_budget = 200
+        self.settings.category_budget_limits = {'Food': 50, 'Rent': 100}
+        self.settings.display_dashboard_range = 'Quarter'
+        self.settings.save()
+        transactions = [
+            Transaction.objects.create(user=self.user, name=name, type=type, category=category, amount=amount, date=day)
+            for name, type, category, amount, day in [
+                ('Market', 'Expense', 'Food', 100, date(2024, 1, 10)),
+                ('Market', 'Expense', 'Food', 40, date(2024, 3, 10)),
+                ('Train', 'Expense', 'Travel', 30, date(2024, 2, 20)),
+                ('Salary', 'Income', None, 5000, date(2024, 1, 1)),
+                ('Market', 'Expense', 'Food', 999, date(2023, 12, 31)),
+            ]
+        ]
+        monthly_summary.record_created(transactions)
+
+    def test_quarter(self):
+        progress = budget.compute_progress(self.settings, date(2024, 3, 15))
+        self.assertEqual((progress['start'], progress['end'], progress['months']), (date(2024, 1, 1), date(2024, 3, 31), 3))
+        self.assertEqual(progress['total'], {
+            'limit': 600, 'spent': 170, 'remaining': 430, 'ratio': Decimal('0.2833'), 'over_threshold': False, 'over_budget': False,
+        })
+        categories = {row.pop('category'): row for row in progress['categories']}
+        self.assertEqual(list(categories), ['Food', 'Rent', 'Travel'])
+        self.assertEqual(categories['Food'], {
+            'limit': 150, 'spent': 140, 'remaining': 10, 'ratio': Decimal('0.9333'), 'over_threshold': True, 'over_budget': False,
+        })
+        self.assertEqual((categories['Rent']['spent'], categories['Rent']['over_threshold']), (0, False))
+        self.assertEqual((categories['Travel']['limit'], categories['Travel']['spent']), (None, 30))
+
+    def test_thirty_days_counts_one_month(self):
+        self.settings.display_dashboard_range = '30 Days'
+        progress = budget.compute_progress(self.settings, date(2024, 3, 15))
+        self.assertEqual((progress['start'], progress['months']), (date(2024, 2, 15), 1))
+        self.assertEqual(progress['total']['spent'], 70)
+        self.assertTrue(progress['total']['spent'] < progress['total']['limit'])
+
+    def test_all_spans_every_month_with_spending(self):
+        self.settings.display_dashboard_range = 'All'
+        progress = budget.compute_progress(self.settings, date(2024, 3, 15))
+        self.assertEqual((progress['start'], progress['months']), (None, 4))
+        self.assertEqual(progress['total']['spent'], 1169)
+        self.assertTrue(progress['total']['over_budget'])
+
+    def test_validate_category_limits(self):
+        self.assertEqual(
+            budget.validate_category_limits({'Food': '50.5', 'Rent': 100, 'Fun': None}),
+            {'Food': 50.5, 'Rent': 100.0, 'Fun': None},
+        )
+        for limits in [[], 'Food', {'': 10}, {' ': 10}, {'Food': -1}, {'Food': 'lots'}, {'Food': True}, {'Food': 'Infinity'}, {'Food': 'NaN'}]:
+            with self.assertRaises(ValueError, msg=limits):
+                budget.validate_category_limits(limits)
+
+    def test_invalid_limits_are_rejected_by_the_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/user/settings/budget/', {'category_budget_limits': {'Food': -5}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/user/settings/budget/', {'category_budget_limits': {'Food': 80, 'Rent': None}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.settings.refresh_from_db()
+        self.assertEqual(self.settings.category_budget_limits, {'Food': 80.0})
+
+
+class IncomeBudgetTests(TransactionTestCase):
+    """
+    The income based budget reads the cached monthly income, which income writes invalidate, while
+    settings changes take effect at once. Transactional, both invalidations run on commit.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create(username='earner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = datetime.now(timezone.utc).date()
+
+    def earn(self, amount):
+        response = self.client.post('/transactions/', {'name': 'Pay', 'type': 'Income', 'amount': amount, 'date': self.today.isoformat()}, format='json')
+        return response.data['id']
+
+    def budget(self):
+        return self.client.get('/user/settings/').json()['income_based_budget']
+
+    def settings(self, **changes):
+        self.assertEqual(self.client.post('/user/settings/display/', changes, format='json').status_code, 200)
+
+    def test_budget_follows_income_and_settings(self):
+        self.earn('4000.00')
+        self.settings(income_affects_budget=True, income_ratio_for_budget='50')
+        self.assertEqual(self.budget(), 2000)
+        self.assertEqual(income.monthly_income(self.user.id, self.today.year, self.today.month), 4000)
+
+        self.settings(income_ratio_for_budget='25')
+        self.assertEqual(self.budget(), 1000)
+
+        id = self.earn('1000.00')
+        self.assertEqual(self.budget(), 1250)
+        self.client.delete('/transactions/', {'ids': [id]}, format='json')
+        self.assertEqual(self.budget(), 1000)
+
+        # Turning it off drops the ratio
+        self.settings(income_affects_budget=False)
+        self.assertIsNone(self.budget())
+        self.user.usersettings.refresh_from_db()
+        self.assertIsNone(self.user.usersettings.income_ratio_for_budget)
+
+    def test_budget_alerts_see_new_settings(self):
+        self.settings(notifications_enabled=True)
+        self.assertIn(self.user.id, budget_alerts.alert_settings([self.user.id]))
+        self.settings(notifications_enabled=False)
+        self.assertEqual(budget_alerts.alert_settings([self.user.id]), {})
+
+
+class RateHistoryTests(TestCase):
+    """
+    Historical conversions use the latest rate on or before each day, from the pair itself, its
+    inverse or crossed through the pivot currency; rates are bulk loaded from CSV.
+    """
+
+    def load(self, text, base=None):
+        return rate_history.load_csv(io.StringIO(text), base=base)
+
+    def test_load_long_and_wide_csv(self):
+        self.assertEqual(self.load('date,base,quote,rate\n2024-03-01,usd,eur,0.9\n2024-03-01,USD,GBP,0.8\n'), 2)
+        self.assertEqual(self.load('Date,EUR,GBP\n2024-03-04,0.92,0.79\n2024-03-05,0.93,\n', base='usd'), 3)
+        # Loading a day again updates it
+        self.assertEqual(self.load('date,base,quote,rate\n2024-03-01,USD,EUR,0.91\n'), 1)
+        self.assertEqual(
+            list(ExchangeRate.objects.order_by('date', 'quote').values_list('date', 'base', 'quote', 'rate')),
+            [
+                (date(2024, 3, 1), 'USD', 'EUR', Decimal('0.91')), (date(2024, 3, 1), 'USD', 'GBP', Decimal('0.8')),
+                (date(2024, 3, 4), 'USD', 'EUR', Decimal('0.92')), (date(2024, 3, 4), 'USD', 'GBP', Decimal('0.79')),
+                (date(2024, 3, 5), 'USD', 'EUR', Decimal('0.93')),
+            ],
+        )
+
+    def test_malformed_csv_writes_nothing(self):
+        for text, base, message in [
+            ('date,EUR\n2024-03-01,0.9\n', None, 'Expected date, base, quote, rate columns'),
+            ('date,base,quote,rate\n2024-03-01,USD,EUR,0.9\n2024-13-01,USD,EUR,0.9\n', None, 'Line 3'),
+            ('date,base,quote,rate\n2024-03-01,USD,EUR,zero\n', None, 'Line 2'),
+            ('date,EUR\n2024-03-01,-1\n', 'USD', 'non-positive rate'),
+        ]:
+            with self.assertRaisesMessage(ValueError, message):
+                self.load(text, base)
+        self.assertFalse(ExchangeRate.objects.exists())
+
+    def test_rate_on_is_as_of_the_day(self):
+        self.load('date,EUR,GBP\n2024-03-01,0.9,0.8\n2024-03-10,0.95,0.75\n', base='USD')
+        self.assertEqual(rate_history.rate_on('USD', 'EUR', date(2024, 3, 1)), Decimal('0.9'))
+        # Weekends and holidays carry the last published rate
+        self.assertEqual(rate_history.rate_on('usd', 'eur', date(2024, 3, 9)), Decimal('0.9'))
+        self.assertEqual(rate_history.rate_on('USD', 'EUR', date(2024, 4, 1)), Decimal('0.95'))
+        # Days before the first rate take the first rate
+        self.assertEqual(rate_history.rate_on('USD', 'EUR', date(2024, 1, 1)), Decimal('0.9'))
+        self.assertEqual(rate_history.rate_on('EUR', 'EUR', date(2024, 1, 1)), 1)
+        with self.assertRaises(exchange_rates.RateUnavailable):
+            rate_history.rate_on('USD', 'JPY', date(2024, 3, 1))
+
+    def test_inverse_and_pivot_cross_rates(self):
+        self.load('date,EUR,GBP\n2024-03-01,0.8,0.5\n2024-03-10,0.8,0.4\n', base='USD')
+        self.assertEqual(rate_history.rate_on('EUR', 'USD', date(2024, 3, 5)), Decimal('1.25'))
+        # EUR -> GBP through USD on the union of both calendars
+        self.assertEqual(rate_history.rate_on('EUR', 'GBP', date(2024, 3, 5)), Decimal('0.625'))
+        self.assertEqual(rate_history.rate_on('GBP', 'EUR', date(2024, 3, 12)), Decimal('2'))
+        converted = rate_history.convert_many(['eur', 'gbp', 'usd'], [date(2024, 3, 5), date(2024, 3, 12), date(2024, 3, 5)], [10, 10, 10], 'EUR')
+        self.assertEqual(converted.round(6).tolist(), [10, 20, 8])
+
+    def test_recent_pair_rate_does_not_override_pivot_history(self):
+        self.load('date,EUR,JPY\n2020-01-01,0.5,100\n', base='USD')
+        today = datetime.now(timezone.utc).date()
+        self.assertEqual(rate_history.rate_on('JPY', 'EUR', date(2021, 1, 1)), Decimal('0.005'))
+        # A single direct rate of today, e.g. a stored live snapshot, only applies from today on
+        ExchangeRate.objects.create(date=today, base='EUR', quote='JPY', rate=Decimal('172.5'))
+        self.assertEqual(rate_history.rate_on('JPY', 'EUR', date(2021, 1, 1)), Decimal('0.005'))
+        self.assertEqual(
+            rate_history.rates_on(['jpy', 'jpy'], [date(2021, 1, 1), today], 'EUR'),
+            [Decimal('0.005'), (1 / Decimal('172.5')).quantize(exchange_rates.RATE_PLACES)],
+        )
+        # A newer pivot rate wins over the older direct one
+        self.load(f"date,EUR,JPY\n{today + timedelta(days=1)},0.5,200\n", base='USD')
+        self.assertEqual(rate_history.rate_on('JPY', 'EUR', today + timedelta(days=2)), Decimal('0.0025'))
+
+@override_settings(PLAID_CLIENT_ID='client-id', PLAID_SECRET='secret')
+class PlaidClientTests(TestCase):
+    """
+    The Plaid client is built on first use, not at import, and rebuilt from the settings after
+    reset_client; building it without credentials is a configuration error.
+    """
+
+    def tearDown(self):
+        plaid_client.reset_client()
+
+    def test_not_built_at_import(self):
+        # A fresh interpreter, this one has imported plaid through other tests by now
+        script = (
+            "import sys, django; django.setup(); "
+            "import personalFinanceDashboard.urls, personalFinanceDashboard.utils.tasks; "
+            "from personalFinanceDashboard.utils import plaid_client; "
+            "print('plaid' in sys.modules, plaid_client._client is None)"
+        )
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.stdout.split(), ['False', 'True'], result.stderr)
+
+    def test_built_once_and_rebuilt_after_reset(self):
+        with override_settings(PLAID_HOST='http://127.0.0.1:1/', PLAID_POOL_SIZE=3):
+            plaid_client.reset_client()
+            client = plaid_client.get_client()
+            self.assertIs(plaid_client.get_client(), client)
+            configuration = client.api_client.configuration
+            self.assertEqual((configuration.host, configuration.connection_pool_maxsize), ('http://127.0.0.1:1', 3))
+        with override_settings(PLAID_HOST='', PLAID_ENV='production'):
+            self.assertIs(plaid_client.get_client(), client)
+            plaid_client.reset_client()
+            rebuilt = plaid_client.get_client()
+            self.assertIsNot(rebuilt, client)
+            self.assertEqual(rebuilt.api_client.configuration.host, 'https://production.plaid.com')
+        with override_settings(PLAID_HOST='', PLAID_ENV='staging'):
+            plaid_client.reset_client()
+            with self.assertRaises(ImproperlyConfigured):
+                plaid_client.get_client()
+
+    def test_missing_credentials(self):
+        for credentials in ({'PLAID_CLIENT_ID': ''}, {'PLAID_SECRET': ''}):
+            with override_settings(PLAID_HOST='http://127.0.0.1:1/', **credentials):
+                plaid_client.reset_client()
+                with self.assertRaisesMessage(ImproperlyConfigured, 'PLAID_CLIENT_ID and PLAID_SECRET'):
+                    plaid_client.get_client()
 
-# Create your tests here.
@@ -4,7 +4,14 @@ from .utils import plaid
 
 urlpatterns = [
     path('transactions/', views.transactions, name='transactions'),
+    path('transactions/summary/', views.transaction_summary, name='transaction_summary'),
+    path('transactions/occurrences/', views.transaction_occurrences, name='transaction_occurrences'),
+    path('transactions/changes/', views.transaction_changes, name='transaction_changes'),
+    path('transactions/export/', views.export_transactions, name='export_transactions'),
     path('transactions/<int:id>/', views.transactions, name='transactions'),
+    path('forecast/', views.cash_flow_forecast, name='cash_flow_forecast'),
+
+    path('cache/stats/', views.response_cache_stats, name='response_cache_stats'),
 
     path('auth/status/', views.authentication_status, name='authentication_status'),
     path('auth/login/', views.login, name='login'),
@@ -15,6 +22,8 @@ urlpatterns = [
     path('user/', views.get_user, name='get_user'),
     path('user/settings/', views.get_user_settings, name='get_user_settings'),
     path('user/settings/budget/', views.update_budget_settings, name='update_budget_settings'),
+    path('user/settings/budget/progress/', views.budget_progress, name='budget_progress'),
+    path('user/settings/budget/alerts/', views.get_budget_alerts, name='get_budget_alerts'),
     path('user/settings/display/', views.update_display_settings, name='update_display_settings'),
 
     path('signup/', views.user_post, name='user_post'),
@@ -27,4 +36,6 @@ urlpatterns = [
     path('exchange-public-token/',plaid.exchange_public_token, name='exchange-public-token'),
     path('get-transactions/',plaid.get_transactions, name='get-transactions'),
     path('get-balance/',plaid.get_balance,name='get-balance'),
+    path('sync-transactions/',plaid.sync_transactions,name='sync-transactions'),
+    path('net-worth/',plaid.net_worth_history,name='net-worth'),
 ]
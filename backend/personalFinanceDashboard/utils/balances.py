@@ -0,0 +1,130 @@
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from ..models import AccountBalanceSnapshot
+from . import jobs, rate_history
+from .plaid_client import get_client
+
+# Account balances served from AccountBalanceSnapshot. The latest fetch of an Item is served while
+# younger than PLAID_BALANCE_TTL; an older one is still served, marked stale, and a
+# 'plaid.refresh_balances' job is queued for the worker. The job's dedupe key keeps it to one
+# pending refresh per Item, so a burst of page views cannot fan out into as many upstream calls.
+# Every fetch is kept, which is the history net worth reads.
+TTL = getattr(settings, 'PLAID_BALANCE_TTL', 15 * 60)
+# Balances owed rather than held
+LIABILITY_TYPES = {'credit', 'loan'}
+
+
+def _decimal(value):
+    return Decimal(str(value)) if value is not None else None
+
+
+def fetch(access_token):
+    # Accounts of /accounts/balance/get as raw JSON dicts
+    from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
+
+    response = get_client().accounts_balance_get(AccountsBalanceGetRequest(access_token=access_token), _preload_content=False)
+    return json.loads(response.data)['accounts']
+
+
+def refresh(item):
+    """
+    Fetches the balances of a PlaidItem from Plaid and stores them as one snapshot.
+    Returns the stored rows.
+    """
+    accounts = fetch(item.access_token)
+    fetched_at = timezone.now()
+    snapshots = [
+        AccountBalanceSnapshot(
+            user_id=item.user_id,
+            item=item,
+            account_id=account['account_id'],
+            name=(account.get('name') or '')[:150],
+            official_name=(account.get('official_name') or '')[:150] or None,
+            mask=account.get('mask'),
+            type=str(account.get('type')),
+            subtype=str(account['subtype']) if account.get('subtype') is not None else None,
+            persistent_account_id=account.get('persistent_account_id'),
+            current=_decimal(account['balances'].get('current')),
+            available=_decimal(account['balances'].get('available')),
+            limit=_decimal(account['balances'].get('limit')),
+            currency=account['balances'].get('iso_currency_code') or account['balances'].get('unofficial_currency_code'),
+            fetched_at=fetched_at,
+        )
+        for account in accounts
+    ]
+    return AccountBalanceSnapshot.objects.bulk_create(snapshots)
+
+
+def schedule_refresh(item):
+    # Queues a refresh of the Item, returns the Job or None when one is already pending
+    return jobs.enqueue('plaid.refresh_balances', {'item_id': item.pk}, dedupe_key=f"balances:{item.pk}")
+
+
+def latest(item):
+    # Rows of the Item's latest snapshot, empty before the first fetch
+    fetched_at = AccountBalanceSnapshot.objects.filter(item=item).aggregate(latest=Max('fetched_at'))['latest']
+    if fetched_at is None:
+        return []
+    return list(AccountBalanceSnapshot.objects.filter(item=item, fetched_at=fetched_at).order_by('account_id'))
+
+
+def get_balances(item, max_age=None):
+    """
+    (rows, stale) of the Item's balances. Fetched synchronously the first time; a snapshot older
+    than max_age (PLAID_BALANCE_TTL) is returned as stale with a refresh queued.
+    """
+    max_age = TTL if max_age is None else max_age
+    rows = latest(item)
+    if not rows:
+        return refresh(item), False
+    stale = rows[0].fetched_at < timezone.now() - timedelta(seconds=max_age)
+    if stale:
+        schedule_refresh(item)
+    return rows, stale
+
+
+def net_worth_history(user, start=None, end=None, currency=None):
+    """
+    [{'date', 'net_worth'}] of the user's accounts from their stored snapshots, one point per day
+    with a fetch: every account at its last balance on or before that day, liabilities subtracted.
+    With a currency, balances convert at that day's rate (see rate_history).
+    """
+    rows = AccountBalanceSnapshot.objects.filter(user=user, current__isnull=False)
+    if end:
+        # A plain range on the column so the (user, fetched_at) index applies
+        rows = rows.filter(fetched_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    rows = rows.order_by('fetched_at').values_list('item_id', 'account_id', 'type', 'current', 'currency', 'fetched_at')
+    balances = {}
+    points = []
+    day = None
+    for item_id, account_id, type, current, account_currency, fetched_at in rows.iterator():
+        fetched_day = timezone.localdate(fetched_at)
+        if day is not None and fetched_day != day:
+            points.append((day, dict(balances)))
+        day = fetched_day
+        balances[(item_id, account_id)] = (-current if type in LIABILITY_TYPES else current, account_currency)
+    if day is not None:
+        points.append((day, balances))
+    points = [(day, accounts) for day, accounts in points if start is None or day >= start]
+    if not currency:
+        return [{'date': day, 'net_worth': sum((amount for amount, _ in accounts.values()), Decimal(0))} for day, accounts in points]
+
+    codes, days, amounts = [], [], []
+    for day, accounts in points:
+        for amount, account_currency in accounts.values():
+            codes.append(account_currency or currency)
+            days.append(day)
+            amounts.append(float(amount))
+    converted = rate_history.convert_many(codes, days, amounts, currency) if amounts else []
+    history, i = [], 0
+    for day, accounts in points:
+        total = float(sum(converted[i:i + len(accounts)]))
+        i += len(accounts)
+        history.append({'date': day, 'net_worth': round(total, 2)})
+    return history
@@ -0,0 +1,165 @@
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import F, Min, Q, Sum
+
+from ..models import MonthlySummary, Transaction
+from . import response_cache, summary
+
+# Budget progress: expense totals per category over the user's dashboard range, compared with the
+# monthly budget and the per-category monthly limits scaled to the number of months in the range.
+UNCATEGORIZED = 'Uncategorized'
+
+
+def _month_end(day):
+    next_month = date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+    return next_month - timedelta(days=1)
+
+
+def dashboard_range(display_range, today):
+    # (start, end) of a display_dashboard_range value, start is None for "All"
+    if display_range == '30 Days':
+        return today - timedelta(days=29), today
+    if display_range == 'Quarter':
+        first_month = (today.month - 1) // 3 * 3 + 1
+        start = date(today.year, first_month, 1)
+        return start, _month_end(date(today.year, first_month + 2, 1))
+    if display_range == 'Year':
+        return date(today.year, 1, 1), date(today.year, 12, 31)
+    if display_range == 'All':
+        return None, None
+    return today.replace(day=1), _month_end(today)
+
+
+def months_spanned(start, end):
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def spending_by_category(user, start, end, currency=None):
+    """
+    {category: (spent, first date)} of the user's expenses in [start, end], in one grouped query.
+    Whole-month ranges read the MonthlySummary rollup, others the (user, type, date) index.
+    With a currency the spending is converted into it, grouped per source currency and day.
+    """
+    if currency:
+        rows, currencies, dates = summary.converted_rows(user, start, end, ['category'], type='Expense')
+        rates = summary.conversion_rates(currencies, dates, currency)
+        totals = {}
+        for row, rate, day in zip(rows, rates, dates):
+            category = row['category'] or UNCATEGORIZED
+            spent, earliest = totals.get(category, (Decimal(0), day))
+            totals[category] = (spent + row['total'] * rate, min(earliest, day))
+        return {category: (spent.quantize(summary.CENTS), first) for category, (spent, first) in totals.items()}
+    month_aligned = (start is None or start.day == 1) and (end is None or end == _month_end(end))
+    if month_aligned:
+        rows = MonthlySummary.objects.filter(user=user, type='Expense')
+        if start:
+            rows = rows.filter(Q(year__gt=start.year) | Q(year=start.year, month__gte=start.month))
+        if end:
+            rows = rows.filter(Q(year__lt=end.year) | Q(year=end.year, month__lte=end.month))
+        rows = rows.values('category').annotate(spent=Sum('total'), first=Min(F('year') * 12 + F('month') - 1)).order_by()
+        spending = {}
+        for row in rows:
+            first = date(row['first'] // 12, row['first'] % 12 + 1, 1)
+            category = row['category'] or UNCATEGORIZED
+            spent, earliest = spending.get(category, (Decimal(0), first))
+            spending[category] = (spent + row['spent'], min(earliest, first))
+        return spending
+    rows = (
+        Transaction.objects.filter(user=user, type='Expense').between(start, end)
+        .values('category').annotate(spent=Sum('amount'), first=Min('date')).order_by()
+    )
+    spending = {}
+    for row in rows:
+        category = row['category'] or UNCATEGORIZED
+        spent, earliest = spending.get(category, (Decimal(0), row['first']))
+        spending[category] = (spent + row['spent'], min(earliest, row['first']))
+    return spending
+
+
+def _progress(limit, spent, threshold):
+    if limit is None:
+        return {'limit': None, 'spent': spent, 'remaining': None, 'ratio': None, 'over_threshold': False, 'over_budget': False}
+    ratio = (spent / limit) if limit else None
+    return {
+        'limit': limit,
+        'spent': spent,
+        'remaining': limit - spent,
+        'ratio': round(ratio, 4) if ratio is not None else None,
+        'over_threshold': spent > 0 and (ratio is None or ratio >= threshold),
+        'over_budget': spent > limit,
+    }
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def compute_progress(user_settings, today):
+    start, end = dashboard_range(user_settings.display_dashboard_range, today)
+    currency = (user_settings.display_currency or '').upper() or None
+    spending = spending_by_category(user_settings.user, start, end, currency)
+    if start is None:
+        earliest = min((first for _, first in spending.values()), default=today)
+        months = months_spanned(earliest, today)
+    else:
+        months = 1 if user_settings.display_dashboard_range == '30 Days' else months_spanned(start, end)
+    threshold = Decimal(user_settings.over_spending_threshold)
+
+    monthly_budget = user_settings.get_income_based_budget if user_settings.income_affects_budget else user_settings.monthly_budget
+    total_limit = Decimal(monthly_budget) * months if monthly_budget is not None else None
+    total_spent = sum((spent for spent, _ in spending.values()), Decimal(0))
+
+    limits = {
+        category: _decimal(limit) * months
+        for category, limit in (user_settings.category_budget_limits or {}).items()
+        if _decimal(limit) is not None
+    }
+    categories = [
+        {'category': category, **_progress(limits.get(category), spending.get(category, (Decimal(0), None))[0], threshold)}
+        for category in sorted(set(limits) | set(spending))
+    ]
+    return {
+        'range': user_settings.display_dashboard_range,
+        'currency': currency,
+        'start': start,
+        'end': end,
+        'months': months,
+        'over_spending_threshold': threshold,
+        'total': _progress(total_limit, total_spent, threshold),
+        'categories': categories,
+    }
+
+
+def get_progress(user_settings, today):
+    # Cached under the user's response cache generation, any transaction or settings write invalidates it
+    key = response_cache.user_key(user_settings.user_id, f"budget-progress:{today.isoformat()}")
+    progress = response_cache.lookup(key)
+    if progress is None:
+        progress = compute_progress(user_settings, today)
+        response_cache.store(key, progress)
+    return progress
+
+
+def validate_category_limits(limits):
+    """
+    Checks a {category: monthly limit} update, a null limit removes the category.
+    Returns the cleaned dict, raises ValueError when malformed.
+    """
+    if not isinstance(limits, dict):
+        raise ValueError('category_budget_limits must be an object of category to monthly limit.')
+    cleaned = {}
+    for category, limit in limits.items():
+        if not isinstance(category, str) or not category.strip():
+            raise ValueError('Category names must be non-empty strings.')
+        if limit is None:
+            cleaned[category] = None
+            continue
+        value = _decimal(limit)
+        if value is None or isinstance(limit, bool) or not value.is_finite() or value < 0:
+            raise ValueError(f"Invalid limit for '{category}', expected a non-negative number.")
+        cleaned[category] = float(value)
+    return cleaned
@@ -0,0 +1,209 @@
+import calendar
+import logging
+import operator
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import reduce
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from ..models import BudgetAlert, MonthlySummary, Transaction, UserSettings
+from . import summary
+from .exchange_rates import RateUnavailable
+from .response_cache import CACHE_ALIAS
+
+# Write-time budget alerts. MonthlySummary already holds the running per-month totals, so after a write
+# only the touched months of users with notifications enabled are read back (a handful of rollup rows
+# through the unique index) and compared with the monthly budget and the category limits.
+# Crossings are inserted into the BudgetAlert outbox, whose unique constraint de-duplicates them per month.
+# Expenses in a currency other than the user's display currency are converted at each day's as-of rate,
+# as budget progress converts them, so only those currencies of the touched months read Transaction.
+# The budget settings are cached until the user's settings are saved, so users without notifications
+# cost one cache read per write.
+# Key of the overall monthly total in the per-category sums. MonthlySummary files uncategorized
+# expenses under '', so the overall total needs a key no stored category can take; its alerts are
+# recorded with BudgetAlert's '' category.
+OVERALL = None
+SETTINGS_TIMEOUT = 60 * 60
+SETTINGS_FIELDS = (
+    'user_id', 'monthly_budget', 'category_budget_limits', 'over_spending_threshold',
+    'income_affects_budget', 'income_ratio_for_budget', 'display_currency',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _settings_key(user_id):
+    return f"budget-alerts:settings:{user_id}"
+
+
+def forget_settings(user_id):
+    caches[CACHE_ALIAS].delete(_settings_key(user_id))
+
+
+def alert_settings(user_ids):
+    # {user_id: UserSettings} of the users with notifications enabled, disabled users are cached as False
+    cache = caches[CACHE_ALIAS]
+    cached = cache.get_many([_settings_key(user_id) for user_id in user_ids])
+    found = {user_id: cached[_settings_key(user_id)] for user_id in user_ids if _settings_key(user_id) in cached}
+    missing = set(user_ids) - set(found)
+    if missing:
+        loaded = {s.user_id: s for s in UserSettings.objects.filter(user_id__in=missing).only(*SETTINGS_FIELDS, 'notifications_enabled')}
+        loaded = {user_id: loaded[user_id] if user_id in loaded and loaded[user_id].notifications_enabled else False for user_id in missing}
+        cache.set_many({_settings_key(user_id): value for user_id, value in loaded.items()}, SETTINGS_TIMEOUT)
+        found.update(loaded)
+    return {user_id: value for user_id, value in found.items() if value}
+
+
+def touched_months(deltas):
+    """
+    {(user_id, year, month): touched categories} where a budget may have been crossed: expenses
+    went up, or income went down for an income based budget. Deltas are monthly_summary's shape.
+    """
+    months = defaultdict(set)
+    for (user_id, year, month, category, type, currency), (total, count) in deltas.items():
+        if type == 'Expense' and total > 0:
+            months[(user_id, year, month)].add(OVERALL)
+            # Uncategorized expenses only count towards the overall budget, category limits need a name
+            if category:
+                months[(user_id, year, month)].add(category)
+        elif type == 'Income' and total < 0:
+            months[(user_id, year, month)].add(OVERALL)
+    return months
+
+
+def display_currency(user_settings):
+    return (user_settings.display_currency or '').upper() or None
+
+
+def converted_expenses(foreign, settings):
+    """
+    {(user_id, year, month, category): spent} of the expenses of (user_id, year, month, currency)
+    in a currency other than the user's display currency, converted into it per day like
+    utils.budget.spending_by_category, in cents. Raises RateUnavailable when a currency has no rates.
+    """
+    in_months = reduce(operator.or_, (
+        Q(user_id=user_id, currency=currency, date__range=(date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])))
+        for user_id, year, month, currency in foreign
+    ))
+    rows = list(
+        Transaction.objects.filter(in_months, type='Expense')
+        .values('user_id', 'category', 'currency', 'date').annotate(total=Sum('amount')).order_by()
+    )
+    by_quote = defaultdict(list)
+    for row in rows:
+        by_quote[display_currency(settings[row['user_id']])].append(row)
+    spent = defaultdict(Decimal)
+    for quote, rows in by_quote.items():
+        rates = summary.conversion_rates([row['currency'] for row in rows], [row['date'] for row in rows], quote)
+        for row, rate in zip(rows, rates):
+            spent[(row['user_id'], row['date'].year, row['date'].month, row['category'] or '')] += row['total'] * rate
+    return {key: total.quantize(summary.CENTS) for key, total in spent.items()}
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def monthly_budget(user_settings, income):
+    # The income based budget for the income of the checked month when enabled
+    budget = user_settings.income_based_budget(income) if user_settings.income_affects_budget else user_settings.monthly_budget
+    return Decimal(budget) if budget is not None else None
+
+
+def crossings(spent, limit, threshold):
+    if limit is None or spent <= 0:
+        return []
+    levels = []
+    if spent >= limit * threshold:
+        levels.append('threshold')
+    if spent > limit:
+        levels.append('over_budget')
+    return levels
+
+
+def check(deltas):
+    """
+    Records an alert for every budget crossed by a batch of MonthlySummary deltas.
+    Call after the deltas are applied, in the same transaction. Returns the alerts found,
+    including ones already in the outbox for the period.
+    """
+    months = touched_months(deltas)
+    if not months:
+        return []
+    settings = alert_settings({user_id for user_id, _, _ in months})
+    months = {key: categories for key, categories in months.items() if key[0] in settings}
+    if not months:
+        return []
+
+    spent = defaultdict(Decimal)
+    income = defaultdict(Decimal)
+    foreign = set()
+    in_months = reduce(operator.or_, (Q(user_id=u, year=y, month=m) for u, y, m in months))
+    rows = MonthlySummary.objects.filter(in_months).values_list('user_id', 'year', 'month', 'category', 'type', 'currency', 'total')
+    for user_id, year, month, category, type, currency, total in rows:
+        if type == 'Income':
+            income[(user_id, year, month)] += total
+        elif display_currency(settings[user_id]) in (None, currency.upper()):
+            spent[(user_id, year, month, category)] += total
+            spent[(user_id, year, month, OVERALL)] += total
+        else:
+            foreign.add((user_id, year, month, currency))
+    if foreign:
+        try:
+            converted = converted_expenses(foreign, settings)
+        except RateUnavailable as e:
+            # The write goes through, the months are checked again on their next write
+            logger.warning('Budget alerts skipped, spending could not be converted: %s', e)
+            unconverted = {(user_id, year, month) for user_id, year, month, _ in foreign}
+            months = {key: categories for key, categories in months.items() if key not in unconverted}
+            converted = {}
+        for (user_id, year, month, category), total in converted.items():
+            spent[(user_id, year, month, category)] += total
+            spent[(user_id, year, month, OVERALL)] += total
+
+    alerts = []
+    for (user_id, year, month), categories in months.items():
+        user_settings = settings[user_id]
+        limits = user_settings.category_budget_limits or {}
+        for category in categories:
+            if category == OVERALL:
+                limit = monthly_budget(user_settings, income[(user_id, year, month)])
+            else:
+                limit = _decimal(limits[category]) if category in limits else None
+            total = spent[(user_id, year, month, category)]
+            alerts.extend(
+                BudgetAlert(
+                    user_id=user_id, year=year, month=month, category=category if category != OVERALL else '',
+                    level=level, spent=total, limit=limit,
+                )
+                for level in crossings(total, limit, user_settings.over_spending_threshold)
+            )
+    if alerts:
+        _record(alerts)
+    return alerts
+
+
+def _recorded_key(user_id, year, month):
+    return f"budget-alerts:recorded:{user_id}:{year}:{month}"
+
+
+def _record(alerts):
+    # Skips the insert for crossings already recorded this period, the unique constraint stays the source of truth
+    cache = caches[CACHE_ALIAS]
+    keys = {_recorded_key(a.user_id, a.year, a.month) for a in alerts}
+    recorded = {key: set(value) for key, value in cache.get_many(keys).items()}
+    new = [a for a in alerts if (a.category, a.level) not in recorded.get(_recorded_key(a.user_id, a.year, a.month), ())]
+    if not new:
+        return
+    BudgetAlert.objects.bulk_create(new, ignore_conflicts=True)
+    for alert in new:
+        recorded.setdefault(_recorded_key(alert.user_id, alert.year, alert.month), set()).add((alert.category, alert.level))
+    # Only once the rows are committed, a rolled back write must not hide the crossing
+    transaction.on_commit(lambda: cache.set_many(recorded, SETTINGS_TIMEOUT))
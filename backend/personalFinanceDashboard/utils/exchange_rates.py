@@ -0,0 +1,317 @@
+import json
+import threading
+import time
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from ..models import ExchangeRate
+from .response_cache import CACHE_ALIAS
+
+# Latest exchange rates, fetched and stored for EXCHANGE_RATE_PIVOT only; other bases are crossed
+# through the pivot's rates, so the ExchangeRate table only gains pivot rows that agree with the
+# history utils.rate_history converts with. The pivot's rates are looked up through three layers
+# before the provider:
+#  1. an in-process dict, valid until the rates are EXCHANGE_RATE_TTL old
+#  2. the Django cache, shared between workers when the backend is
+#  3. the ExchangeRate table, today's rows fetched within the TTL
+# Misses are single-flight: one thread per process (a lock per base) and one process per cache
+# (a cache.add lock) asks the provider, the others wait for its result. When the provider fails
+# the last persisted rates are served stale rather than failing the request, and that outcome (the
+# stale rates, or the error when nothing was persisted) is cached for EXCHANGE_RATE_FAILURE_BACKOFF
+# so an outage costs one provider call per back-off instead of one per lookup.
+PROVIDER = getattr(settings, 'EXCHANGE_RATE_PROVIDER', 'http')
+TTL = getattr(settings, 'EXCHANGE_RATE_TTL', 60 * 60)
+PIVOT = getattr(settings, 'EXCHANGE_RATE_PIVOT', 'USD')
+FAILURE_BACKOFF = getattr(settings, 'EXCHANGE_RATE_FAILURE_BACKOFF', 60)
+TIMEOUT = getattr(settings, 'EXCHANGE_RATE_TIMEOUT', (3.05, 10))
+# Longest a process holds the fetch lock, and how long the others wait for its result
+LOCK_TIMEOUT = 30
+WAIT_INTERVAL = 0.05
+RATE_PLACES = Decimal('1e-10')
+
+
+class RateUnavailable(Exception):
+    pass
+
+
+class HttpProvider:
+    # exchangerate-api.com v6, one request returns every quote of a base.
+    # The session keeps the upstream connection alive between fetches.
+    url = 'https://v6.exchangerate-api.com/v6/{key}/latest/{base}'
+
+    def __init__(self, api_key=None, timeout=TIMEOUT):
+        self.api_key = api_key if api_key is not None else getattr(settings, 'EXCHANGE_RATE_API_KEY', '')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def fetch(self, base):
+        try:
+            response = self.session.get(self.url.format(key=self.api_key, base=base), timeout=self.timeout)
+            payload = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise RateUnavailable(f"Exchange rate request failed: {e}")
+        if response.status_code != 200 or payload.get('result') != 'success':
+            raise RateUnavailable(payload.get('error-type', f"HTTP {response.status_code}"))
+        return {quote: Decimal(str(rate)) for quote, rate in payload['conversion_rates'].items()}
+
+
+class LocalProvider:
+    # Rates of every currency against one base from a JSON file ({"base": ..., "rates": {...}}),
+    # cross rates for other bases are derived from it
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'EXCHANGE_RATE_FILE')
+        self._rates = None
+
+    def rates(self):
+        if self._rates is None:
+            with open(self.path) as f:
+                data = json.load(f)
+            self._rates = {quote.upper(): Decimal(str(rate)) for quote, rate in data['rates'].items()}
+        return self._rates
+
+    def fetch(self, base):
+        rates = self.rates()
+        if base not in rates:
+            raise RateUnavailable('unsupported-code')
+        return {quote: rate / rates[base] for quote, rate in rates.items()}
+
+
+PROVIDERS = {'http': HttpProvider, 'local': LocalProvider}
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    # Built on first use, EXCHANGE_RATE_PROVIDER is 'http', 'local' or the dotted path of a provider class
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = (PROVIDERS.get(PROVIDER) or import_string(PROVIDER))()
+    return _provider
+
+
+def set_provider(provider):
+    # Swaps the provider, e.g. a LocalProvider in tests, and drops the in-process rates
+    global _provider
+    with _provider_lock:
+        _provider = provider
+    _local.clear()
+    _failures.clear()
+
+
+_local = {}
+# {base: failure entry} of recent provider failures, see _stale
+_failures = {}
+_fetch_locks = {}
+_fetch_locks_lock = threading.Lock()
+
+
+def _fetch_lock(base):
+    with _fetch_locks_lock:
+        return _fetch_locks.setdefault(base, threading.Lock())
+
+
+def _cache_key(base):
+    return f"exchange-rates:{base}"
+
+
+def _failure_key(base):
+    return f"{_cache_key(base)}:failure"
+
+
+def _fresh(snapshot):
+    return snapshot is not None and snapshot['fetched_at'] > time.time() - TTL
+
+
+def _remember(base, snapshot):
+    _local[base] = snapshot
+    remaining = int(snapshot['fetched_at'] + TTL - time.time())
+    if remaining > 0:
+        caches[CACHE_ALIAS].set(_cache_key(base), snapshot, remaining)
+    return snapshot
+
+
+def _persisted(base, day=None):
+    # Rates of the base for a day (the latest persisted day by default) as a snapshot, None when missing
+    rows = ExchangeRate.objects.filter(base=base)
+    if day is None:
+        day = rows.aggregate(latest=Max('date'))['latest']
+    rows = list(rows.filter(date=day).values_list('quote', 'rate', 'fetched_at')) if day else []
+    if not rows:
+        return None
+    return {
+        'base': base,
+        'date': day,
+        'fetched_at': min(fetched_at for _, _, fetched_at in rows).timestamp(),
+        'rates': {quote: rate for quote, rate, _ in rows},
+    }
+
+
+def _persist(base, rates):
+    now = timezone.now()
+    today = now.date()
+    # Rounded like the column so fresh and persisted snapshots agree
+    rates = {quote.upper(): rate.quantize(RATE_PLACES) for quote, rate in rates.items()}
+    ExchangeRate.objects.bulk_create(
+        [ExchangeRate(date=today, base=base, quote=quote, rate=rate, fetched_at=now) for quote, rate in rates.items()],
+        update_conflicts=True,
+        unique_fields=['base', 'quote', 'date'],
+        update_fields=['rate', 'fetched_at'],
+    )
+    return {'base': base, 'date': today, 'fetched_at': now.timestamp(), 'rates': rates}
+
+
+def _failure(base):
+    # Entry of a provider failure still within its back-off, None otherwise
+    now = time.time()
+    entry = _failures.get(base)
+    if entry is None or entry['until'] <= now:
+        entry = caches[CACHE_ALIAS].get(_failure_key(base))
+        if entry is None or entry['until'] <= now:
+            return None
+        _failures[base] = entry
+    return entry
+
+
+def _served(entry):
+    # The stale snapshot of a failure entry, or its error when there was nothing to serve
+    if entry['snapshot'] is None:
+        raise RateUnavailable(entry['error'])
+    return entry['snapshot']
+
+
+def _stale(base, error):
+    entry = {'snapshot': _persisted(base), 'error': str(error), 'until': time.time() + FAILURE_BACKOFF}
+    # Lookups within the back-off get the same answer without asking the provider
+    _failures[base] = entry
+    caches[CACHE_ALIAS].set(_failure_key(base), entry, FAILURE_BACKOFF)
+    return _served(entry)
+
+
+def _load(base):
+    cache = caches[CACHE_ALIAS]
+    with _fetch_lock(base):
+        # Filled by another thread while this one waited for the lock
+        for snapshot in (_local.get(base), cache.get(_cache_key(base))):
+            if _fresh(snapshot):
+                return _remember(base, snapshot)
+        snapshot = _persisted(base, timezone.now().date())
+        if _fresh(snapshot):
+            return _remember(base, snapshot)
+        entry = _failure(base)
+        if entry is not None:
+            return _served(entry)
+
+        lock_key = f"{_cache_key(base)}:lock"
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                rates = get_provider().fetch(base)
+            except RateUnavailable as e:
+                return _stale(base, e)
+            else:
+                # The provider is back, drop the back-off of an earlier failure
+                _failures.pop(base, None)
+                cache.delete(_failure_key(base))
+                return _remember(base, _persist(base, rates))
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is fetching this base, wait for its result
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            snapshot = cache.get(_cache_key(base))
+            if _fresh(snapshot):
+                return _remember(base, snapshot)
+            entry = _failure(base)
+            if entry is not None:
+                return _served(entry)
+            if cache.get(lock_key) is None:
+                break
+        return _stale(base, RateUnavailable('Timed out waiting for exchange rates.'))
+
+
+def _crossed(base, pivot):
+    # Rates of another base derived from the pivot's snapshot, kept in-process until the pivot's rates change
+    snapshot = _local.get(base)
+    if snapshot is not None and (snapshot['date'], snapshot['fetched_at']) == (pivot['date'], pivot['fetched_at']):
+        return snapshot
+    rates = {PIVOT: Decimal(1), **pivot['rates']}
+    if not rates.get(base):
+        raise RateUnavailable('unsupported-code')
+    snapshot = {
+        'base': base,
+        'date': pivot['date'],
+        'fetched_at': pivot['fetched_at'],
+        'rates': {quote: (rate / rates[base]).quantize(RATE_PLACES) for quote, rate in rates.items()},
+    }
+    _local[base] = snapshot
+    return snapshot
+
+
+def latest(base):
+    """
+    Snapshot of the latest rates of a base currency:
+    {'base', 'date', 'fetched_at' (epoch seconds), 'rates': {quote: Decimal}}.
+    Raises RateUnavailable when the provider fails and nothing was persisted before.
+    """
+    base = base.upper()
+    if len(base) != 3 or not base.isalpha():
+        raise RateUnavailable('unsupported-code')
+    if base != PIVOT:
+        return _crossed(base, latest(PIVOT))
+    snapshot = _local.get(base)
+    if _fresh(snapshot):
+        return snapshot
+    snapshot = caches[CACHE_ALIAS].get(_cache_key(base))
+    if _fresh(snapshot):
+        _local[base] = snapshot
+        return snapshot
+    entry = _failure(base)
+    if entry is not None:
+        return _served(entry)
+    return _load(base)
+
+
+def latest_rates(base):
+    return latest(base)['rates']
+
+
+def rate(base, quote):
+    base, quote = base.upper(), quote.upper()
+    if base == quote:
+        return Decimal(1)
+    try:
+        return latest_rates(base)[quote]
+    except KeyError:
+        raise RateUnavailable('unsupported-code')
+
+
+def convert(amount, base, quote):
+    return Decimal(amount) * rate(base, quote)
+
+
+def rates_into(currencies, quote):
+    """
+    {currency: Decimal rate} converting each currency into quote at the latest rates,
+    from a single lookup of quote's snapshot.
+    """
+    quote = quote.upper()
+    rates = {}
+    snapshot = None
+    for currency in currencies:
+        if currency.upper() == quote:
+            rates[currency] = Decimal(1)
+            continue
+        snapshot = snapshot or latest_rates(quote)
+        if not snapshot.get(currency.upper()):
+            raise RateUnavailable(f"No {currency.upper()} to {quote} rate.")
+        rates[currency] = 1 / snapshot[currency.upper()]
+    return rates
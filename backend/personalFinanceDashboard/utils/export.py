@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import zlib
+
+from ..models import Transaction
+
+# Streaming export of a user's transactions. Rows are read as tuples with a server side
+# cursor and written out in ~64KB chunks, so memory use does not depend on history size.
+EXPORT_COLUMNS = ('id', 'date', 'name', 'type', 'category', 'amount', 'currency', 'frequency', 'period')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+ITERATOR_CHUNK_SIZE = 2000
+FLUSH_SIZE = 64 * 1024
+
+
+def export_queryset(user, start=None, end=None, category=None):
+    transactions = Transaction.objects.filter(user=user).between(start, end)
+    if category:
+        transactions = transactions.filter(category=category)
+    return transactions.order_by('date', 'name', 'category', 'id').values_list(*EXPORT_COLUMNS)
+
+
+def accepts_gzip(accept_encoding):
+    # gzip, or else *, listed in an Accept-Encoding header with a non-zero q
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = [part.strip() for part in coding.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        qualities[name.lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0)) > 0
+
+
+def _csv_value(value):
+    return '' if value is None else value
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (str, int)):
+        return value
+    # Dates and decimals are exported as strings to keep full precision
+    return str(value)
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def iter_ndjson(rows):
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps({column: _json_value(value) for column, value in zip(EXPORT_COLUMNS, row)}) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield ''.join(chunk).encode()
+            chunk = []
+            size = 0
+    yield ''.join(chunk).encode()
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(queryset, export_format, compress=False):
+    rows = queryset.iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    chunks = iter_csv(rows) if export_format == 'csv' else iter_ndjson(rows)
+    return iter_gzip(chunks) if compress else chunks
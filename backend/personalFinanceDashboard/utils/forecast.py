@@ -0,0 +1,170 @@
+import hashlib
+import json
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Min, Sum
+
+from ..models import Transaction
+from . import exchange_rates, recurring, response_cache
+
+# Cash-flow forecast. Every source of money is an item with an amount per future day:
+#  - recurring transactions, placed on their expanded occurrence dates
+#  - non-recurring history, averaged per (category, type) over a lookback window and spread evenly per day
+# Items form an (items x months) amount matrix and each scenario is a weight vector over the items, so
+# every scenario is projected at once with (scenarios x items) @ (items x months) products; daily balances
+# come from one weighted bincount over (scenario, day) of the recurring occurrences.
+# With a currency, item amounts are converted into it at the latest rates, one rate per source currency.
+UNCATEGORIZED = 'Uncategorized'
+
+
+def _month_end(year, month):
+    next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return next_month - timedelta(days=1)
+
+
+def _add_months(day, months):
+    total = day.year * 12 + day.month - 1 + months
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def forecast_window(today, months):
+    # From tomorrow through the end of the month `months` months ahead
+    last_month = _add_months(today, months)
+    return today + timedelta(days=1), _month_end(last_month.year, last_month.month)
+
+
+def history_items(user, today, lookback_months):
+    # Average daily amount of the non-recurring transactions per (category, type) over whole past months
+    history_end = today.replace(day=1) - timedelta(days=1)
+    history_start = _add_months(today, -lookback_months)
+    transactions = Transaction.objects.filter(user=user, frequency__isnull=True)
+    first = transactions.aggregate(first=Min('date'))['first']
+    if first is None or first > history_end:
+        return []
+    history_start = max(history_start, first)
+    days = (history_end - history_start).days + 1
+    rows = (
+        transactions.between(history_start, history_end)
+        .values('category', 'type', 'currency')
+        .annotate(total=Sum('amount'))
+        .order_by('type', 'category', 'currency')
+    )
+    return [
+        {'category': row['category'], 'type': row['type'], 'currency': row['currency'], 'daily': float(row['total']) / days}
+        for row in rows
+    ]
+
+
+def _scenario_weights(scenarios, is_income, item_categories, item_ids):
+    weights = np.ones((len(scenarios), len(is_income)))
+    for s, scenario in enumerate(scenarios):
+        weights[s, is_income] *= float(scenario.get('income_factor', 1))
+        weights[s, ~is_income] *= float(scenario.get('expense_factor', 1))
+        for category, factor in scenario.get('category_factors', {}).items():
+            weights[s, item_categories == category] *= float(factor)
+        excluded = set(scenario.get('exclude', []))
+        if excluded:
+            weights[s, np.isin(item_ids, list(excluded))] = 0
+    return weights
+
+
+def compute_forecast(user, today, months, starting_balance, lookback_months, scenarios, currency=None):
+    start, end = forecast_window(today, months)
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    n_days = len(days)
+
+    recurring_rows = recurring.recurring_items(user, end)
+    occ_index, _, occ_dates = recurring.expand(recurring_rows, start, end)
+    history = history_items(user, today, lookback_months)
+    n_recurring = len(recurring_rows)
+    n_items = n_recurring + len(history)
+
+    is_income = np.array([row['type'] == 'Income' for row in recurring_rows] + [row['type'] == 'Income' for row in history], dtype=bool)
+    sign = np.where(is_income, 1.0, -1.0)
+    item_categories = np.array(
+        [row['category'] or UNCATEGORIZED for row in recurring_rows] + [row['category'] or UNCATEGORIZED for row in history],
+        dtype=object,
+    )
+    # History items have no transaction id to exclude
+    item_ids = np.array([row['id'] for row in recurring_rows] + [-1] * len(history), dtype=np.int64)
+    weights = _scenario_weights(scenarios, is_income, item_categories, item_ids)
+    n_scenarios = len(scenarios)
+
+    month_of_day = days.astype('datetime64[M]')
+    boundaries = np.flatnonzero(np.r_[True, month_of_day[1:] != month_of_day[:-1]])
+    month_labels = [str(m) for m in month_of_day[boundaries]]
+    month_index = np.cumsum(np.r_[False, month_of_day[1:] != month_of_day[:-1]])
+    days_in_window = np.diff(np.r_[boundaries, n_days])
+
+    # (items x months) matrix of absolute amounts: recurring occurrences land in their month,
+    # history items accrue their daily average over the days of each month inside the window
+    sources = {row['currency'] for row in recurring_rows} | {row['currency'] for row in history}
+    rates = {code: float(rate) for code, rate in exchange_rates.rates_into(sources, currency).items()} if currency else {}
+    recurring_amount = np.array([float(row['amount']) * rates.get(row['currency'], 1.0) for row in recurring_rows])
+    history_daily = np.array([row['daily'] * rates.get(row['currency'], 1.0) for row in history])
+    by_month = np.zeros((n_items, len(boundaries)))
+    occ_day = (occ_dates - days[0]).astype(np.int64)
+    np.add.at(by_month, (occ_index, month_index[occ_day]), recurring_amount[occ_index])
+    by_month[n_recurring:] = np.outer(history_daily, days_in_window)
+
+    # Daily net per scenario: one weighted bincount over (scenario, day) for the recurring occurrences
+    # plus each scenario's constant daily history flow
+    contribution = weights[:, occ_index] * (sign[occ_index] * recurring_amount[occ_index])
+    flat = (np.arange(n_scenarios)[:, None] * n_days + occ_day[None, :]).ravel()
+    daily_net = np.bincount(flat, weights=contribution.ravel(), minlength=n_scenarios * n_days).astype(float).reshape(n_scenarios, n_days)
+    daily_net += (weights[:, n_recurring:] @ (sign[n_recurring:] * history_daily))[:, None]
+    balance = float(starting_balance) + np.cumsum(daily_net, axis=1)
+
+    income = weights[:, is_income] @ by_month[is_income]
+    expense = weights[:, ~is_income] @ by_month[~is_income]
+
+    # (scenarios x categories x items) @ (items x months) over the expense items
+    categories, codes = np.unique(item_categories, return_inverse=True)
+    one_hot = (codes[None, :] == np.arange(len(categories))[:, None]) & ~is_income[None, :]
+    spent_on = one_hot.any(axis=1)
+    categories, one_hot = categories[spent_on].tolist(), one_hot[spent_on].astype(float)
+    category_spend = (weights[:, None, :] * one_hot[None, :, :]) @ by_month
+
+    results = []
+    for s, scenario in enumerate(scenarios):
+        low = int(np.argmin(balance[s]))
+        results.append({
+            'name': scenario.get('name', f"scenario {s + 1}"),
+            'daily_balance': np.round(balance[s], 2).tolist(),
+            'ending_balance': round(float(balance[s, -1]), 2),
+            'min_balance': round(float(balance[s, low]), 2),
+            'min_balance_date': str(days[low]),
+            'monthly': [
+                {
+                    'month': month_labels[m],
+                    'income': round(float(income[s, m]), 2),
+                    'expense': round(float(expense[s, m]), 2),
+                    'net': round(float(income[s, m] - expense[s, m]), 2),
+                    'category_spend': {
+                        category: round(float(category_spend[s, c, m]), 2)
+                        for c, category in enumerate(categories)
+                    },
+                }
+                for m in range(len(month_labels))
+            ],
+        })
+    return {
+        'start': start,
+        'end': end,
+        'starting_balance': float(starting_balance),
+        'currency': currency,
+        'dates': [str(day) for day in days],
+        'scenarios': results,
+    }
+
+
+def get_forecast(user, today, months, starting_balance, lookback_months, scenarios, currency=None):
+    # Cached per set of parameters under the user's response cache generation
+    params = json.dumps([str(today), months, str(starting_balance), lookback_months, scenarios, currency], sort_keys=True, default=str)
+    key = response_cache.user_key(user.id, f"forecast:{hashlib.md5(params.encode()).hexdigest()}")
+    forecast = response_cache.lookup(key)
+    if forecast is None:
+        forecast = compute_forecast(user, today, months, starting_balance, lookback_months, scenarios, currency)
+        response_cache.store(key, forecast)
+    return forecast
@@ -0,0 +1,50 @@
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Sum
+
+from .response_cache import CACHE_ALIAS
+
+# Cached monthly income totals behind the income based budget. Values come from the MonthlySummary
+# rollup and are dropped by utils.monthly_summary whenever an Income delta touches their month;
+# the timeout only bounds staleness for writes that bypass it.
+INCOME_TIMEOUT = 60 * 60
+
+
+def _key(user_id, year, month):
+    return f"income:{user_id}:{year}:{month}"
+
+
+def monthly_incomes(user_ids, year, month):
+    """
+    {user_id: total income} of a month for many users, one cache read plus one grouped query
+    for the users not cached yet.
+    """
+    # Imported here, the models import this package
+    from ..models import MonthlySummary
+
+    cache = caches[CACHE_ALIAS]
+    keys = {user_id: _key(user_id, year, month) for user_id in user_ids}
+    cached = cache.get_many(keys.values())
+    incomes = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+    missing = [user_id for user_id in keys if user_id not in incomes]
+    if missing:
+        rows = (
+            MonthlySummary.objects.filter(user_id__in=missing, type='Income', year=year, month=month)
+            .values('user_id').annotate(total=Sum('total')).order_by()
+        )
+        loaded = dict.fromkeys(missing, 0)
+        loaded.update({row['user_id']: row['total'] for row in rows})
+        cache.set_many({keys[user_id]: total for user_id, total in loaded.items()}, INCOME_TIMEOUT)
+        incomes.update(loaded)
+    return incomes
+
+
+def monthly_income(user_id, year, month):
+    return monthly_incomes([user_id], year, month)[user_id]
+
+
+def forget(months):
+    # Drops the cached totals of (user_id, year, month) keys once the current transaction commits
+    keys = [_key(*month) for month in months]
+    if keys:
+        transaction.on_commit(lambda: caches[CACHE_ALIAS].delete_many(keys))
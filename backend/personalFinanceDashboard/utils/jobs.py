@@ -0,0 +1,323 @@
+import logging
+import math
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Min, Sum
+from django.utils import timezone
+
+from ..models import Job
+
+# Background jobs in the Job table, no broker needed. Workers (manage.py runworker) claim due
+# queued jobs with SELECT ... FOR UPDATE SKIP LOCKED, so several workers never block on or run the
+# same row, then mark them running under a lease. A failed job is retried with exponential backoff
+# and jitter until max_attempts; a worker that dies leaves its job running until the lease expires
+# and housekeeping queues it again. Periodic jobs (JOB_PERIODIC) are enqueued for their next slot
+# under a dedupe key, which the partial unique index keeps to one pending instance however many
+# workers schedule it. Tasks registered with dedupe_while_running=False give the key up as they
+# start, for work that must run again when asked for after the running job last looked. Jobs
+# enqueued inside a transaction only become visible when it commits.
+POLL_INTERVAL = getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+LEASE = getattr(settings, 'JOB_LEASE', 10 * 60)
+RETENTION = getattr(settings, 'JOB_RETENTION', 7 * 24 * 60 * 60)
+# {schedule name: {'task': name, 'every': seconds, 'kwargs': {...}}}
+PERIODIC = getattr(settings, 'JOB_PERIODIC', {})
+HOUSEKEEPING_INTERVAL = 10
+DEFAULT_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled for each later one up to BACKOFF_MAX
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+ERROR_LENGTH = 4000
+# Modules whose @task functions are registered on first lookup
+TASK_MODULES = ['personalFinanceDashboard.utils.tasks']
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownTask(ValueError):
+    pass
+
+
+class Task:
+    def __init__(self, func, name, max_attempts, backoff, dedupe_while_running=True):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.dedupe_while_running = dedupe_while_running
+
+    def retry_delay(self, attempts):
+        # Exponential in the attempts made so far, with jitter so failed batches do not retry in lockstep
+        delay = min(BACKOFF_MAX, self.backoff * 2 ** max(attempts - 1, 0))
+        return delay * random.uniform(0.5, 1.0)
+
+
+_tasks = {}
+_tasks_loaded = False
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff=BACKOFF_BASE, dedupe_while_running=True):
+    # Registers the decorated function as the job type `name`, it is called with the job's kwargs
+    def register(func):
+        _tasks[name] = Task(func, name, max_attempts, backoff, dedupe_while_running)
+        return func
+    return register
+
+
+def get_task(name):
+    global _tasks_loaded
+    if not _tasks_loaded:
+        for module in TASK_MODULES:
+            import_module(module)
+        _tasks_loaded = True
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise UnknownTask(f"No job type '{name}'.")
+
+
+def enqueue(name, kwargs=None, run_at=None, delay=None, dedupe_key=None, max_attempts=None):
+    """
+    Queues a job of a registered type, due now, at run_at, or after delay seconds.
+    Returns the Job, or None when a queued or running job already holds dedupe_key (running
+    jobs of tasks registered with dedupe_while_running=False no longer hold it).
+    """
+    task = get_task(name)
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    job = Job(
+        name=name,
+        kwargs=kwargs or {},
+        run_at=run_at,
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts or task.max_attempts,
+    )
+    if dedupe_key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def claim(worker_id, limit=1):
+    # Due queued jobs marked running for this worker, oldest run_at first
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=now)
+            .order_by('run_at').values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        # Conditional on the status, backends without SKIP LOCKED may have handed the rows to another worker too
+        Job.objects.filter(id__in=ids, status='queued').update(
+            status='running', locked_by=worker_id, started_at=now, attempts=F('attempts') + 1,
+        )
+        return list(Job.objects.filter(id__in=ids, status='running', locked_by=worker_id, started_at=now))
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _count(name, outcome, seconds):
+    with _stats_lock:
+        counters = _stats.setdefault(name, {'succeeded': 0, 'failed': 0, 'retried': 0, 'seconds': 0.0})
+        counters[outcome] += 1
+        counters['seconds'] += seconds
+
+
+def stats():
+    # {job name: {'succeeded', 'failed', 'retried', 'seconds'}} run by this process
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
+
+
+def run(job, worker_id):
+    """
+    Runs a claimed job and records its outcome: succeeded, queued again for a retry, or failed.
+    Returns the outcome.
+    """
+    started = time.monotonic()
+    try:
+        task = get_task(job.name)
+        if job.dedupe_key and not task.dedupe_while_running:
+            Job.objects.filter(pk=job.pk).update(dedupe_key=None)
+        task.func(**job.kwargs)
+    except Exception as error:
+        now = timezone.now()
+        message = traceback.format_exc()[-ERROR_LENGTH:]
+        # Unknown job types cannot succeed on a retry
+        if job.attempts < job.max_attempts and not isinstance(error, UnknownTask):
+            outcome = 'retried'
+            delay = get_task(job.name).retry_delay(job.attempts)
+            changes = {'status': 'queued', 'run_at': now + timedelta(seconds=delay), 'locked_by': ''}
+            logger.warning('Job %s %s failed (attempt %d/%d), retrying in %.0fs: %s', job.id, job.name, job.attempts, job.max_attempts, delay, error)
+        else:
+            outcome = 'failed'
+            changes = {'status': 'failed', 'finished_at': now}
+            logger.error('Job %s %s failed after %d attempt(s): %s', job.id, job.name, job.attempts, error)
+        changes['last_error'] = message
+    else:
+        outcome = 'succeeded'
+        changes = {'status': 'succeeded', 'finished_at': timezone.now(), 'last_error': ''}
+    # Left alone when the lease expired and another worker has the job by now
+    Job.objects.filter(pk=job.pk, status='running', locked_by=worker_id).update(**changes)
+    _count(job.name, outcome, time.monotonic() - started)
+    return outcome
+
+
+def reclaim_expired():
+    # Running jobs whose lease expired (the worker died) are queued again, or failed when out of attempts
+    now = timezone.now()
+    expired = Job.objects.filter(status='running', started_at__lt=now - timedelta(seconds=LEASE))
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, last_error='Lease expired, the worker running the job stopped.',
+    )
+    queued = expired.update(status='queued', run_at=now, locked_by='', last_error='Lease expired, the worker running the job stopped.')
+    return failed + queued
+
+
+def next_slot(every, now=None):
+    # Start of the next period of `every` seconds, aligned on the epoch so every worker agrees
+    now = now or timezone.now()
+    return datetime.fromtimestamp(math.ceil(now.timestamp() / every) * every, tz=dt_timezone.utc)
+
+
+def schedule_periodic(now=None, schedules=None):
+    # Enqueues each periodic job (JOB_PERIODIC by default) for its next slot, returns the number newly queued
+    queued = 0
+    for schedule, spec in (PERIODIC if schedules is None else schedules).items():
+        job = enqueue(
+            spec.get('task', schedule),
+            kwargs=spec.get('kwargs'),
+            run_at=next_slot(spec['every'], now),
+            dedupe_key=f"periodic:{schedule}",
+        )
+        queued += job is not None
+    return queued
+
+
+def prune(now=None):
+    # Finished jobs older than JOB_RETENTION
+    now = now or timezone.now()
+    deleted, _ = Job.objects.filter(finished_at__lt=now - timedelta(seconds=RETENTION)).delete()
+    return deleted
+
+
+def housekeeping():
+    reclaim_expired()
+    schedule_periodic()
+    prune()
+
+
+def metrics(since=None):
+    """
+    Per job type over the jobs finished since `since` (the last hour by default):
+    {name: {'succeeded', 'failed', 'per_minute', 'avg_seconds', 'queued', 'lag_seconds'}},
+    lag_seconds being how overdue the oldest due queued job is.
+    """
+    now = timezone.now()
+    since = since or now - timedelta(hours=1)
+    minutes = max((now - since).total_seconds() / 60, 1 / 60)
+    duration = ExpressionWrapper(F('finished_at') - F('started_at'), output_field=DurationField())
+    result = {}
+
+    def entry(name):
+        return result.setdefault(name, {'succeeded': 0, 'failed': 0, 'per_minute': 0.0, 'avg_seconds': None, 'queued': 0, 'lag_seconds': None})
+
+    finished = (
+        Job.objects.filter(finished_at__gte=since)
+        .values('name', 'status').annotate(count=Count('id'), total=Sum(duration)).order_by()
+    )
+    for row in finished:
+        counters = entry(row['name'])
+        counters[row['status']] = row['count']
+        if row['status'] == 'succeeded' and row['total'] is not None:
+            counters['avg_seconds'] = round(row['total'].total_seconds() / row['count'], 3)
+    for counters in result.values():
+        counters['per_minute'] = round((counters['succeeded'] + counters['failed']) / minutes, 2)
+    queued = Job.objects.filter(status='queued').values('name').annotate(count=Count('id'), due=Min('run_at')).order_by()
+    for row in queued:
+        counters = entry(row['name'])
+        counters['queued'] = row['count']
+        counters['lag_seconds'] = round(max((now - row['due']).total_seconds(), 0), 3)
+    return result
+
+
+class Worker:
+    """
+    Claims and runs jobs on `concurrency` threads (the calling thread when 1) until stop() is called,
+    or, in burst mode, until no job is due.
+    """
+
+    def __init__(self, concurrency=1, poll_interval=POLL_INTERVAL, burst=False, name=None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._housekeeping_at = 0.0
+        self._housekeeping_lock = threading.Lock()
+
+    def stop(self):
+        # Threads finish the job they are running, then exit
+        self._stop.set()
+
+    def _housekeeping(self):
+        with self._housekeeping_lock:
+            if time.monotonic() < self._housekeeping_at:
+                return
+            self._housekeeping_at = time.monotonic() + HOUSEKEEPING_INTERVAL
+        try:
+            housekeeping()
+        except Exception:
+            logger.exception('Job housekeeping failed')
+
+    def _loop(self, index):
+        worker_id = f"{self.name}:{index}"
+        try:
+            while not self._stop.is_set():
+                self._housekeeping()
+                jobs = claim(worker_id)
+                if not jobs:
+                    if self.burst:
+                        return
+                    self._stop.wait(self.poll_interval)
+                    continue
+                for job in jobs:
+                    run(job, worker_id)
+                # Like the end of a request: drops connections past CONN_MAX_AGE or broken by the job,
+                # unless the caller holds a transaction open around the worker
+                if not connection.in_atomic_block:
+                    close_old_connections()
+        finally:
+            if self.concurrency > 1:
+                connections.close_all()
+
+    def run(self):
+        if self.concurrency == 1:
+            self._loop(0)
+            return
+        threads = [
+            threading.Thread(target=self._loop, args=(index,), name=f"job-worker-{index}", daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
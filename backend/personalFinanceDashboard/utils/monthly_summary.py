@@ -0,0 +1,131 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from ..models import MonthlySummary, Transaction
+from . import budget_alerts, income
+
+# Incremental maintenance of MonthlySummary. Every write path collects per-key deltas
+# (user, year, month, category, type, currency) -> (total, count) and applies them in one pass.
+
+
+def _key(user_id, date, category, type, currency):
+    return (user_id, date.year, date.month, category or "", type, currency)
+
+
+def _deltas_for(transactions, sign=1):
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for t in transactions:
+        delta = deltas[_key(t.user_id, t.date, t.category, t.type, t.currency)]
+        delta[0] += sign * Decimal(t.amount)
+        delta[1] += sign
+    return deltas
+
+
+def _grouped_deltas(queryset, sign=1):
+    # Same shape as _deltas_for but grouped by the database, for querysets about to be bulk deleted
+    rows = (
+        queryset.annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('user_id', 'year', 'month', 'category', 'type', 'currency')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for row in rows:
+        key = (row['user_id'], row['year'], row['month'], row['category'] or "", row['type'], row['currency'])
+        deltas[key][0] += sign * row['total']
+        deltas[key][1] += sign * row['count']
+    return deltas
+
+
+def _apply(deltas):
+    with db_transaction.atomic():
+        for (user_id, year, month, category, type, currency), (total, count) in deltas.items():
+            if not total and not count:
+                continue
+            lookup = dict(user_id=user_id, year=year, month=month, category=category, type=type, currency=currency)
+            updated = MonthlySummary.objects.filter(**lookup).update(total=F('total') + total, count=F('count') + count)
+            if not updated:
+                try:
+                    with db_transaction.atomic():
+                        MonthlySummary.objects.create(total=total, count=count, **lookup)
+                except IntegrityError:
+                    # Created concurrently, fold the delta into that row instead
+                    MonthlySummary.objects.filter(**lookup).update(total=F('total') + total, count=F('count') + count)
+        # Drop rollups whose last transaction went away
+        user_ids = {key[0] for key in deltas}
+        MonthlySummary.objects.filter(user_id__in=user_ids, count__lte=0).delete()
+        budget_alerts.check(deltas)
+        income.forget({key[:3] for key in deltas if key[4] == 'Income'})
+
+
+def record_created(transactions):
+    _apply(_deltas_for(transactions))
+
+
+def record_deleted(transactions):
+    _apply(_deltas_for(transactions, sign=-1))
+
+
+def record_updated(before, after):
+    # before are snapshots of the rows prior to the update, after the saved instances
+    deltas = _deltas_for(before, sign=-1)
+    for key, (total, count) in _deltas_for(after).items():
+        deltas[key][0] += total
+        deltas[key][1] += count
+    _apply(deltas)
+
+
+def record_queryset_deleted(queryset):
+    # Call before queryset.delete(), one GROUP BY instead of loading the rows
+    _apply(_grouped_deltas(queryset, sign=-1))
+
+
+def expected_rows(user=None):
+    transactions = Transaction.objects.all()
+    if user is not None:
+        transactions = transactions.filter(user=user)
+    return {key: (total, count) for key, (total, count) in _grouped_deltas(transactions).items()}
+
+
+def rebuild(user=None):
+    """
+    Recomputes MonthlySummary from Transaction, for one user or everyone.
+    Returns the number of summary rows written.
+    """
+    rows = [
+        MonthlySummary(user_id=user_id, year=year, month=month, category=category, type=type, currency=currency, total=total, count=count)
+        for (user_id, year, month, category, type, currency), (total, count) in expected_rows(user).items()
+    ]
+    with db_transaction.atomic():
+        summaries = MonthlySummary.objects.all()
+        if user is not None:
+            summaries = summaries.filter(user=user)
+        income.forget(set(summaries.filter(type='Income').values_list('user_id', 'year', 'month')))
+        income.forget({(row.user_id, row.year, row.month) for row in rows if row.type == 'Income'})
+        summaries.delete()
+        MonthlySummary.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def verify(user=None):
+    """
+    Compares MonthlySummary against Transaction.
+    Returns a list of (key, expected, actual) for every mismatching key, empty when consistent.
+    """
+    summaries = MonthlySummary.objects.all()
+    if user is not None:
+        summaries = summaries.filter(user=user)
+    actual = {
+        (s.user_id, s.year, s.month, s.category, s.type, s.currency): (s.total, s.count)
+        for s in summaries
+    }
+    expected = expected_rows(user)
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in sorted(set(expected) | set(actual))
+        if expected.get(key) != actual.get(key)
+    ]
@@ -0,0 +1,169 @@
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import OutboxEmail
+from . import jobs
+
+# Transactional email outbox. Requests write the email to OutboxEmail (in the same transaction as
+# the data it is about) and queue an 'outbox.send' job, one queued job however many emails are
+# queued; a running sender gives its dedupe key up, so emails written meanwhile get a job of their
+# own. The worker delivers due emails in batches, each batch over one connection of EMAIL_BACKEND
+# opened once and reused for every message. A message that fails is retried with
+# exponential backoff and jitter, the rest of the batch still goes out. A batch is claimed in a
+# short transaction (FOR UPDATE SKIP LOCKED) that moves its emails' next_attempt_at past a lease,
+# so concurrent senders never pick the same email, and is sent with no transaction or row lock
+# held; the results are then recorded for the emails still under that claim. Emails of a sender
+# that dies become due again when the lease runs out and are delivered again (at least once).
+BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 50)
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+# Seconds a claimed batch has to be sent before other senders may claim its emails again
+LEASE = getattr(settings, 'OUTBOX_LEASE', 15 * 60)
+# Seconds before the first retry, doubled for each later one up to RETRY_MAX
+RETRY_BASE = 30
+RETRY_MAX = 60 * 60
+# Sent emails are deleted after this many seconds, they may hold one-time codes
+RETENTION = getattr(settings, 'OUTBOX_RETENTION', 24 * 60 * 60)
+ERROR_LENGTH = 2000
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, to, from_email=None):
+    """
+    Writes an email to the outbox and queues its delivery, both visible once the current transaction commits.
+    Emails queued while a send job is queued share it. Returns the OutboxEmail.
+    """
+    email = OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+    jobs.enqueue('outbox.send', dedupe_key='outbox:send')
+    return email
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX, RETRY_BASE * 2 ** max(attempts - 1, 0)) * random.uniform(0.5, 1.0)
+
+
+def _failed(email, error, now):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"[:ERROR_LENGTH]
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+        logger.error('Email %s to %s failed after %d attempt(s): %s', email.pk, email.to, email.attempts, error)
+    else:
+        email.next_attempt_at = now + timedelta(seconds=retry_delay(email.attempts))
+        logger.warning('Email %s to %s failed (attempt %d/%d): %s', email.pk, email.to, email.attempts, MAX_ATTEMPTS, error)
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Claims up to batch_size due emails for LEASE seconds in a short transaction.
+    Returns (emails, lease), lease being the claimed emails' next_attempt_at.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=LEASE)
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return [], lease
+        # Conditional on the due date, backends without SKIP LOCKED may have handed the rows to another sender too
+        OutboxEmail.objects.filter(id__in=ids, status='pending', next_attempt_at__lte=now).update(next_attempt_at=lease)
+    return list(OutboxEmail.objects.filter(id__in=ids, status='pending', next_attempt_at=lease).order_by('id')), lease
+
+
+def _deliver(emails, connection, now):
+    # Sends the claimed emails over one connection and updates them in memory, returns (sent, failed)
+    sent = failed = 0
+    try:
+        # Opened once here, send_messages leaves a connection it did not open itself open
+        connection.open()
+    except Exception as error:
+        # Nothing could be sent, every email of the batch is retried
+        for email in emails:
+            _failed(email, error, now)
+        return 0, len(emails)
+    try:
+        for index, email in enumerate(emails):
+            message = EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection)
+            try:
+                connection.send_messages([message])
+            except Exception as error:
+                _failed(email, error, now)
+                failed += 1
+                # The failure may have broken the session, the rest of the batch goes over a new one
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as error:
+                    for remaining in emails[index + 1:]:
+                        _failed(remaining, error, now)
+                    failed += len(emails) - index - 1
+                    break
+            else:
+                email.status = 'sent'
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def send_batch(batch_size=BATCH_SIZE, connection=None):
+    """
+    Delivers up to batch_size due emails over one connection, outside any transaction.
+    Returns (sent, failed attempts); (0, 0) when nothing is due.
+    """
+    emails, lease = claim(batch_size)
+    if not emails:
+        return 0, 0
+    sent, failed = _deliver(emails, connection or get_connection(fail_silently=False), timezone.now())
+    with transaction.atomic():
+        # Emails whose lease ran out mid-batch may belong to another sender by now
+        owned = set(
+            OutboxEmail.objects.select_for_update()
+            .filter(id__in=[email.pk for email in emails], status='pending', next_attempt_at=lease)
+            .values_list('id', flat=True)
+        )
+        OutboxEmail.objects.bulk_update(
+            [email for email in emails if email.pk in owned],
+            ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'],
+        )
+    return sent, failed
+
+
+def send_pending(batch_size=BATCH_SIZE):
+    """
+    Sends batches until no email is due and queues a job for the earliest retry.
+    Returns the number sent.
+    """
+    total = 0
+    while True:
+        sent, failed = send_batch(batch_size)
+        total += sent
+        if not sent and not failed:
+            break
+    retry_at = OutboxEmail.objects.filter(status='pending').order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+    if retry_at is not None:
+        jobs.enqueue('outbox.send', run_at=retry_at, dedupe_key='outbox:retry')
+    return total
+
+
+def prune(now=None):
+    now = now or timezone.now()
+    deleted, _ = OutboxEmail.objects.filter(status='sent', sent_at__lt=now - timedelta(seconds=RETENTION)).delete()
+    return deleted
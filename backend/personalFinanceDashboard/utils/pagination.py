@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import date
+
+from django.db.models import F, Q
+
+# Keyset pagination over the (date, name, category, id) ordering used by the transactions list.
+# The cursor is an opaque urlsafe base64 blob of the last row's sort key.
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+KEYSET_ORDERING = ('date', 'name', F('category').asc(nulls_last=True), 'id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(transaction):
+    key = [transaction.date.isoformat(), transaction.name, transaction.category, transaction.id]
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_str, name, category, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return date.fromisoformat(date_str), str(name), category, int(pk)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor.')
+
+
+def get_page_size(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def _after(cursor_date, name, category, pk):
+    # Rows strictly after the cursor key. Categories sort NULLS LAST, so nothing follows a
+    # null category within the same (date, name) and every null follows a non-null one.
+    if category is None:
+        same_category = Q(category__isnull=True)
+        later_category = Q(pk__in=[])
+    else:
+        same_category = Q(category=category)
+        later_category = Q(category__gt=category) | Q(category__isnull=True)
+    return (
+        Q(date__gt=cursor_date)
+        | Q(date=cursor_date, name__gt=name)
+        | (Q(date=cursor_date, name=name) & later_category)
+        | (Q(date=cursor_date, name=name, id__gt=pk) & same_category)
+    )
+
+
+def apply_cursor(queryset, cursor=None):
+    # Orders by the keyset and keeps only the rows after the cursor
+    queryset = queryset.order_by(*KEYSET_ORDERING)
+    if cursor:
+        cursor_date, name, category, pk = decode_cursor(cursor)
+        # The leading date bound keeps the predicate a range scan on the composite index
+        queryset = queryset.filter(date__gte=cursor_date).filter(_after(cursor_date, name, category, pk))
+    return queryset
+
+
+def paginate_keyset(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Returns (rows, next_cursor) for one page of a transaction queryset.
+    Raises InvalidCursor when the cursor cannot be decoded.
+    """
+    queryset = apply_cursor(queryset, cursor)
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor
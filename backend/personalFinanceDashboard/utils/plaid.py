@@ -1,138 +1,199 @@
-import plaid
-from plaid.api import plaid_api
-from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.transactions_get_request import TransactionsGetRequest
-from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
-from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
-from datetime import datetime, timedelta
-from plaid.model.products import Products
-from plaid.model.country_code import CountryCode
+import itertools
+import json
+import logging
+from datetime import date, datetime, timedelta
+from functools import wraps
+import urllib3
 from rest_framework.decorators import api_view
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 
+from ..models import PlaidItem, UserSettings
+from .exchange_rates import RateUnavailable
+from .plaid_client import get_client
+from . import balances, plaid_backfill, plaid_sync, tasks
 
-import environ
-env = environ.Env()
-environ.Env.read_env()
-from django.http import JsonResponse
+# The plaid package and its models are imported inside the views, see plaid_client
 
-configuration = plaid.Configuration(
-    host = plaid.Environment.Sandbox,
-    api_key={
-        'clientId': env('CLIENT_ID'),
-        'secret': env('SECRET'),
-    }
-)
-api_client = plaid.ApiClient(configuration)
-client = plaid_api.PlaidApi(api_client)
+logger = logging.getLogger(__name__)
+
+def plaid_errors(view):
+    # Plaid API errors become a 500 with the error message, timeouts and connection failures a 502
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        from plaid import ApiException
+        try:
+            return view(request, *args, **kwargs)
+        except ApiException as error:
+            return JsonResponse({'error': str(error)}, status=500)
+        except urllib3.exceptions.HTTPError as error:
+            return JsonResponse({'error': f'Plaid unavailable: {error}'}, status=502)
+    return wrapper
 
 @api_view(['POST'])
+@plaid_errors
 def create_link_token(request):
-    try:
-        link_token_request = LinkTokenCreateRequest(
-            user={
-                'client_user_id': 'shinedwardc'
-            },
-            client_name='expense-tracker',
-            products=[Products("auth"),Products("transactions")],
-            country_codes=[CountryCode("US")],
-            language='en'
-        )
-        response = client.link_token_create(link_token_request)
-        link_token = response['link_token']
-        return JsonResponse({'link_token': link_token})
-    except plaid.ApiException as error:
-        return JsonResponse({'error': str(error)}, status=500)
+    from plaid.model.link_token_create_request import LinkTokenCreateRequest
+    from plaid.model.products import Products
+    from plaid.model.country_code import CountryCode
+
+    link_token_request = LinkTokenCreateRequest(
+        user={
+            'client_user_id': 'shinedwardc'
+        },
+        client_name='expense-tracker',
+        products=[Products("auth"),Products("transactions")],
+        country_codes=[CountryCode("US")],
+        language='en'
+    )
+    response = get_client().link_token_create(link_token_request)
+    link_token = response['link_token']
+    return JsonResponse({'link_token': link_token})
 
 @api_view(['POST'])
+@plaid_errors
 def exchange_public_token(request):
-    try:
-        public_token = request.data.get('public_token')
-        if not public_token:
-            return JsonResponse({'error': 'Public token is required'}, status=400)
+    from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
+
+    public_token = request.data.get('public_token')
+    if not public_token:
+        return JsonResponse({'error': 'Public token is required'}, status=400)
 
-        exchange_request = ItemPublicTokenExchangeRequest(public_token=public_token)
-        exchange_response = client.item_public_token_exchange(exchange_request)
-        access_token = exchange_response['access_token']
-        return JsonResponse({'access_token': access_token})
-    except plaid.ApiException as error:
-        return JsonResponse({'error': str(error)}, status=500)
+    exchange_request = ItemPublicTokenExchangeRequest(public_token=public_token)
+    exchange_response = get_client().item_public_token_exchange(exchange_request)
+    access_token = exchange_response['access_token']
+    item_id = exchange_response['item_id']
+    # Kept per Item so transactions can be synced incrementally from its cursor
+    item, _ = PlaidItem.objects.update_or_create(item_id=item_id, defaults={'user': request.user, 'access_token': access_token})
+    # The initial history is pulled by a worker rather than in this request
+    tasks.enqueue_plaid_sync(item.pk)
+    return JsonResponse({'access_token': access_token, 'item_id': item_id})
+
+@api_view(['POST'])
+@plaid_errors
+def sync_transactions(request):
+    # Added, modified and removed transactions of the user's Items since their last sync
+    item_id = request.data.get('item_id')
+    if item_id:
+        item = PlaidItem.objects.filter(user=request.user, item_id=item_id).first()
+        if item is None:
+            return JsonResponse({'error': 'Plaid item not found'}, status=404)
+        items = {item.item_id: plaid_sync.sync_item(item)}
+    else:
+        items = plaid_sync.sync_user(request.user)
+    return JsonResponse({'items': items})
+
+def _stream_transactions(total, first, pages):
+    # {"total_transactions": n, "transactions": [...]} written page by page; a page failing after the
+    # response has started closes the array and reports it under "error" instead of cutting the body
+    yield '{"total_transactions": %d, "transactions": [' % total
+    separator = ''
+    sent = 0
+    try:
+        for page in itertools.chain([first], pages):
+            if page:
+                yield separator + ', '.join(json.dumps(t) for t in page)
+                separator = ', '
+                sent += len(page)
+    except Exception as error:
+        logger.warning('Plaid transactions page failed after %d of %d: %s', sent, total, error)
+        yield '], "error": %s}' % json.dumps(f'Plaid request failed after {sent} of {total} transactions')
+        return
+    yield ']}'
 
 @api_view(['GET'])
+@plaid_errors
 def get_transactions(request):
+    access_token = request.GET.get('access_token')
+    if not access_token:
+        return JsonResponse({'error': 'Access token is required'}, status=400)
+
+    # The last 30 days by default, start_date/end_date (YYYY-MM-DD) for a backfill
     try:
-        access_token = request.GET.get('access_token')
-        if not access_token:
-            return JsonResponse({'error': 'Access token is required'}, status=400)
-
-        # Set date range for the last 30 days
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=30)
-
-        request = TransactionsGetRequest(
-            access_token=access_token,
-            start_date=start_date,
-            end_date=end_date,
-            options=TransactionsGetRequestOptions(
-                count=100,
-                offset=0
-            )
-        )
-        response = client.transactions_get(request)
-        
-        transactions = response['transactions']
-        # Convert transactions to a serializable format
-        serializable_transactions = []
-        for transaction in transactions:
-            serializable_transaction = {
-                'id': transaction['transaction_id'],
-                'amount': transaction['amount'],
-                'currency': transaction['iso_currency_code'],
-                'date': transaction['date'],
-                'name': transaction['name'],
-                'merchant_name': transaction.get('merchant_name', ''),
-                'category': transaction['category'],
-                'payment_channel': transaction.get('payment_channel', ''),
-            }
-            serializable_transactions.append(serializable_transaction)
-        transactions = serializable_transactions
-        print('transactions: ', transactions)
-        return JsonResponse({'transactions': transactions})
-    except plaid.ApiException as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        end_date = date.fromisoformat(request.GET['end_date']) if request.GET.get('end_date') else datetime.now().date()
+        start_date = date.fromisoformat(request.GET['start_date']) if request.GET.get('start_date') else end_date - timedelta(days=30)
+    except ValueError:
+        return JsonResponse({'error': 'start_date and end_date must be YYYY-MM-DD'}, status=400)
+    if start_date > end_date:
+        return JsonResponse({'error': 'start_date must not be after end_date'}, status=400)
+
+    # Every page of the range: the first one here so Plaid errors still get their status,
+    # the rest fetched concurrently while the response streams
+    total, first = plaid_backfill.first_page(access_token, start_date, end_date)
+    pages = plaid_backfill.remaining_pages(access_token, start_date, end_date, total)
+    return StreamingHttpResponse(_stream_transactions(total, first, pages), content_type='application/json')
+
+def _serialize_account(account):
+    return {
+        'account_id': account['account_id'],
+        'balances': {
+            'available': account['balances']['available'],
+            'current': account['balances']['current'],
+            'iso_currency_code': account['balances']['iso_currency_code'],
+            'limit': account['balances'].get('limit'),
+        },
+        'mask': account.get('mask'),
+        'name': account['name'],
+        'persistent_account_id': account.get('persistent_account_id'),
+        'official_name': account.get('official_name'),
+        'type': str(account['type']),
+        'subtype': str(account.get('subtype')),
+    }
+
+def _serialize_snapshot(snapshot):
+    return {
+        'account_id': snapshot.account_id,
+        'balances': {
+            'available': snapshot.available,
+            'current': snapshot.current,
+            'iso_currency_code': snapshot.currency,
+            'limit': snapshot.limit,
+        },
+        'mask': snapshot.mask,
+        'name': snapshot.name,
+        'persistent_account_id': snapshot.persistent_account_id,
+        'official_name': snapshot.official_name,
+        'type': snapshot.type,
+        'subtype': str(snapshot.subtype),
+    }
 
 @api_view(['GET'])
+@plaid_errors
 def get_balance(request):
-    try:
-        access_token = request.GET.get('access_token')
-        if not access_token:
-            return JsonResponse({'error': 'Access token is required'}, status=400)
-
-        request = AccountsBalanceGetRequest(access_token=access_token)
-        response = client.accounts_balance_get(request)
-        print('response: ', response)
-        accounts = response['accounts']
-        # Convert accounts to a serializable format
-        serializable_accounts = []
-        for account in accounts:
-            serializable_account = {
-                'account_id': account['account_id'],
-                'balances': {
-                    'available': account['balances']['available'],
-                    'current': account['balances']['current'],
-                    'iso_currency_code': account['balances']['iso_currency_code'],
-                    'limit': account['balances'].get('limit'),
-                },
-                'mask': account.get('mask'),
-                'name': account['name'],
-                'persistent_account_id': account.get('persistent_account_id'),
-                'official_name': account.get('official_name'),
-                'type': str(account['type']),
-                'subtype': str(account.get('subtype')),
-            }
-            serializable_accounts.append(serializable_account)
-        
-        return JsonResponse({'accounts': serializable_accounts})
-    except plaid.ApiException as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    item_id = request.GET.get('item_id')
+    access_token = request.GET.get('access_token')
+    if not item_id and not access_token:
+        return JsonResponse({'error': 'Access token is required'}, status=400)
 
+    items = PlaidItem.objects.filter(user=request.user)
+    item = items.filter(item_id=item_id).first() if item_id else items.filter(access_token=access_token).first()
+    if item is None:
+        if item_id:
+            return JsonResponse({'error': 'Plaid item not found'}, status=404)
+        # A token without a stored Item is fetched live and not kept
+        accounts = balances.fetch(access_token)
+        return JsonResponse({'accounts': [_serialize_account(account) for account in accounts], 'fetched_at': timezone.now(), 'stale': False})
+
+    # Served from the latest snapshot, a stale one is refreshed in the background
+    snapshots, stale = balances.get_balances(item)
+    return JsonResponse({
+        'accounts': [_serialize_snapshot(snapshot) for snapshot in snapshots],
+        'fetched_at': snapshots[0].fetched_at if snapshots else None,
+        'stale': stale,
+    })
+
+@api_view(['GET'])
+def net_worth_history(request):
+    # Net worth per day from the stored balance snapshots, in the display currency when set
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({'error': 'start and end must be YYYY-MM-DD'}, status=400)
+    currency = UserSettings.objects.filter(user=request.user).values_list('display_currency', flat=True).first()
+    currency = currency.upper() if currency else None
+    try:
+        history = balances.net_worth_history(request.user, start, end, currency)
+    except RateUnavailable as error:
+        return JsonResponse({'error': str(error)}, status=503)
+    return JsonResponse({'currency': currency, 'history': history})
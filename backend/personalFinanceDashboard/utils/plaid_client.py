@@ -0,0 +1,69 @@
+import os
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Lazily built Plaid client. Importing the plaid package loads every generated model (a few hundred
+# milliseconds), so nothing from it is imported until the first Plaid call, and the client is built
+# once per process: threads share it (urllib3's pool is thread safe) and a forked worker builds its own.
+HOSTS = {'sandbox': 'https://sandbox.plaid.com', 'production': 'https://production.plaid.com'}
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def plaid_host():
+    # PLAID_HOST wins over PLAID_ENV, e.g. a local stub server in tests
+    host = getattr(settings, 'PLAID_HOST', '')
+    if host:
+        return host.rstrip('/')
+    environment = getattr(settings, 'PLAID_ENV', 'sandbox')
+    if environment not in HOSTS:
+        raise ImproperlyConfigured(f"PLAID_ENV must be one of {', '.join(HOSTS)}.")
+    return HOSTS[environment]
+
+
+def build_client(host=None, client_id=None, secret=None, pool_size=None, timeout=None):
+    import plaid
+    from plaid.api import plaid_api
+
+    default_timeout = timeout if timeout is not None else getattr(settings, 'PLAID_TIMEOUT', (3.05, 30))
+
+    class ApiClient(plaid.ApiClient):
+        # Applies the default timeout to calls that do not pass their own _request_timeout
+        def request(self, *args, _request_timeout=None, **kwargs):
+            return super().request(*args, _request_timeout=_request_timeout or default_timeout, **kwargs)
+
+    api_key = {
+        'clientId': client_id if client_id is not None else getattr(settings, 'PLAID_CLIENT_ID', ''),
+        'secret': secret if secret is not None else getattr(settings, 'PLAID_SECRET', ''),
+    }
+    if not all(api_key.values()):
+        raise ImproperlyConfigured('PLAID_CLIENT_ID and PLAID_SECRET must be set.')
+    configuration = plaid.Configuration(host=host or plaid_host(), api_key=api_key)
+    # Connections kept per host, bounds concurrent requests from this process without reconnecting
+    configuration.connection_pool_maxsize = pool_size or getattr(settings, 'PLAID_POOL_SIZE', 10)
+    return plaid_api.PlaidApi(ApiClient(configuration))
+
+
+def get_client():
+    """
+    The process' PlaidApi, built on first use from the PLAID_* settings.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = build_client()
+                _client_pid = pid
+    return _client
+
+
+def reset_client():
+    # Drops the client so the next call rebuilds it, e.g. after changing settings in tests
+    global _client
+    with _lock:
+        _client = None
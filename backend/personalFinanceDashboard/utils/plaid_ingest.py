@@ -0,0 +1,95 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+
+from ..models import Transaction, UserDataVersion
+from . import monthly_summary, response_cache, sync
+
+# Stores normalized Plaid transactions (plaid_sync.normalize) as Transaction rows keyed by
+# (user, external_id). Each chunk costs one probe of the unique index for the rows it may touch;
+# only new or changed rows are written, with a single INSERT ... ON CONFLICT DO UPDATE, so
+# re-ingesting the same data writes nothing. Removed ids are deleted in bulk like the DELETE
+# endpoint does, with the MonthlySummary rollup, tombstones and caches kept in step.
+CHUNK_SIZE = 1000
+UPDATE_FIELDS = ['name', 'type', 'category', 'amount', 'currency', 'date', 'source_account']
+CENTS = Decimal('0.01')
+
+
+def to_transaction(user, plaid_transaction):
+    # Plaid amounts are positive for money leaving the account, negative for money coming in
+    amount = Decimal(str(plaid_transaction['amount'])).quantize(CENTS)
+    category = plaid_transaction.get('category')
+    if isinstance(category, list):
+        category = category[0] if category else None
+    return Transaction(
+        user=user,
+        external_id=plaid_transaction['id'],
+        source_account=plaid_transaction.get('account_id'),
+        name=(plaid_transaction.get('merchant_name') or plaid_transaction['name'])[:150],
+        type='Income' if amount < 0 else 'Expense',
+        category=category[:150] if category else None,
+        amount=abs(amount),
+        currency=(plaid_transaction.get('currency') or 'usd').lower()[:3],
+        date=date.fromisoformat(str(plaid_transaction['date'])),
+    )
+
+
+def _changed(existing, incoming):
+    return any(getattr(existing, field) != getattr(incoming, field) for field in UPDATE_FIELDS)
+
+
+def _upsert(user, rows):
+    # rows: {external_id: Transaction} of one chunk, returns (created, updated)
+    existing = {t.external_id: t for t in Transaction.objects.filter(user=user, external_id__in=list(rows))}
+    writes = [row for external_id, row in rows.items() if external_id not in existing or _changed(existing[external_id], row)]
+    if not writes:
+        return 0, 0
+    Transaction.objects.bulk_create(
+        writes,
+        update_conflicts=True,
+        unique_fields=['user', 'external_id'],
+        update_fields=[*UPDATE_FIELDS, 'updated_at'],
+    )
+    before = [existing[row.external_id] for row in writes if row.external_id in existing]
+    monthly_summary.record_updated(before, writes)
+    return len(writes) - len(before), len(before)
+
+
+def _remove(user, external_ids):
+    deleted = Transaction.objects.filter(user=user, external_id__in=external_ids)
+    ids = list(deleted.values_list('id', flat=True))
+    if not ids:
+        return 0
+    monthly_summary.record_queryset_deleted(deleted)
+    sync.record_deleted(user, ids)
+    Transaction.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def ingest(user, added=(), modified=(), removed=()):
+    """
+    Upserts added and modified Plaid transactions and deletes removed ids, in one transaction.
+    Returns {'created', 'updated', 'unchanged', 'removed'} counts.
+    """
+    # Later entries win, a transaction modified within the same walk it was added in
+    rows = {}
+    for plaid_transaction in [*added, *modified]:
+        row = to_transaction(user, plaid_transaction)
+        rows[row.external_id] = row
+    removed = list(dict.fromkeys(removed))
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+    external_ids = list(rows)
+    with response_cache.batch_invalidation(), db_transaction.atomic():
+        for i in range(0, len(external_ids), CHUNK_SIZE):
+            chunk = {external_id: rows[external_id] for external_id in external_ids[i:i + CHUNK_SIZE]}
+            created, updated = _upsert(user, chunk)
+            counts['created'] += created
+            counts['updated'] += updated
+            counts['unchanged'] += len(chunk) - created - updated
+        for i in range(0, len(removed), CHUNK_SIZE):
+            counts['removed'] += _remove(user, removed[i:i + CHUNK_SIZE])
+        if counts['created'] or counts['updated'] or counts['removed']:
+            UserDataVersion.bump(user.id)
+            response_cache.invalidate(user.id)
+    return counts
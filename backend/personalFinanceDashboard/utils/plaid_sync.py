@@ -0,0 +1,92 @@
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import PlaidItem
+from . import plaid_ingest
+from .plaid_client import get_client
+
+# Incremental transaction sync of a PlaidItem with /transactions/sync. Each run pages from the
+# stored cursor until has_more is false and only then stores the new cursor, so an interrupted run
+# is simply repeated. Pages are read as raw JSON (_preload_content=False) instead of being
+# deserialized into the generated models, which dominate the cost of large pages.
+SYNC_PAGE_SIZE = 500
+# Walks restarted from the stored cursor when Plaid reports a mutation during pagination
+MAX_RESTARTS = 3
+MUTATION_DURING_PAGINATION = 'TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION'
+
+
+def normalize(transaction):
+    # Serializable subset of a Plaid transaction, the shape the transaction endpoints return
+    return {
+        'id': transaction['transaction_id'],
+        'account_id': transaction.get('account_id'),
+        'amount': transaction['amount'],
+        'currency': transaction.get('iso_currency_code') or transaction.get('unofficial_currency_code'),
+        'date': transaction['date'],
+        'name': transaction['name'],
+        'merchant_name': transaction.get('merchant_name') or '',
+        'category': transaction.get('category'),
+        'payment_channel': transaction.get('payment_channel') or '',
+        'pending': transaction.get('pending', False),
+    }
+
+
+def _error_code(error):
+    try:
+        return json.loads(error.body).get('error_code')
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def fetch_changes(access_token, cursor=''):
+    """
+    Pages /transactions/sync from cursor to the end.
+    Returns (added, modified, removed ids, next cursor) with normalized transactions.
+    """
+    from plaid import ApiException
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
+
+    client = get_client()
+    for attempt in range(MAX_RESTARTS + 1):
+        added, modified, removed = [], [], []
+        next_cursor = cursor
+        try:
+            while True:
+                params = {'access_token': access_token, 'count': SYNC_PAGE_SIZE}
+                if next_cursor:
+                    params['cursor'] = next_cursor
+                response = client.transactions_sync(TransactionsSyncRequest(**params), _preload_content=False)
+                page = json.loads(response.data)
+                added.extend(normalize(t) for t in page['added'])
+                modified.extend(normalize(t) for t in page['modified'])
+                removed.extend(r['transaction_id'] for r in page['removed'])
+                next_cursor = page['next_cursor']
+                if not page['has_more']:
+                    return added, modified, removed, next_cursor
+        except ApiException as error:
+            # The Item changed between pages, every page since cursor has to be fetched again
+            if _error_code(error) != MUTATION_DURING_PAGINATION or attempt == MAX_RESTARTS:
+                raise
+
+
+def sync_item(item):
+    """
+    Pulls the changes of a PlaidItem since its last sync, stores them as Transactions and advances its cursor.
+    Returns {'added', 'modified', 'removed', 'cursor', 'stored'}, stored is None when a concurrent sync won.
+    """
+    added, modified, removed, cursor = fetch_changes(item.access_token, item.cursor)
+    stored = None
+    with transaction.atomic():
+        # Stored and advanced only from the cursor the walk started at, a concurrent sync of the same Item wins
+        if PlaidItem.objects.select_for_update().filter(pk=item.pk, cursor=item.cursor).exists():
+            stored = plaid_ingest.ingest(item.user, added, modified, removed)
+            PlaidItem.objects.filter(pk=item.pk).update(cursor=cursor, last_synced_at=timezone.now())
+            item.cursor = cursor
+    return {'added': added, 'modified': modified, 'removed': removed, 'cursor': cursor, 'stored': stored}
+
+
+def sync_user(user):
+    # Syncs every Item of a user, {item_id: result}
+    return {item.item_id: sync_item(item) for item in PlaidItem.objects.filter(user=user).select_related('user')}
@@ -0,0 +1,212 @@
+import csv
+import operator
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import reduce
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Min, Q
+
+from ..models import ExchangeRate
+from .exchange_rates import PIVOT, RATE_PLACES, RateUnavailable
+
+# Date-accurate conversion over the daily ExchangeRate history. An amount dated d converts at the
+# latest rate on or before d ("as of" d), taken from the pair, its inverse or the cross through
+# EXCHANGE_RATE_PIVOT (the base histories are usually published against), whichever has the most
+# recent rate on or before d.
+# Conversions of many rows load every needed series with two queries and resolve the as-of rates
+# with one searchsorted per currency, so the cost follows the number of currencies, not of rows.
+LOAD_BATCH_SIZE = 5000
+NOT_SEEN = np.iinfo(np.int64).min
+
+
+def _pairs(currencies, quote):
+    return (
+        Q(base__in=currencies, quote=quote)
+        | Q(base=quote, quote__in=currencies)
+        | Q(base=PIVOT, quote__in=set(currencies) | {quote})
+    )
+
+
+def _as_of(series, days):
+    # Rates of a (dates, rates) series as of each day; days before the first rate take the first rate
+    dates, rates = series
+    index = np.searchsorted(dates, days, side='right') - 1
+    return rates[np.maximum(index, 0)]
+
+
+def rate_history(currencies, quote, start, end):
+    """
+    {currency: (dates, rates)} of the currency -> quote rate as numpy arrays, from the last rate
+    on or before start through end, or from the first rate after end for a pair with none before.
+    Currencies without any usable rates are left out.
+    """
+    quote = quote.upper()
+    currencies = {currency.upper() for currency in currencies} - {quote}
+    if not currencies:
+        return {}
+    pairs = _pairs(currencies, quote)
+    # Last day on or before start of every pair, one grouped probe of the (base, quote, date) index
+    seeds = (
+        ExchangeRate.objects.filter(pairs, date__lte=start)
+        .values('base', 'quote').annotate(seed=Max('date')).order_by()
+    )
+    first = min((row['seed'] for row in seeds), default=start)
+    rows = (
+        ExchangeRate.objects.filter(pairs, date__gte=first, date__lte=end)
+        .order_by('date').values_list('base', 'quote', 'date', 'rate')
+    )
+    raw = defaultdict(lambda: ([], []))
+    for base, rate_quote, day, rate in rows:
+        raw[(base, rate_quote)][0].append(day)
+        raw[(base, rate_quote)][1].append(float(rate))
+    history = _resolve(raw, currencies, quote)
+    if set(history) != currencies:
+        # Pairs whose history only starts after end, their first rate applies to earlier days too
+        later = (
+            ExchangeRate.objects.filter(pairs, date__gt=end)
+            .values('base', 'quote').annotate(first=Min('date')).order_by()
+        )
+        firsts = [Q(base=row['base'], quote=row['quote'], date=row['first']) for row in later if (row['base'], row['quote']) not in raw]
+        if firsts:
+            for base, rate_quote, day, rate in ExchangeRate.objects.filter(reduce(operator.or_, firsts)).values_list('base', 'quote', 'date', 'rate'):
+                raw[(base, rate_quote)][0].append(day)
+                raw[(base, rate_quote)][1].append(float(rate))
+            history = _resolve(raw, currencies, quote)
+    return history
+
+
+def _observed(series, days):
+    # (day of the latest rate on or before each day as an integer, None before the first, as-of rate)
+    dates, rates = series
+    index = np.searchsorted(dates, days, side='right') - 1
+    seen = np.where(index >= 0, dates.astype(np.int64)[np.maximum(index, 0)], NOT_SEEN)
+    return seen, rates[np.maximum(index, 0)]
+
+
+def _resolve(raw, currencies, quote):
+    """
+    Rate series of each currency into quote from the loaded {(base, quote): (dates, rates)} lists.
+    The pair itself, its inverse and the cross through PIVOT are all candidates; each day takes the
+    one with the most recent rate on or before it, the pair first on a tie. A pair with a single
+    recent rate so only applies from that day on and never overrides older pivot history.
+    """
+    series = {pair: (np.array(dates, dtype='datetime64[D]'), np.array(rates)) for pair, (dates, rates) in raw.items()}
+    history = {}
+    for currency in currencies:
+        candidates = []
+        if (currency, quote) in series:
+            candidates.append((series[(currency, quote)],))
+        if (quote, currency) in series:
+            dates, rates = series[(quote, currency)]
+            candidates.append(((dates, 1 / rates),))
+        if PIVOT not in (currency, quote) and (PIVOT, quote) in series and (PIVOT, currency) in series:
+            candidates.append((series[(PIVOT, quote)], series[(PIVOT, currency)]))
+        if not candidates:
+            continue
+        days = np.unique(np.concatenate([legs[0] for candidate in candidates for legs in candidate]))
+        seen, rates = [], []
+        for candidate in candidates:
+            observed = [_observed(legs, days) for legs in candidate]
+            # A cross rate is as old as its older leg
+            seen.append(np.minimum.reduce([leg_seen for leg_seen, _ in observed]))
+            rates.append(observed[0][1] / observed[1][1] if len(observed) == 2 else observed[0][1])
+        best = np.argmax(np.array(seen), axis=0)
+        history[currency] = (days, np.array(rates)[best, np.arange(len(days))])
+    return history
+
+
+def convert_many(currencies, days, amounts, quote):
+    """
+    Converts amounts in per-row currencies into quote at the rate of each row's day.
+    Takes equal length sequences, returns a float numpy array.
+    Raises RateUnavailable when a currency has no rates to quote at all.
+    """
+    quote = quote.upper()
+    codes, currency_index = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+    codes = [code.upper() for code in codes.tolist()]
+    days = np.asarray(days, dtype='datetime64[D]')
+    converted = np.asarray(amounts, dtype=float).copy()
+    needed = set(codes) - {quote}
+    if not needed:
+        return converted
+    history = rate_history(needed, quote, days.min().item(), days.max().item())
+    missing = needed - set(history)
+    if missing:
+        raise RateUnavailable(f"No {', '.join(sorted(missing))} to {quote} rates.")
+    for i, code in enumerate(codes):
+        if code in needed:
+            rows = currency_index == i
+            converted[rows] *= _as_of(history[code], days[rows])
+    return converted
+
+
+def rates_on(currencies, days, quote):
+    """
+    As-of rate into quote of each (currency, day) pair as a Decimal at RATE_PLACES, the precision
+    rates are stored at, for conversions kept in Decimal. Takes equal length sequences.
+    Raises RateUnavailable when a currency has no rates to quote at all.
+    """
+    if not len(currencies):
+        return []
+    return [Decimal(str(rate)).quantize(RATE_PLACES) for rate in convert_many(currencies, days, np.ones(len(currencies)), quote).tolist()]
+
+
+def rate_on(base, quote, day):
+    # As-of rate of one pair, for single conversions
+    base, quote = base.upper(), quote.upper()
+    if base == quote:
+        return Decimal(1)
+    return rates_on([base], [day], quote)[0]
+
+
+def _parse_rows(reader, base=None):
+    # Long format (date, base, quote, rate) or wide format (date, one column per quote) with a given base
+    fields = [field.strip().lower() for field in reader.fieldnames or []]
+    long_format = {'date', 'base', 'quote', 'rate'} <= set(fields)
+    if not long_format and not base:
+        raise ValueError("Expected date, base, quote, rate columns, or a base for one column per quote.")
+    for line, row in enumerate(reader, start=2):
+        row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+        try:
+            day = date.fromisoformat(row.pop('date'))
+            if long_format:
+                quotes = {row['quote'].upper(): row['rate']}
+                row_base = row['base'].upper()
+            else:
+                quotes = {column.upper(): value for column, value in row.items() if value}
+                row_base = base.upper()
+            for quote, value in quotes.items():
+                rate = Decimal(value)
+                if not rate.is_finite() or rate <= 0:
+                    raise ValueError(f"non-positive rate {value}")
+                yield ExchangeRate(date=day, base=row_base, quote=quote, rate=rate.quantize(RATE_PLACES))
+        except (KeyError, ValueError, InvalidOperation) as e:
+            raise ValueError(f"Line {line}: {e}")
+
+
+def load_csv(file, base=None, batch_size=LOAD_BATCH_SIZE):
+    """
+    Bulk loads a CSV of daily rates, upserting on (base, quote, date) in chunks.
+    Returns the number of rates written. Nothing is written when a line is malformed.
+    """
+    written = 0
+    batch = []
+    with transaction.atomic():
+        for rate in _parse_rows(csv.DictReader(file), base):
+            batch.append(rate)
+            if len(batch) >= batch_size:
+                written += _upsert(batch)
+                batch = []
+        if batch:
+            written += _upsert(batch)
+    return written
+
+
+def _upsert(rates):
+    # A key repeated within one ON CONFLICT statement is an error on PostgreSQL, the last line wins
+    rates = list({(rate.base, rate.quote, rate.date): rate for rate in rates}.values())
+    ExchangeRate.objects.bulk_create(rates, update_conflicts=True, unique_fields=['base', 'quote', 'date'], update_fields=['rate'])
+    return len(rates)
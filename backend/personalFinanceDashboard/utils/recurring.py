@@ -0,0 +1,101 @@
+import numpy as np
+
+from ..models import Transaction
+from . import response_cache
+
+# Expansion of recurring transactions (frequency + period) into dated occurrences.
+# A recurring transaction repeats every month or year from its own date, `period` times when set
+# and indefinitely otherwise. Days past the end of a shorter month are clamped to its last day,
+# so a subscription started on Jan 31 falls on Feb 28/29 and returns to the 31st in March.
+FREQUENCY_MONTHS = {'monthly': 1, 'yearly': 12}
+# Upper bound on the requested window, keeps the output size bounded
+MAX_WINDOW_DAYS = 366 * 10
+RECURRING_FIELDS = ('id', 'name', 'type', 'category', 'amount', 'currency', 'frequency', 'period', 'date')
+
+
+def recurring_items(user, end=None):
+    items = Transaction.objects.filter(user=user, frequency__in=FREQUENCY_MONTHS)
+    if end:
+        items = items.filter(date__lte=end)
+    return list(items.order_by('date', 'id').values(*RECURRING_FIELDS))
+
+
+def expand(items, start, end):
+    """
+    Vectorized expansion of recurring items into occurrences within [start, end].
+    Returns (item index, occurrence number, date) arrays sorted by date; occurrence 0 is the
+    original transaction itself.
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[D]'))
+    if not items or start > end:
+        return empty
+    first = np.array([item['date'] for item in items], dtype='datetime64[D]')
+    step = np.array([FREQUENCY_MONTHS[item['frequency']] for item in items], dtype=np.int64)
+    # A missing period repeats forever, a non-positive one is treated as the single original charge
+    period = np.array([
+        int(item['period']) if item['period'] is not None else np.iinfo(np.int64).max
+        for item in items
+    ], dtype=np.int64)
+    period = np.maximum(period, 1)
+
+    first_month = first.astype('datetime64[M]')
+    day_offset = (first - first_month.astype('datetime64[D]')).astype(np.int64)
+    window_start = np.datetime64(start, 'D')
+    window_end = np.datetime64(end, 'D')
+    start_month = window_start.astype('datetime64[M]')
+    end_month = window_end.astype('datetime64[M]')
+
+    # Range of occurrence numbers whose month falls inside the window, per item
+    months_to_start = (start_month - first_month).astype(np.int64)
+    months_to_end = (end_month - first_month).astype(np.int64)
+    k_min = np.maximum(0, -(-months_to_start // step))
+    k_max = np.minimum(period - 1, np.floor_divide(months_to_end, step))
+    counts = np.maximum(k_max - k_min + 1, 0)
+    total = int(counts.sum())
+    if not total:
+        return empty
+
+    # Ragged arange: one row per (item, k) without a Python loop
+    index = np.repeat(np.arange(len(items)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    k = k_min[index] + offsets
+
+    month = first_month[index] + (k * step[index]).astype('timedelta64[M]')
+    month_start = month.astype('datetime64[D]')
+    days_in_month = ((month + 1).astype('datetime64[D]') - month_start).astype(np.int64)
+    dates = month_start + np.minimum(day_offset[index], days_in_month - 1).astype('timedelta64[D]')
+
+    # The window's edge months can hold occurrences just outside the exact bounds
+    inside = (dates >= window_start) & (dates <= window_end)
+    index, k, dates = index[inside], k[inside], dates[inside]
+    order = np.lexsort((index, dates))
+    return index[order], k[order], dates[order]
+
+
+def get_occurrences(user, start, end):
+    """
+    Occurrences of the user's recurring transactions between start and end inclusive,
+    cached under the user's response cache generation so any transaction write invalidates them.
+    """
+    key = response_cache.user_key(user.id, f"occurrences:{start.isoformat()}:{end.isoformat()}")
+    occurrences = response_cache.lookup(key)
+    if occurrences is not None:
+        return occurrences
+    items = recurring_items(user, end)
+    index, k, dates = expand(items, start, end)
+    occurrences = [
+        {
+            'transaction_id': items[i]['id'],
+            'occurrence': n,
+            'date': d,
+            'name': items[i]['name'],
+            'type': items[i]['type'],
+            'category': items[i]['category'],
+            'amount': items[i]['amount'],
+            'currency': items[i]['currency'],
+            'frequency': items[i]['frequency'],
+        }
+        for i, n, d in zip(index.tolist(), k.tolist(), dates.tolist())
+    ]
+    response_cache.store(key, occurrences)
+    return occurrences
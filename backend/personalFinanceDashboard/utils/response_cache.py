@@ -0,0 +1,106 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Per-user cache of read endpoint responses. Every key embeds the user's generation counter,
+# so bumping the counter on a write orphans all of that user's entries at once and the backend's
+# own eviction (LRU for locmem, redis and memcached) reclaims them.
+# The counter lives in the same cache as the entries, use a shared backend when running more than one process.
+CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_local = threading.local()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_key(user_id):
+    return f"response-cache:generation:{user_id}"
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        counters = dict(_stats)
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else None
+    return counters
+
+
+def get_generation(user_id):
+    cache = _cache()
+    generation = cache.get(_generation_key(user_id))
+    if generation is None:
+        # Seed from the clock so a counter lost to eviction never reuses an older generation
+        cache.add(_generation_key(user_id), time.time_ns(), timeout=None)
+        generation = cache.get(_generation_key(user_id))
+    return generation
+
+
+def _bump(user_id):
+    cache = _cache()
+    try:
+        cache.incr(_generation_key(user_id))
+    except ValueError:
+        cache.set(_generation_key(user_id), time.time_ns(), timeout=None)
+    _count('invalidations')
+
+
+def invalidate(user_id):
+    # Deferred to commit, otherwise a concurrent read could cache pre-commit data under the new generation
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch.add(user_id)
+    else:
+        transaction.on_commit(lambda: _bump(user_id))
+
+
+def batching():
+    # Inside batch_invalidation, whose caller bumps the user's data version once for the whole write
+    return getattr(_local, 'batch', None) is not None
+
+
+@contextmanager
+def batch_invalidation():
+    # Collapses the per-row signals of a bulk write into one bump per user
+    if getattr(_local, 'batch', None) is not None:
+        yield
+        return
+    _local.batch = set()
+    try:
+        yield
+    finally:
+        user_ids, _local.batch = _local.batch, None
+        for user_id in user_ids:
+            transaction.on_commit(lambda user_id=user_id: _bump(user_id))
+
+
+def user_key(user_id, name):
+    return f"response-cache:{user_id}:{get_generation(user_id)}:{name}"
+
+
+def key_for(request, extra=''):
+    return user_key(request.user.id, hashlib.md5(f"{request.get_full_path()}|{extra}".encode()).hexdigest())
+
+
+def lookup(key):
+    data = _cache().get(key)
+    _count('misses' if data is None else 'hits')
+    return data
+
+
+def store(key, data):
+    _cache().set(key, data, timeout=CACHE_TIMEOUT)
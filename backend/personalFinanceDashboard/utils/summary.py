@@ -0,0 +1,156 @@
+import calendar
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from ..models import MonthlySummary, Transaction
+from . import rate_history
+
+# Dimensions the summary endpoint can group by, in output order
+SUMMARY_DIMENSIONS = ('month', 'category', 'type', 'currency')
+CENTS = Decimal('0.01')
+
+
+def parse_group_by(value):
+    # Comma separated subset of SUMMARY_DIMENSIONS, defaults to all of them
+    if not value:
+        return list(SUMMARY_DIMENSIONS)
+    group_by = [dim.strip() for dim in value.split(',') if dim.strip()]
+    invalid = [dim for dim in group_by if dim not in SUMMARY_DIMENSIONS]
+    if invalid:
+        raise ValueError(f"Invalid group_by value(s): {', '.join(invalid)}")
+    return [dim for dim in SUMMARY_DIMENSIONS if dim in group_by]
+
+
+def _summary_row(row, group_by):
+    summary_row = {dim: row[dim] for dim in group_by}
+    summary_row['total'] = row['total']
+    summary_row['count'] = row['count']
+    return summary_row
+
+
+def is_month_aligned(start, end):
+    # Ranges covering whole months can be answered from MonthlySummary alone
+    if start and start.day != 1:
+        return False
+    if end and end.day != calendar.monthrange(end.year, end.month)[1]:
+        return False
+    return True
+
+
+def summarize_transactions(user, start=None, end=None, group_by=SUMMARY_DIMENSIONS, currency=None):
+    """
+    Totals and counts of a user's transactions grouped in the database.
+    start and end are inclusive dates, either may be None for an open range.
+    With a currency every total is converted into it, see summarize_converted.
+    """
+    if currency:
+        return summarize_converted(user, start, end, group_by, currency)
+    if is_month_aligned(start, end):
+        return summarize_monthly(user, start, end, group_by)
+    transactions = Transaction.objects.filter(user=user).between(start, end)
+    if 'month' in group_by:
+        transactions = transactions.annotate(month=TruncMonth('date'))
+    rows = (
+        transactions.values(*group_by)
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by(*[F(dim).asc(nulls_last=True) for dim in group_by])
+    )
+    summary = []
+    for row in rows:
+        if 'month' in row:
+            row['month'] = row['month'].strftime('%Y-%m')
+        summary.append(_summary_row(row, group_by))
+    return summary
+
+
+def _monthly_summaries(user, start=None, end=None):
+    summaries = MonthlySummary.objects.filter(user=user)
+    if start:
+        summaries = summaries.filter(Q(year__gt=start.year) | Q(year=start.year, month__gte=start.month))
+    if end:
+        summaries = summaries.filter(Q(year__lt=end.year) | Q(year=end.year, month__lte=end.month))
+    return summaries
+
+
+def summarize_monthly(user, start=None, end=None, group_by=SUMMARY_DIMENSIONS):
+    # Same result as summarize_transactions, read from the O(months x categories) rollup table
+    summaries = _monthly_summaries(user, start, end)
+    fields = [dim for dim in group_by if dim != 'month']
+    if 'month' in group_by:
+        fields = ['year', 'month'] + fields
+    rows = (
+        summaries.values(*fields)
+        .annotate(total=Sum('total'), count=Sum('count'))
+        .order_by(*fields)
+    )
+    summary = []
+    for row in rows:
+        if 'month' in row:
+            row['month'] = date(row['year'], row['month'], 1).strftime('%Y-%m')
+        if 'category' in row:
+            row['category'] = row['category'] or None
+        summary.append(_summary_row(row, group_by))
+    # Uncategorized is stored as '', ordered last like the NULLs of summarize_transactions
+    return sorted(summary, key=lambda row: _sort_key(row[dim] for dim in group_by))
+
+
+def converted_rows(user, start=None, end=None, dims=(), **filters):
+    """
+    Rows of (dims..., month, currency, total, count) grouped by the database per currency and
+    day, each with the day's rate into the target currency still to apply: returns
+    (rows, currencies, dates). Always read from Transaction, even for month aligned ranges, so
+    every amount converts at the rate of its own day whatever the range.
+    filters apply to Transaction, e.g. type='Expense'.
+    """
+    dims = [dim for dim in dims if dim not in ('month', 'currency')]
+    rows = list(
+        Transaction.objects.filter(user=user, **filters).between(start, end)
+        .values(*dims, 'currency', 'date')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    for row in rows:
+        row['month'] = row['date'].strftime('%Y-%m')
+    return rows, [row['currency'] for row in rows], [row['date'] for row in rows]
+
+
+def conversion_rates(currencies, dates, currency):
+    # Decimal as-of rate of every converted_rows row into currency, one vectorized pass per source currency
+    return rate_history.rates_on(currencies, dates, currency)
+
+
+def _sort_key(key):
+    # Uncategorized (None) groups sort last, like the database's NULLS LAST
+    return tuple((value is None, value or '') for value in key)
+
+
+def summarize_converted(user, start=None, end=None, group_by=SUMMARY_DIMENSIONS, currency='USD'):
+    """
+    summarize_transactions with every total converted into currency inside the aggregation.
+    The database groups by currency and day, each group converts at its day's as-of rate and the
+    groups are summed again in Decimal, so the cost follows currencies x days rather than
+    transactions. Rows grouped by currency keep the source amount as original_total.
+    Raises RateUnavailable when a currency has no rates.
+    """
+    rows, currencies, dates = converted_rows(user, start, end, group_by)
+    rates = conversion_rates(currencies, dates, currency)
+    groups = {}
+    for row, rate in zip(rows, rates):
+        key = tuple(row[dim] for dim in group_by)
+        group = groups.setdefault(key, {'total': Decimal(0), 'count': 0, 'original_total': Decimal(0)})
+        group['total'] += row['total'] * rate
+        group['count'] += row['count']
+        group['original_total'] += row['total']
+    summary = []
+    for key in sorted(groups, key=_sort_key):
+        group = groups[key]
+        summary_row = dict(zip(group_by, key))
+        summary_row['total'] = group['total'].quantize(CENTS)
+        summary_row['count'] = group['count']
+        if 'currency' in group_by:
+            summary_row['original_total'] = group['original_total']
+        summary.append(summary_row)
+    return summary
@@ -0,0 +1,47 @@
+from ..models import PlaidItem
+from . import balances, exchange_rates, outbox, plaid_sync
+from .jobs import enqueue, task
+from .rate_history import PIVOT
+
+# Job types run by the worker, see utils.jobs. Arguments are JSON, so jobs take ids rather than instances.
+
+
+@task('plaid.sync_item')
+def sync_plaid_item(item_id):
+    item = PlaidItem.objects.select_related('user').filter(pk=item_id).first()
+    # Unlinked since it was queued
+    if item is not None:
+        plaid_sync.sync_item(item)
+
+
+@task('plaid.sync_all', max_attempts=1)
+def sync_all_plaid_items():
+    # Fans out one job per Item so they retry and spread over workers independently
+    for item_id in PlaidItem.objects.values_list('pk', flat=True).iterator():
+        enqueue_plaid_sync(item_id)
+
+
+def enqueue_plaid_sync(item_id, delay=None):
+    return enqueue('plaid.sync_item', {'item_id': item_id}, delay=delay, dedupe_key=f"plaid-sync:{item_id}")
+
+
+@task('plaid.refresh_balances')
+def refresh_plaid_balances(item_id):
+    item = PlaidItem.objects.filter(pk=item_id).first()
+    if item is not None:
+        balances.refresh(item)
+
+
+@task('exchange_rates.refresh', backoff=60)
+def refresh_exchange_rates(bases=None):
+    # Keeps the latest rates of each base warm, the provider is only asked once they are past the TTL
+    for base in bases or [PIVOT]:
+        exchange_rates.latest(base)
+
+
+# Emails queued while a sender runs queue the next one, this run may have claimed its last batch already
+@task('outbox.send', dedupe_while_running=False)
+def send_outbox():
+    # Emails that fail are retried by the outbox itself, the job only fails when the database does
+    outbox.send_pending()
+    outbox.prune()
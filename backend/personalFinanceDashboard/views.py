@@ -1,4 +1,4 @@
-from .models import Transaction, Investment, EmailVerification, UserSettings
+from .models import Transaction, Investment, EmailVerification, UserSettings, UserDataVersion, BudgetAlert
 from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta
@@ -8,20 +8,24 @@ from django.views.decorators.csrf import csrf_exempt
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
-from personalFinanceDashboard.serializers import TransactionSerializer, UserSerializer, UserSettingsSerializer
+from personalFinanceDashboard.serializers import TransactionSerializer, UserSerializer, UserSettingsSerializer, ForecastSerializer
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.core.mail import send_mail
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 import secrets
 from google.auth.transport.requests import Request
 from google.oauth2 import id_token
-from .decorator import check_authentication
+from .decorator import check_authentication, conditional_on_data_version, cache_per_user
+from .utils.pagination import paginate_keyset, get_page_size, InvalidCursor
+from .utils.summary import summarize_transactions, parse_group_by
+from .utils import monthly_summary, sync, response_cache, recurring, forecast, budget, exchange_rates, outbox
+from .utils.export import accepts_gzip, export_queryset, stream_export, EXPORT_FORMATS
+from django.db import transaction as db_transaction
+from django.utils.dateparse import parse_date
 import environ
 env = environ.Env()
 environ.Env.read_env()
-import requests
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -32,6 +36,8 @@ def authentication_status(request):
 
 @api_view(['GET','POST','DELETE','PATCH'])
 @permission_classes([IsAuthenticated])
+@conditional_on_data_version
+@cache_per_user
 def transactions(request,id=None):
     if id and request.method == 'PATCH':
         try:
@@ -49,25 +55,176 @@ def transactions(request,id=None):
             if request.query_params.get('month') and request.query_params.get('year'):
                 month = int(request.query_params.get('month'))
                 year = int(request.query_params.get('year'))
-                transactions = Transaction.objects.filter(user=request.user, date__month=month, date__year=year).order_by('date','name','category')
-            else:
-                transactions = Transaction.objects.filter(user=request.user).order_by('date','name','category')
+                transactions = Transaction.objects.filter(user=request.user).for_month(year, month).select_related('user').order_by('date','name','category')
+                serializer = TransactionSerializer(transactions, many=True)
+                return Response({'expenses': serializer.data})
+            # Full history is served one keyset page at a time
+            try:
+                transactions, next_cursor = paginate_keyset(
+                    Transaction.objects.filter(user=request.user).select_related('user'),
+                    cursor=request.query_params.get('cursor'),
+                    page_size=get_page_size(request.query_params.get('page_size')),
+                )
+            except InvalidCursor as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             serializer = TransactionSerializer(transactions, many=True)
-            return Response({'expenses': serializer.data})
+            return Response({'expenses': serializer.data, 'next': next_cursor})
         elif request.method == 'POST':
-            serializer = TransactionSerializer(data=request.data, many=isinstance(request.data,list), context={'request': request})
+            if isinstance(request.data, list):
+                # Bulk import, valid rows are inserted even when others are rejected
+                serializer = TransactionSerializer(data=request.data, many=True, context={'request': request})
+                errors = serializer.save_valid_rows()
+                if errors and not serializer.instance:
+                    return Response({'created': [], 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+                response_status = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+                return Response({'created': serializer.data, 'errors': errors}, status=response_status)
+            serializer = TransactionSerializer(data=request.data, context={'request': request})
             if serializer.is_valid():
                 serializer.save()
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        elif request.method == 'PATCH':
+            # Bulk edit, body is a list of {id, ...fields}
+            if not isinstance(request.data, list):
+                return Response({'error': 'Expected a list of changes.'}, status=status.HTTP_400_BAD_REQUEST)
+            serializer = TransactionSerializer(data=request.data, many=True, partial=True, context={'request': request})
+            errors = serializer.update_valid_rows()
+            if errors and not serializer.instance:
+                return Response({'updated': [], 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+            response_status = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_200_OK
+            return Response({'updated': serializer.data, 'errors': errors}, status=response_status)
         elif request.method == 'DELETE':          
             ids = request.data.get('ids', [])
             print(ids)
             if not isinstance(ids, list):
                 return Response({'error': 'Expected a list of IDs.'}, status=status.HTTP_400_BAD_REQUEST)
-            Transaction.objects.filter(id__in=ids).delete()
+            with response_cache.batch_invalidation(), db_transaction.atomic():
+                deleted = Transaction.objects.filter(id__in=ids, user=request.user)
+                monthly_summary.record_queryset_deleted(deleted)
+                sync.record_deleted(request.user, list(deleted.values_list('id', flat=True)))
+                deleted.delete()
+                UserDataVersion.bump(request.user.id)
             return Response({'Successfully deleted expense(s)'},status=status.HTTP_204_NO_CONTENT)
 
+def date_query_param(request, name):
+    # Optional YYYY-MM-DD query parameter, raises ValueError when malformed
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Invalid date for '{name}', expected YYYY-MM-DD.")
+    return parsed
+
+def display_currency(user):
+    # Currency totals are converted into, None while the user has not picked one
+    code = UserSettings.objects.filter(user=user).values_list('display_currency', flat=True).first()
+    return code.upper() if code else None
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@cache_per_user
+def transaction_summary(request):
+    # Aggregated totals over an optional inclusive date range, grouped in the database
+    try:
+        start = date_query_param(request, 'start')
+        end = date_query_param(request, 'end')
+        group_by = parse_group_by(request.query_params.get('group_by'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    currency = display_currency(request.user)
+    try:
+        summary = summarize_transactions(request.user, start=start, end=end, group_by=group_by, currency=currency)
+    except exchange_rates.RateUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({'start': start, 'end': end, 'group_by': group_by, 'currency': currency, 'summary': summary})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_on_data_version
+def transaction_occurrences(request):
+    # Recurring transactions expanded over [start, end], defaults to the current month
+    try:
+        start = date_query_param(request, 'start')
+        end = date_query_param(request, 'end')
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    today = timezone.localdate()
+    start = start or today.replace(day=1)
+    end = end or (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    if end < start:
+        return Response({'error': "'end' must not be before 'start'."}, status=status.HTTP_400_BAD_REQUEST)
+    if (end - start).days > recurring.MAX_WINDOW_DAYS:
+        return Response({'error': f"Window is limited to {recurring.MAX_WINDOW_DAYS} days."}, status=status.HTTP_400_BAD_REQUEST)
+    occurrences = recurring.get_occurrences(request.user, start, end)
+    return Response({'start': start, 'end': end, 'occurrences': occurrences})
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def cash_flow_forecast(request):
+    # GET projects the baseline from query parameters, POST takes a JSON body with several scenarios
+    serializer = ForecastSerializer(data=request.data if request.method == 'POST' else request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    params = serializer.validated_data
+    scenarios = params.get('scenarios') or [{'name': 'baseline'}]
+    try:
+        result = forecast.get_forecast(
+            request.user,
+            today=timezone.localdate(),
+            months=params['months'],
+            starting_balance=params['starting_balance'],
+            lookback_months=params['lookback_months'],
+            scenarios=[dict(scenario) for scenario in scenarios],
+            currency=display_currency(request.user),
+        )
+    except exchange_rates.RateUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(result)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def transaction_changes(request):
+    # Delta sync, without a token only a starting token is returned
+    token = request.query_params.get('since')
+    if not token:
+        return Response({'changed': [], 'deleted': [], 'token': sync.encode_token(timezone.now())})
+    try:
+        changed, deleted, next_token = sync.get_changes(request.user, token)
+    except sync.ExpiredToken as e:
+        return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+    except sync.InvalidToken as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = TransactionSerializer(changed, many=True)
+    return Response({'changed': serializer.data, 'deleted': deleted, 'token': next_token})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_transactions(request):
+    # Streams transactions as CSV or NDJSON, optionally gzip encoded
+    export_format = request.query_params.get('file_format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'error': f"Unsupported file_format, expected one of: {', '.join(EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start = date_query_param(request, 'start')
+        end = date_query_param(request, 'end')
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    compress = request.query_params.get('gzip') in ('1', 'true') and accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    queryset = export_queryset(request.user, start=start, end=end, category=request.query_params.get('category'))
+    response = StreamingHttpResponse(stream_export(queryset, export_format, compress), content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="transactions.{export_format}"'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def response_cache_stats(request):
+    # Hit/miss counters of this worker process
+    return Response(response_cache.stats())
+
 @api_view(['POST'])
 @csrf_exempt
 @permission_classes([AllowAny])
@@ -224,17 +381,17 @@ def reset_password_email(request):
     email = request.data.get('email')
     user = User.objects.get(email=email)
     code = secrets.token_hex(3).upper()
-    send_mail(
-        "Your authentication code",
-        f"Your verification code is: {code}",
-        "514090db0f-53a608@inbox.mailtrap.io",
-        [email],
-        False
-    )
-    verification_object, created = EmailVerification.objects.get_or_create(user=user)
-    verification_object.code = code
-    verification_object.save()
-    print(verification_object.code, verification_object.created_at)
+    with db_transaction.atomic():
+        verification_object, created = EmailVerification.objects.get_or_create(user=user)
+        verification_object.code = code
+        verification_object.save()
+        # Delivered by the background sender, a slow SMTP server no longer holds up the request
+        outbox.queue_email(
+            "Your authentication code",
+            f"Your verification code is: {code}",
+            [email],
+            from_email="514090db0f-53a608@inbox.mailtrap.io",
+        )
     return Response({'Email sent successfully to', email}, status=status.HTTP_200_OK)
 
 
@@ -279,6 +436,8 @@ def get_user(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_on_data_version
+@cache_per_user
 def get_user_settings(request):
     user = request.user
     user_settings, created = UserSettings.objects.get_or_create(user=user)
@@ -292,11 +451,19 @@ def update_budget_settings(request):
         user = request.user
         monthly_budget = request.data.get('monthly_budget')
         over_spending_threshold = request.data.get('over_spending_threshold')
+        category_budget_limits = request.data.get('category_budget_limits')
         user_settings = UserSettings.objects.get(user=user)
         if monthly_budget is not None:
             user_settings.monthly_budget = monthly_budget
-        #if category_budget_limits is not None:
-        #    user_settings.category_budget_limits = category_budget_limits
+        if category_budget_limits is not None:
+            # Merged into the existing limits, a null limit removes the category
+            limits = dict(user_settings.category_budget_limits or {})
+            for category, limit in budget.validate_category_limits(category_budget_limits).items():
+                if limit is None:
+                    limits.pop(category, None)
+                else:
+                    limits[category] = limit
+            user_settings.category_budget_limits = limits
         if over_spending_threshold is not None:
             user_settings.over_spending_threshold = over_spending_threshold
         user_settings.save()
@@ -304,6 +471,35 @@ def update_budget_settings(request):
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     return Response({'message': 'Monthly budget updated successfully.'}, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def budget_progress(request):
+    # Spending against the monthly budget and every category limit over the dashboard range
+    user_settings, created = UserSettings.objects.select_related('user').get_or_create(user=request.user)
+    try:
+        return Response(budget.get_progress(user_settings, timezone.localdate()))
+    except exchange_rates.RateUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_budget_alerts(request):
+    # Latest budget threshold crossings recorded at write time
+    alerts = BudgetAlert.objects.filter(user=request.user).order_by('-created_at')[:50]
+    return Response([
+        {
+            'year': alert.year,
+            'month': alert.month,
+            'category': alert.category or None,
+            'level': alert.level,
+            'spent': alert.spent,
+            'limit': alert.limit,
+            'created_at': alert.created_at,
+            'sent_at': alert.sent_at,
+        }
+        for alert in alerts
+    ])
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_display_settings(request):
@@ -336,10 +532,14 @@ def update_display_settings(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_currency_exchange(request, from_currency):
-    key = env('EXCHANGE_RATE_API_KEY')
-    url = f'https://v6.exchangerate-api.com/v6/{key}/latest/{from_currency}'
-    response = requests.get(url)
-    print(response)
-    if response.status_code == 200:
-        return JsonResponse({'rate': response.json()}, status=200)
-    return JsonResponse({'error': 'Currency not found'}, status=400)
+    try:
+        snapshot = exchange_rates.latest(from_currency)
+    except exchange_rates.RateUnavailable:
+        return JsonResponse({'error': 'Currency not found'}, status=400)
+    # Same shape as the exchangerate-api payload this endpoint used to pass through
+    return JsonResponse({'rate': {
+        'result': 'success',
+        'base_code': snapshot['base'],
+        'time_last_update_unix': int(snapshot['fetched_at']),
+        'conversion_rates': {quote: float(rate) for quote, rate in snapshot['rates'].items()},
+    }}, status=200)
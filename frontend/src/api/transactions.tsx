@@ -1,5 +1,5 @@
 import axios, { AxiosInstance } from "axios";
-import { TransactionInterface } from "@/interfaces/Transactions";
+import { BulkCreateResponse, TransactionInterface } from "@/interfaces/Transactions";
 
 axios.defaults.withCredentials = true;
 
@@ -10,8 +10,17 @@ const api: AxiosInstance = axios.create({
 
 export const getTransactions = async (): Promise<TransactionInterface[]> => {
   try {
-    const response = await api.get("/transactions/");
-    return response.data.expenses;
+    // The full list is paginated, follow the cursor until the last page
+    const transactions: TransactionInterface[] = [];
+    let cursor: string | null = null;
+    do {
+      const response = await api.get("/transactions/", {
+        params: cursor ? { cursor } : {},
+      });
+      transactions.push(...response.data.expenses);
+      cursor = response.data.next;
+    } while (cursor);
+    return transactions;
   } catch (error) {
     console.error(error);
     throw error;
@@ -33,9 +42,19 @@ export const getTransactionsByMonth = async (
   }
 };
 
-export const addTransactions = async (
+// A single transaction is returned as created, a list as the rows created and the rows rejected
+export async function addTransactions(
+  newTransaction: TransactionInterface,
+): Promise<TransactionInterface>;
+export async function addTransactions(
+  newTransaction: TransactionInterface[],
+): Promise<BulkCreateResponse>;
+export async function addTransactions(
+  newTransaction: TransactionInterface | TransactionInterface[],
+): Promise<TransactionInterface | BulkCreateResponse>;
+export async function addTransactions(
   newTransaction: TransactionInterface | TransactionInterface[],
-): Promise<TransactionInterface | TransactionInterface[]> => {
+): Promise<TransactionInterface | BulkCreateResponse> {
   try {
     const response = await api.post(
       "/transactions/",
@@ -46,7 +65,7 @@ export const addTransactions = async (
         },
       },
     );
-    return response.data as TransactionInterface | TransactionInterface[];
+    return response.data as TransactionInterface | BulkCreateResponse;
   } catch (error: any) {
     if (error.response) {
       console.log("Error response:", error.response.data);
@@ -55,7 +74,7 @@ export const addTransactions = async (
     }
     throw error;
   }
-};
+}
 
 export const deleteTransactions = async (ids: number[]) => {
   try {
@@ -50,7 +50,11 @@ export const TransactionProvider = ({ children }: { children: ReactNode }) => {
     useMutation({
       mutationFn: (newTransaction: TransactionInterface | TransactionInterface[]) =>
         addTransactions(newTransaction),
-      onSuccess: () => {
+      onSuccess: (result) => {
+        // A list is created row by row, rejected rows come back with their index (207)
+        if ("errors" in result && result.errors.length) {
+          console.error("Some transactions were not added:", result.errors);
+        }
         queryClient.invalidateQueries({ queryKey: ["transactions"] });
         queryClient.invalidateQueries({ queryKey: ['monthlyTransactions'] });
       },
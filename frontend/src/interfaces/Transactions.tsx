@@ -11,3 +11,14 @@ export interface TransactionInterface {
   notes?: string | null;
   updated_at: string;
 }
+
+export interface TransactionRowError {
+  index: number;
+  errors: Record<string, string[]>;
+}
+
+// Response of a list POST: 201 when every row was created, 207 when some were rejected
+export interface BulkCreateResponse {
+  created: TransactionInterface[];
+  errors: TransactionRowError[];
+}